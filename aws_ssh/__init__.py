@@ -1,14 +1,12 @@
 """The AWS ssh script"""
 
-import logging.config
-
 __author__ = 'Aru Sahni'
 __version__ = '0.0.2'
 __licence__ = 'MIT'
 
 APP_NAME = 'aws-ssh'
 
-logging.config.dictConfig({
+LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
     'formatters': {
@@ -40,4 +38,9 @@ logging.config.dictConfig({
             'propagate': False,
         }
     },
-})
+}
+
+def configure_logging():
+    """Configure logging for the command line interface"""
+    import logging.config
+    logging.config.dictConfig(LOGGING)
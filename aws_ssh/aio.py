@@ -0,0 +1,179 @@
+"""Asyncio interface, for resolving instances from within an event loop (Python 3.5+)
+
+Lookups block on the AWS API and the local caches, so they run in a small, bounded thread pool shared by every
+caller. Usernames that can't be inferred are probed by ssh subprocesses driven by the event loop itself, so
+resolving hundreds of instances at once doesn't take a thread per instance.
+
+    instance = await project.aget_instance('web')
+    instances = await project.aresolve_many(['web', 'data'])
+
+"""
+
+import asyncio
+from collections import OrderedDict
+import functools
+import logging
+import tempfile
+import threading
+
+from aws_ssh.errors import NoAddressError, UsernameNotFoundError
+from aws_ssh.probe import AUTH_FAILED, PROBE_TIMEOUT, check_failure, classify, describe, get_ssh_version
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_WORKERS = 8 # Blocking lookups in flight at once. The shared rate limit paces their API calls.
+DEFAULT_MAX_PROBING = 32 # Instances whose usernames are probed at once, each with a process per candidate
+
+_EXECUTOR_LOCK = threading.Lock()
+_EXECUTOR = None
+
+def get_executor():
+    """Get the thread pool shared by every lookup that doesn't bring its own
+
+    :returns: The executor
+
+    """
+    global _EXECUTOR # pylint: disable=global-statement
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is None:
+            from concurrent.futures import ThreadPoolExecutor
+            _EXECUTOR = ThreadPoolExecutor(max_workers=DEFAULT_MAX_WORKERS)
+        return _EXECUTOR
+
+async def run_blocking(function, *args, executor=None, **kwargs):
+    """Call a blocking function in a thread pool
+
+    :param function: The function
+    :param executor: The thread pool, defaulting to the shared one
+    :returns: The function's result
+
+    """
+    call = functools.partial(function, *args, **kwargs)
+    return await asyncio.get_event_loop().run_in_executor(executor or get_executor(), call)
+
+async def get_instance(project, instance_name, refresh=False, executor=None):
+    """Get an instance of a project, as `Project.get_instance` does
+
+    :param project: The project
+    :param instance_name: The prefix-less instance name
+    :param refresh: Bypass the instance and miss caches
+    :param executor: The thread pool for the lookup, defaulting to the shared one
+    :returns: The instance
+
+    """
+    return await run_blocking(project.get_instance, instance_name, refresh=refresh, executor=executor)
+
+async def resolve_many(project, instance_names, refresh=False, usernames=True, executor=None,
+                       max_probing=DEFAULT_MAX_PROBING):
+    """Resolve several instances of a project concurrently
+
+    The instances are looked up as `Project.lookup_instances` does: cached instances are served without
+    contacting AWS, and the rest are found with one sweep of the fleet.
+
+    :param project: The project
+    :param instance_names: The prefix-less instance names
+    :param refresh: Bypass the instance and miss caches
+    :param usernames: Also determine each instance's username (see `get_user_name`)
+    :param executor: The thread pool for blocking lookups, defaulting to the shared one
+    :param max_probing: The maximum number of instances whose usernames are probed at once
+    :returns: An ordered dict mapping each name to its instance, or to the exception raised when resolving it
+
+    """
+    instance_names = list(OrderedDict.fromkeys(instance_names))
+    results = await run_blocking(project.lookup_instances, instance_names, refresh=refresh, executor=executor)
+    if not usernames:
+        return results
+    semaphore = asyncio.Semaphore(max_probing)
+
+    async def discover(instance_name, instance):
+        async with semaphore:
+            try:
+                await get_user_name(instance, executor=executor)
+            except (NoAddressError, UsernameNotFoundError) as exc:
+                results[instance_name] = exc
+
+    await asyncio.gather(*[discover(instance_name, result) for instance_name, result in results.items()
+                           if not isinstance(result, Exception)])
+    return results
+
+async def probe_username(instance, username, timeout=PROBE_TIMEOUT):
+    """Attempt to log in to an instance, as `Instance.get_user_name` does, in an ssh subprocess
+
+    :param instance: The instance, whose route has already been chosen
+    :param username: The username to test
+    :param timeout: The number of seconds to wait for the connection
+    :returns: The kind of failure (see `aws_ssh.probe`), or `None` if the username authenticated, and the gist
+              of ssh's error output
+
+    """
+    logger.debug('Trying username: %s', username)
+    with tempfile.TemporaryFile() as errors: # Rather than a pipe, which a backgrounded master could hold open
+        process = await asyncio.create_subprocess_exec(*instance.get_probe_args(username, timeout=timeout),
+                                                       stdin=asyncio.subprocess.DEVNULL,
+                                                       stdout=asyncio.subprocess.DEVNULL, stderr=errors)
+        try:
+            returncode = await asyncio.wait_for(process.wait(), timeout * 2)
+        except asyncio.TimeoutError:
+            logger.debug('Probe timed out for username: %s', username)
+            return AUTH_FAILED, 'Timed out'
+        finally:
+            if process.returncode is None: # Timed out, or lost the race to another username
+                process.kill()
+                await process.wait()
+        errors.seek(0)
+        stderr = errors.read().decode('utf-8', 'replace')
+    return classify(returncode, stderr), describe(stderr)
+
+async def probe_user_names(instance, candidates, timeout=PROBE_TIMEOUT):
+    """Probe candidate usernames concurrently, as `Instance.get_user_name` does
+
+    :param instance: The instance, whose route has already been chosen
+    :param candidates: The usernames to try
+    :param timeout: The number of seconds to wait for each probe's connection
+    :returns: The username which authenticated, or `None` if none did
+
+    """
+    async def attempt(candidate):
+        return candidate, await probe_username(instance, candidate, timeout=timeout)
+
+    probes = [asyncio.ensure_future(attempt(candidate)) for candidate in candidates]
+    try:
+        for probe in asyncio.as_completed(probes):
+            candidate, (failure, message) = await probe
+            if failure is None:
+                return candidate
+            logger.debug('Probe failed (%s) for username %s: %s', failure, candidate, message)
+            check_failure(instance.name, failure, message) # Every other username would fail the same way
+    finally:
+        for probe in probes:
+            probe.cancel()
+        await asyncio.gather(*probes, return_exceptions=True)
+    return None
+
+async def get_user_name(instance, executor=None, timeout=PROBE_TIMEOUT):
+    """Determine the username of an instance, as `Instance.get_user_name` does
+
+    :param instance: The instance
+    :param executor: The thread pool for blocking lookups, defaulting to the shared one
+    :param timeout: The number of seconds to wait for each probe's connection
+    :returns: The username, raises `UsernameNotFoundError` (or its `HostUnreachableError` and `HostKeyError`
+              subclasses) otherwise
+    :raises NoAddressError: If the instance has no address to probe
+
+    """
+    if instance.username:
+        return instance.username
+    await run_blocking(instance.check_address, executor=executor) # Choosing a route may test connections
+    await run_blocking(get_ssh_version, executor=executor) # Detected once, choosing the probes' options
+    candidates = instance._project._usernames # pylint: disable=protected-access
+    inferred = await run_blocking(instance.infer_user_name, executor=executor)
+    if inferred is not None:
+        if await probe_user_names(instance, [inferred], timeout=timeout) == inferred:
+            await run_blocking(instance.set_user_name, inferred, inferred=True, executor=executor)
+            return inferred
+        candidates = [username for username in candidates if username != inferred]
+    username = await probe_user_names(instance, candidates, timeout=timeout) if candidates else None
+    if username is None:
+        raise UsernameNotFoundError()
+    await run_blocking(instance.set_user_name, username, executor=executor)
+    return username
@@ -1,35 +1,308 @@
-"""Interface with AWS"""
+"""Interface with AWS
 
-import boto3
+Boto3 is only imported once an API call is made, so that answers served from local caches never pay for it.
 
-from aws_ssh.errors import NoInstanceFoundError, TooManyInstancesError
+"""
 
-def get_session(profile_name):
-    """Get the boto session
+import logging
+import threading
+import time
+
+from six.moves import queue
+
+from aws_ssh import timing
+from aws_ssh.cache import TARGET_FIELD
+from aws_ssh.errors import InstanceNotRunningError, NoInstanceFoundError, TooManyInstancesError
+from aws_ssh.ratelimit import TokenBucket, get_limits
+
+logger = logging.getLogger(__name__)
+
+# Instance states worth resolving. Terminated instances linger in API responses for a while, and would
+# otherwise be mistaken for duplicates of their replacements.
+LIVE_STATES = ('pending', 'running', 'stopping', 'stopped')
+STATE_FILTER = {'Name': 'instance-state-name', 'Values': list(LIVE_STATES)}
+
+# Throttled requests are retried with botocore's adaptive mode, which also slows the client's own request rate
+# once EC2 starts throttling
+RETRY_CONFIG = {'mode': 'adaptive', 'max_attempts': 10}
+
+INITIAL_POLL_DELAY = 0.5 # Seconds between the first state checks, doubling thereafter
+MAX_POLL_DELAY = 5 # Seconds
+
+# Sessions and clients are pooled per process, as creating a client loads the (large) botocore service model.
+# Boto3 sessions are not thread-safe, so they are only used while holding the pool lock. Clients are.
+_POOL_LOCK = threading.RLock()
+_SESSIONS = {}
+_CLIENTS = {}
+_RATE_LIMITER = None
+
+def get_session(profile_name, region_name=None):
+    """Get the boto session, reusing any previously created for the same profile and region
 
     :param profile_name: The profile name associated with the AWS creds
+    :param region_name: The AWS region, or `None` for the profile default
     :returns: The Boto3 session object
 
     """
-    return boto3.session.Session(profile_name=profile_name)
+    with timing.span('aws.import'):
+        import boto3 # Deferred, as importing boto3 dominates the CLI start-up time
+    key = (profile_name, region_name)
+    with _POOL_LOCK:
+        if key not in _SESSIONS:
+            with timing.span('aws.session'):
+                if region_name:
+                    _SESSIONS[key] = boto3.session.Session(profile_name=profile_name, region_name=region_name)
+                else:
+                    _SESSIONS[key] = boto3.session.Session(profile_name=profile_name)
+        return _SESSIONS[key]
+
+def get_client(profile_name, service_name='ec2', region_name=None):
+    """Get a boto client, reusing any previously created for the same profile, region, and service
+
+    :param profile_name: The profile name associated with the AWS creds
+    :param service_name: The AWS service
+    :param region_name: The AWS region, or `None` for the profile default
+    :returns: The Boto3 client, which may be shared between threads
+
+    """
+    key = (profile_name, region_name, service_name)
+    with _POOL_LOCK:
+        if key not in _CLIENTS:
+            from botocore.config import Config
+            with timing.span('aws.client'):
+                client = get_session(profile_name, region_name).client(service_name,
+                                                                       config=Config(retries=RETRY_CONFIG))
+            client.meta.events.register('before-call', _throttle)
+            _CLIENTS[key] = client
+        return _CLIENTS[key]
+
+def get_rate_limiter():
+    """Get the rate limit shared by every API request made on this machine
+
+    :returns: The token bucket, at the pace currently configured (see `aws_ssh.ratelimit.get_limits`)
+
+    """
+    global _RATE_LIMITER # pylint: disable=global-statement
+    rate, burst = get_limits()
+    with _POOL_LOCK:
+        if _RATE_LIMITER is None or (_RATE_LIMITER.rate, _RATE_LIMITER.burst) != (rate, burst):
+            _RATE_LIMITER = TokenBucket(rate=rate, burst=burst)
+        return _RATE_LIMITER
+
+def _throttle(**kwargs): # pylint: disable=unused-argument
+    with timing.span('aws.throttle'):
+        get_rate_limiter().acquire()
+
+def reset_pool():
+    """Discard all pooled sessions and clients"""
+    with _POOL_LOCK:
+        _SESSIONS.clear()
+        _CLIENTS.clear()
 
-def get_instance_info(profile_name, prefix, name):
+@timing.timed('aws.get_instance_info')
+def get_instance_info(profile_name, prefix, name, region_name=None):
     """Get the API info for an EC2 instance
 
     :param profile_name: The profile name associated with the AWS creds
     :param prefix: The name prefix shared by all EC2 instances
     :param name: The prefix-less instance name
+    :param region_name: The AWS region, or `None` for the profile default
     :returns: The corresponding instance, otherwise an exception
 
     """
-    session = get_session(profile_name)
-    client = session.client('ec2')
+    client = get_client(profile_name, region_name=region_name)
     response = client.describe_instances(Filters=[
-        {'Name': 'tag:Name', 'Values': ['{}{}'.format(prefix, name)]}
+        {'Name': 'tag:Name', 'Values': ['{}{}'.format(prefix, name)]},
+        STATE_FILTER,
         ])
-    if len(response['Reservations']) == 0:
+    instances = [instance for reservation in response['Reservations']
+                 for instance in reservation['Instances']]
+    if not instances:
         raise NoInstanceFoundError()
-    instances = response['Reservations'][0]['Instances']
-    if len(instances) > 1:
+    if len(instances) > 1: # Whether launched together, or in separate reservations
         raise TooManyInstancesError()
     return instances[0]
+
+def get_instance_name(instance):
+    """Get the value of an instance's `Name` tag
+
+    :param instance: The API info for an EC2 instance
+    :returns: The instance name, or `None` if it is untagged
+
+    """
+    for tag in instance.get('Tags', []):
+        if tag['Key'] == 'Name':
+            return tag['Value']
+    return None
+
+@timing.timed('aws.get_fleet')
+def get_fleet(profile_name, prefix, region_name=None):
+    """Get the API info for every EC2 instance sharing a name prefix, in one paginated sweep
+
+    :param profile_name: The profile name associated with the AWS creds
+    :param prefix: The name prefix shared by all EC2 instances
+    :param region_name: The AWS region, or `None` for the profile default
+    :returns: A dict mapping each prefix-less instance name to the list of matching instances
+
+    """
+    paginator = get_client(profile_name, region_name=region_name).get_paginator('describe_instances')
+    fleet = {}
+    filters = [{'Name': 'tag:Name', 'Values': ['{}*'.format(prefix)]}, STATE_FILTER]
+    for page in paginator.paginate(Filters=filters):
+        for reservation in page['Reservations']:
+            for instance in reservation['Instances']:
+                name = get_instance_name(instance)
+                if name is None or not name.startswith(prefix):
+                    continue
+                fleet.setdefault(name[len(prefix):], []).append(instance)
+    return fleet
+
+def _sweep(target, prefix, latencies):
+    started = time.time()
+    try:
+        fleet = get_fleet(target[0], prefix, region_name=target[1])
+    finally:
+        latencies[target] = time.time() - started
+        logger.debug('Swept %s in %.3fs', target, latencies[target])
+    for instances in fleet.values():
+        for instance in instances:
+            instance[TARGET_FIELD] = list(target)
+    return fleet
+
+def get_fleets(targets, prefix, latencies=None):
+    """Get the API info for every EC2 instance sharing a name prefix across several profiles and regions
+
+    The targets are swept concurrently, so the overall latency is that of the slowest target, rather than the
+    sum. Targets that fail are skipped, unless all of them do.
+
+    :param targets: The (profile name, region name) pairs to sweep, where a region of `None` is the profile
+                    default
+    :param prefix: The name prefix shared by all EC2 instances
+    :param latencies: A dict in which to record the number of seconds each target's sweep took
+    :returns: A dict mapping each prefix-less instance name to the list of matching instances, across targets
+
+    """
+    latencies = {} if latencies is None else latencies
+    if len(targets) == 1:
+        return _sweep(targets[0], prefix, latencies)
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+        futures = [(target, executor.submit(_sweep, target, prefix, latencies)) for target in targets]
+    fleet = {}
+    errors = []
+    for target, future in futures:
+        exc = future.exception()
+        if exc is not None:
+            logger.warning('Unable to list instances in %s: %s', target, exc)
+            errors.append(exc)
+            continue
+        for name, instances in future.result().items():
+            fleet.setdefault(name, []).extend(instances)
+    if len(errors) == len(targets):
+        raise errors[0]
+    return fleet
+
+@timing.timed('aws.find_instance')
+def find_instance(targets, prefix, name, latencies=None):
+    """Find an EC2 instance in whichever of several profiles and regions first reports it
+
+    The targets are queried concurrently, and the first match is returned without waiting for the others.
+
+    :param targets: The (profile name, region name) pairs to query, where a region of `None` is the profile
+                    default
+    :param prefix: The name prefix shared by all EC2 instances
+    :param name: The prefix-less instance name
+    :param latencies: A dict in which to record the number of seconds each target's lookup took
+    :returns: The instance's API info, otherwise an exception
+
+    """
+    latencies = {} if latencies is None else latencies
+    results = queue.Queue()
+
+    def lookup(target):
+        started = time.time()
+        try:
+            instance = get_instance_info(target[0], prefix, name, region_name=target[1])
+            instance[TARGET_FIELD] = list(target)
+            results.put((instance, None))
+        except Exception as exc: # pylint: disable=broad-except
+            results.put((None, exc))
+        finally:
+            latencies[target] = time.time() - started
+            logger.debug('Queried %s in %.3fs', target, latencies[target])
+
+    for target in targets:
+        thread = threading.Thread(target=lookup, args=(target,), name='find-{}'.format(name))
+        thread.daemon = True # Stragglers must not delay exit once a match is found
+        thread.start()
+    error = None
+    for _ in targets:
+        instance, exc = results.get()
+        if exc is None:
+            return instance
+        if isinstance(exc, TooManyInstancesError):
+            raise TooManyInstancesError(name)
+        if not isinstance(exc, NoInstanceFoundError):
+            error = exc
+    if error is not None:
+        raise error
+    raise NoInstanceFoundError(name)
+
+@timing.timed('aws.start_instance')
+def start_instance(profile_name, instance_id, region_name=None):
+    """Start a stopped EC2 instance
+
+    :param profile_name: The profile name associated with the AWS creds
+    :param instance_id: The instance ID
+    :param region_name: The AWS region, or `None` for the profile default
+
+    """
+    get_client(profile_name, region_name=region_name).start_instances(InstanceIds=[instance_id])
+
+@timing.timed('aws.wait_for_state')
+def wait_for_state(profile_name, instance_id, states, region_name=None, timeout=300):
+    """Wait for an EC2 instance to reach one of the given states, backing off exponentially between checks
+
+    :param profile_name: The profile name associated with the AWS creds
+    :param instance_id: The instance ID
+    :param states: The acceptable instance state names
+    :param region_name: The AWS region, or `None` for the profile default
+    :param timeout: The number of seconds to wait
+    :returns: The instance's API info, once it has reached one of the states
+
+    """
+    client = get_client(profile_name, region_name=region_name)
+    deadline = time.time() + timeout
+    delay = INITIAL_POLL_DELAY
+    while True:
+        instance = client.describe_instances(InstanceIds=[instance_id])['Reservations'][0]['Instances'][0]
+        state = instance['State']['Name']
+        if state in states:
+            return instance
+        logger.debug('%s is %s. Waiting for %s...', instance_id, state, '/'.join(states))
+        if time.time() + delay > deadline:
+            raise InstanceNotRunningError('{} is still {} after {} seconds'.format(instance_id, state,
+                                                                                  timeout))
+        time.sleep(delay)
+        delay = min(delay * 2, MAX_POLL_DELAY)
+
+@timing.timed('aws.get_image_info')
+def get_image_info(profile_name, image_id, region_name=None):
+    """Get the API info for an AMI
+
+    :param profile_name: The profile name associated with the AWS creds
+    :param image_id: The AMI ID
+    :param region_name: The AWS region, or `None` for the profile default
+    :returns: The corresponding image, or `None` if it is unavailable (e.g., deregistered or not shared)
+
+    """
+    from botocore.exceptions import BotoCoreError, ClientError
+    client = get_client(profile_name, region_name=region_name)
+    try:
+        response = client.describe_images(ImageIds=[image_id])
+    except (BotoCoreError, ClientError) as exc:
+        logger.debug('Unable to describe image %s: %s', image_id, exc)
+        return None
+    if len(response['Images']) == 0:
+        return None
+    return response['Images'][0]
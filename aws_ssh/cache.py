@@ -0,0 +1,447 @@
+"""On-disk caches"""
+
+from contextlib import contextmanager
+import errno
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import os.path
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = '~/.aws-ssh/cache'
+DEFAULT_CACHE_TTL = 3600 # Seconds
+DEFAULT_MISS_TTL = 30 # Seconds for which missing or ambiguous instance names are remembered
+SHARD_DIGITS = 2 # Hex digits of a name's hash selecting its instance cache shard, i.e., 256 shards per fleet
+
+# Added to the API info of instances found via `aws.get_fleets` or `aws.find_instance`, holding the
+# [profile, region] target in which the instance lives
+TARGET_FIELD = 'AwsSshTarget'
+
+# The subset of the `describe_instances` response needed to connect to an instance
+CACHED_FIELDS = ('InstanceId', 'PublicIpAddress', 'PrivateIpAddress', 'Ipv6Address', 'State', 'ImageId',
+                 'PlatformDetails', 'InstanceType', 'LaunchTime', TARGET_FIELD)
+
+# The subset of the `describe_images` response needed to infer an image's username
+CACHED_IMAGE_FIELDS = ('ImageId', 'Name', 'Description', 'PlatformDetails')
+
+def make_dirs(directory):
+    """Create a directory and its parents, tolerating concurrent creation by another process
+
+    :param directory: The directory to create
+
+    """
+    try:
+        os.makedirs(directory)
+    except OSError:
+        if not os.path.isdir(directory):
+            raise
+
+@contextmanager
+def locked(path, required=True, on_wait=None):
+    """Hold an exclusive lock on a file, shared with other processes, e.g., for the duration of a
+    read-modify-write
+
+    :param path: The lock file, created (along with its directory) if necessary
+    :param required: Whether to raise if the lock file can't be opened, rather than proceeding unlocked
+    :param on_wait: Called before waiting, if another process holds the lock
+
+    """
+    try:
+        make_dirs(os.path.dirname(path))
+        lockfile = open(path, 'a')
+    except (IOError, OSError) as exc:
+        if required:
+            raise
+        logger.debug('Unable to open the lock file %s: %s', path, exc)
+        yield
+        return
+    with lockfile:
+        try:
+            fcntl.flock(lockfile, fcntl.LOCK_EX | (fcntl.LOCK_NB if on_wait else 0))
+        except (IOError, OSError) as exc:
+            if exc.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+            on_wait()
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+def write_file(path, content, mode=None):
+    """Atomically write a file, so that concurrent readers never see a partial file
+
+    :param path: The destination file
+    :param content: The text to write
+    :param mode: The file's permissions, defaulting to owner read/write only
+
+    """
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        make_dirs(directory)
+    handle, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(handle, 'w') as outfile:
+            outfile.write(content)
+        if mode is not None:
+            os.chmod(temp_path, mode)
+        os.rename(temp_path, path)
+    except Exception:
+        os.remove(temp_path)
+        raise
+
+def write_json(path, data):
+    """Atomically write JSON to disk
+
+    :param path: The destination file
+    :param data: The JSON-serializable data
+
+    """
+    write_file(path, json.dumps(data, default=str))
+
+def read_json(path):
+    """Read JSON from disk
+
+    :param path: The source file
+    :returns: The deserialized data, or `None` if the file is missing or corrupt
+
+    """
+    try:
+        with open(path) as jsonfile:
+            return json.load(jsonfile)
+    except (IOError, OSError, ValueError):
+        return None
+
+def trim_resource(resource):
+    """Get the subset of an instance's API info that is cached
+
+    :param resource: The instance's API info
+    :returns: The cached fields
+
+    """
+    return {field: resource[field] for field in CACHED_FIELDS if field in resource}
+
+def get_fleet_digest(profile_name, region_name, prefix):
+    """Get a short, filename-safe key for a project fleet
+
+    :param profile_name: The profile name associated with the AWS creds
+    :param region_name: The AWS region, or `None` for the profile default
+    :param prefix: The name prefix shared by all EC2 instances
+    :returns: The key
+
+    """
+    key = '\0'.join((profile_name or '', region_name or '', prefix or ''))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+def get_shard(name):
+    """Get the shard of a fleet's instance cache holding an instance
+
+    :param name: The prefix-less instance name
+    :returns: The shard, as a hex string
+
+    """
+    return hashlib.sha1(name.encode('utf-8')).hexdigest()[:SHARD_DIGITS]
+
+class InstanceCache(object):
+    """Resolved instance details, persisted between invocations.
+
+    Each (profile, region, prefix) fleet is stored twice: as a snapshot of the entire fleet, for listing it
+    (e.g., in the picker), and split by name into up to 256 shards, so that looking up one instance reads a
+    small file however large the fleet.
+
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, ttl=DEFAULT_CACHE_TTL):
+        """Initialize the cache
+
+        :param directory: The directory in which cache files are stored
+        :param ttl: The number of seconds for which an entry is valid
+
+        """
+        self.directory = os.path.expanduser(directory)
+        self.ttl = ttl
+
+    def _path(self, profile_name, region_name, prefix):
+        digest = get_fleet_digest(profile_name, region_name, prefix)
+        return os.path.join(self.directory, 'instances', '{}.json'.format(digest))
+
+    def _shard_dir(self, profile_name, region_name, prefix):
+        return os.path.join(self.directory, 'instances', get_fleet_digest(profile_name, region_name, prefix))
+
+    def _read(self, profile_name, region_name, prefix):
+        return read_json(self._path(profile_name, region_name, prefix)) or {}
+
+    def _write(self, profile_name, region_name, prefix, entries, names=None):
+        """Write the fleet snapshot, and the shards holding the given names (or every shard)"""
+        shards = {}
+        for name, entry in entries.items():
+            shards.setdefault(get_shard(name), {})[name] = entry
+        directory = self._shard_dir(profile_name, region_name, prefix)
+        try:
+            write_json(self._path(profile_name, region_name, prefix), entries)
+            if names is None:
+                stale = set(os.listdir(directory)) if os.path.isdir(directory) else set()
+                stale.difference_update('{}.json'.format(shard) for shard in shards)
+                for filename in stale:
+                    if filename.endswith('.json'):
+                        os.remove(os.path.join(directory, filename))
+                names = entries
+            for shard in set(get_shard(name) for name in names):
+                path = os.path.join(directory, '{}.json'.format(shard))
+                if shard in shards:
+                    write_json(path, shards[shard])
+                elif os.path.exists(path):
+                    os.remove(path)
+        except (IOError, OSError) as exc:
+            logger.warning('Unable to write the instance cache: %s', exc)
+
+    def get(self, profile_name, region_name, prefix, name):
+        """Get a cached instance, reading only its shard
+
+        :param profile_name: The profile name associated with the AWS creds
+        :param region_name: The AWS region, or `None` for the profile default
+        :param prefix: The name prefix shared by all EC2 instances
+        :param name: The prefix-less instance name
+        :returns: The cached subset of the instance's API info, or `None` if absent or expired
+
+        """
+        if self.ttl <= 0:
+            return None
+        directory = self._shard_dir(profile_name, region_name, prefix)
+        entry = (read_json(os.path.join(directory, '{}.json'.format(get_shard(name)))) or {}).get(name)
+        if entry is None:
+            return None
+        if time.time() - entry.get('cached_at', 0) > self.ttl:
+            logger.debug('Cache entry for "%s" has expired', name)
+            return None
+        return entry
+
+    def get_all(self, profile_name, region_name, prefix):
+        """Get every cached instance sharing a name prefix, however stale
+
+        :param profile_name: The profile name associated with the AWS creds
+        :param region_name: The AWS region, or `None` for the profile default
+        :param prefix: The name prefix shared by all EC2 instances
+        :returns: A dict mapping prefix-less instance names to their cached API info, and whether any have
+                  expired
+
+        """
+        entries = self._read(profile_name, region_name, prefix)
+        now = time.time()
+        stale = not entries or any(now - entry.get('cached_at', 0) > self.ttl for entry in entries.values())
+        return entries, stale
+
+    def set(self, profile_name, region_name, prefix, name, resource):
+        """Cache an instance
+
+        :param profile_name: The profile name associated with the AWS creds
+        :param region_name: The AWS region, or `None` for the profile default
+        :param prefix: The name prefix shared by all EC2 instances
+        :param name: The prefix-less instance name
+        :param resource: The instance's API info
+
+        """
+        self.update(profile_name, region_name, prefix, {name: resource})
+
+    def update(self, profile_name, region_name, prefix, resources, replace=False):
+        """Cache several instances at once
+
+        :param profile_name: The profile name associated with the AWS creds
+        :param region_name: The AWS region, or `None` for the profile default
+        :param prefix: The name prefix shared by all EC2 instances
+        :param resources: A dict mapping prefix-less instance names to their API info
+        :param replace: Discard any other cached instances (e.g., as the resources are the complete fleet)
+
+        """
+        entries = {} if replace else self._read(profile_name, region_name, prefix)
+        cached_at = time.time()
+        for name, resource in resources.items():
+            entry = trim_resource(resource)
+            entry['cached_at'] = cached_at
+            entries[name] = entry
+        self._write(profile_name, region_name, prefix, entries, names=None if replace else resources)
+
+    def invalidate(self, profile_name, region_name, prefix, name):
+        """Remove an instance from the cache
+
+        :param profile_name: The profile name associated with the AWS creds
+        :param region_name: The AWS region, or `None` for the profile default
+        :param prefix: The name prefix shared by all EC2 instances
+        :param name: The prefix-less instance name
+
+        """
+        entries = self._read(profile_name, region_name, prefix)
+        cached = self.get(profile_name, region_name, prefix, name) is not None
+        if entries.pop(name, None) is not None or cached:
+            logger.debug('Invalidating cache entry for "%s"', name)
+            self._write(profile_name, region_name, prefix, entries, names=[name])
+
+class ImageCache(object):
+    """AMI details, persisted between invocations.
+
+    AMIs are immutable, so entries never expire.
+
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR):
+        """Initialize the cache
+
+        :param directory: The directory in which cache files are stored
+
+        """
+        self.path = os.path.join(os.path.expanduser(directory), 'images.json')
+
+    def get(self, image_id):
+        """Get a cached image
+
+        :param image_id: The AMI ID
+        :returns: The cached subset of the image's API info, or `None` if absent
+
+        """
+        return (read_json(self.path) or {}).get(image_id)
+
+    def set(self, image_id, image):
+        """Cache an image
+
+        :param image_id: The AMI ID
+        :param image: The image's API info
+
+        """
+        entries = read_json(self.path) or {}
+        entries[image_id] = {field: image[field] for field in CACHED_IMAGE_FIELDS if field in image}
+        try:
+            write_json(self.path, entries)
+        except (IOError, OSError) as exc:
+            logger.warning('Unable to write the image cache: %s', exc)
+
+class RouteCache(object):
+    """The routes chosen to reach instances, per local network, persisted between invocations"""
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, ttl=DEFAULT_CACHE_TTL):
+        """Initialize the cache
+
+        :param directory: The directory in which cache files are stored
+        :param ttl: The number of seconds for which a decision is valid
+
+        """
+        self.path = os.path.join(os.path.expanduser(directory), 'routes.json')
+        self.ttl = ttl
+
+    def get(self, network_id, instance_id):
+        """Get the route chosen for an instance
+
+        :param network_id: The local network on which the route was chosen
+        :param instance_id: The instance ID
+        :returns: The route, or `None` if absent or expired
+
+        """
+        if self.ttl <= 0:
+            return None
+        entry = (read_json(self.path) or {}).get(network_id, {}).get(instance_id)
+        if entry is None or time.time() - entry.get('chosen_at', 0) > self.ttl:
+            return None
+        return entry['route']
+
+    def set(self, network_id, instance_id, route):
+        """Record the route chosen for an instance
+
+        :param network_id: The local network on which the route was chosen
+        :param instance_id: The instance ID
+        :param route: The route
+
+        """
+        entries = read_json(self.path) or {}
+        entries.setdefault(network_id, {})[instance_id] = {'route': route, 'chosen_at': time.time()}
+        try:
+            write_json(self.path, entries)
+        except (IOError, OSError) as exc:
+            logger.warning('Unable to write the route cache: %s', exc)
+
+class MissCache(object):
+    """Recently failed instance lookups, persisted between invocations.
+
+    Names found to be missing or ambiguous are remembered briefly, so that typos and retrying scripts don't
+    repeat the API calls.
+
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, ttl=DEFAULT_MISS_TTL):
+        """Initialize the cache
+
+        :param directory: The directory in which cache files are stored
+        :param ttl: The number of seconds for which a miss is remembered
+
+        """
+        self.path = os.path.join(os.path.expanduser(directory), 'misses.json')
+        self.ttl = ttl
+
+    def _write(self, entries):
+        try:
+            write_json(self.path, entries)
+        except (IOError, OSError) as exc:
+            logger.warning('Unable to write the miss cache: %s', exc)
+
+    def get(self, profile_name, region_name, prefix, name):
+        """Get the outcome of a recent failed lookup
+
+        :param profile_name: The profile name associated with the AWS creds
+        :param region_name: The AWS region, or `None` for the profile default
+        :param prefix: The name prefix shared by all EC2 instances
+        :param name: The prefix-less instance name
+        :returns: The name of the error raised by the lookup, or `None` if absent or expired
+
+        """
+        if self.ttl <= 0:
+            return None
+        fleet = (read_json(self.path) or {}).get(get_fleet_digest(profile_name, region_name, prefix), {})
+        entry = fleet.get(name)
+        if entry is None or time.time() - entry.get('cached_at', 0) > self.ttl:
+            return None
+        return entry['error']
+
+    def set(self, profile_name, region_name, prefix, name, error):
+        """Record a failed lookup, discarding any expired ones
+
+        :param profile_name: The profile name associated with the AWS creds
+        :param region_name: The AWS region, or `None` for the profile default
+        :param prefix: The name prefix shared by all EC2 instances
+        :param name: The prefix-less instance name
+        :param error: The name of the error raised by the lookup
+
+        """
+        if self.ttl <= 0:
+            return
+        now = time.time()
+        entries = {}
+        for digest, fleet in (read_json(self.path) or {}).items():
+            fleet = {key: entry for key, entry in fleet.items()
+                     if now - entry.get('cached_at', 0) <= self.ttl}
+            if fleet:
+                entries[digest] = fleet
+        digest = get_fleet_digest(profile_name, region_name, prefix)
+        entries.setdefault(digest, {})[name] = {'error': error, 'cached_at': now}
+        self._write(entries)
+
+    def invalidate(self, profile_name, region_name, prefix, name=None):
+        """Forget failed lookups
+
+        :param profile_name: The profile name associated with the AWS creds
+        :param region_name: The AWS region, or `None` for the profile default
+        :param prefix: The name prefix shared by all EC2 instances
+        :param name: The prefix-less instance name, or `None` for every name sharing the prefix
+
+        """
+        entries = read_json(self.path)
+        digest = get_fleet_digest(profile_name, region_name, prefix)
+        if not entries or digest not in entries:
+            return
+        if name is None:
+            del entries[digest]
+        elif entries[digest].pop(name, None) is None:
+            return
+        self._write(entries)
@@ -1,20 +1,34 @@
 """The command line interface"""
 from __future__ import print_function
 
+# Imported first, so that the remaining imports are timed
+from aws_ssh import timing # pylint: disable=wrong-import-order,ungrouped-imports
+
 import argparse
 from collections import namedtuple
 import logging
 import os
 import sys
+import threading
 
 import six
 from six.moves import input
 
-from aws_ssh import APP_NAME
-from aws_ssh.errors import ProjectConfigNotFoundError
-from aws_ssh.interfaces import Environment
+from aws_ssh import APP_NAME, __version__, configure_logging, daemon, execute
+from aws_ssh.errors import (HostKeyError, HostUnreachableError, InstanceNotRunningError, NoAddressError,
+                            NoInstanceFoundError, ProbeConfigError, ProjectConfigNotFoundError,
+                            TooManyInstancesError, UnknownProjectError, UsernameNotFoundError)
+from aws_ssh.interfaces import Environment, split_address
+from aws_ssh.network import SSH_PORT, wait_for_port
 
 Argument = namedtuple('Argument', 'switch metavar description prompt')
+SSHArgs = namedtuple('SSHArgs', 'key user addr cached options')
+
+# Exit codes signalling the shell wrappers to connect. The latter indicates that the address was served from
+# the instance cache (and accepted a connection).
+EXIT_CONNECT = 170
+EXIT_CONNECT_CACHED = 171
+CACHED_CONNECT_TIMEOUT = 2 # Seconds to wait for a cached address to accept a connection, before refreshing
 
 logger = logging.getLogger(__name__)
 
@@ -34,12 +48,14 @@ class AwsshHelpFormatter(argparse.ArgumentDefaultsHelpFormatter):
     """Customize the CLI help functionality"""
     def _format_usage(self, usage, actions, groups, prefix):
         prefix = 'usage: '
-        init_actions = [action for action in actions if action.dest != 'instance']
-        host_actions = [action for action in actions if action.dest in ('instance', 'help', 'debug')]
+        init_actions = [action for action in actions
+                        if action.dest not in ('instance', 'refresh', 'start', 'timings')]
+        host_actions = [action for action in actions
+                        if action.dest in ('instance', 'help', 'debug', 'refresh', 'start', 'timings')]
         init_usage = super(AwsshHelpFormatter, self)._format_usage(usage, init_actions, groups, prefix)
         host_usage = super(AwsshHelpFormatter, self)._format_usage(usage, host_actions, groups, prefix)
         init_usage = init_usage.replace(prefix, len(prefix) * ' ') # Replace the usage prefix with whitespace
-        return host_usage.replace('[HOST]', 'HOST')[:-1] + init_usage # Strip trailing newline and concat
+        return host_usage[:-1] + init_usage # Strip trailing newline and concat
 
 
 def prompt_for_arg(argument, out=sys.stderr):
@@ -66,12 +82,242 @@ def init_environment(environment):
     environment.set_key_root(key_root)
     environment.save()
 
+def find_project(parser, environment):
+    """Find the project for the current directory, exiting with a usage error if there is none"""
+    try:
+        return environment.find_project(os.getcwd())
+    except ProjectConfigNotFoundError:
+        return parser.error('No project configuration found. Run `{} --init` to initialize.'.format(APP_NAME))
+
+def describe_missing_instance(project, instance_name):
+    """Explain that an instance doesn't exist, suggesting similarly-named ones
+
+    :param project: The project
+    :param instance_name: The prefix-less instance name
+    :returns: The explanation
+
+    """
+    message = 'No instance named "{}{}" found.'.format(project.prefix, instance_name)
+    suggestions = project.suggest_instance_names(instance_name)
+    if suggestions:
+        message += ' Did you mean {}?'.format(' or '.join('"{}"'.format(name) for name in suggestions))
+    return message + ' Pass --refresh if it was just created.'
+
+def lookup_instance(parser, project, instance_name, refresh=False):
+    """Get an instance, exiting with a usage error if there is no single instance of that name
+
+    :param parser: The argument parser
+    :param project: The project
+    :param instance_name: The prefix-less instance name
+    :param refresh: Bypass the instance and miss caches
+    :returns: The instance
+
+    """
+    try:
+        return project.get_instance(instance_name, refresh=refresh)
+    except NoInstanceFoundError:
+        return parser.error(describe_missing_instance(project, instance_name))
+    except TooManyInstancesError:
+        return parser.error('Several instances are named "{}{}".'.format(project.prefix, instance_name))
+
+def ensure_running(parser, instance, start=False):
+    """Make sure an instance can be connected to, exiting with a usage error otherwise
+
+    :param parser: The argument parser
+    :param instance: The instance
+    :param start: Start the instance if it's stopped
+
+    """
+    if not instance.is_running:
+        if not start:
+            parser.error('{} is {}. Pass --start to start it.'.format(instance.name, instance.state))
+        sys.stderr.write('Starting {}...\n'.format(instance.name))
+        try:
+            instance.start()
+        except InstanceNotRunningError as exc:
+            parser.error(str(exc))
+    try:
+        instance.check_address()
+    except NoAddressError as exc:
+        parser.error(str(exc))
+
+def raise_unreachable(parser, exc):
+    """Exit with an explanation if a username couldn't be found as the instance itself couldn't be reached, or
+    probed at all
+
+    :param parser: The argument parser
+    :param exc: The error raised when finding the username
+
+    """
+    if isinstance(exc, (HostUnreachableError, HostKeyError, ProbeConfigError)):
+        parser.error(str(exc))
+
+def get_picker_rows(entries):
+    """Describe instances for the picker
+
+    :param entries: A dict mapping prefix-less instance names to their (cached) API info
+    :returns: (name, description) pairs, sorted by name
+
+    """
+    from aws_ssh.picker import format_table
+    names = sorted(entries)
+    rows = []
+    for name in names:
+        entry = entries[name]
+        launched = str(entry.get('LaunchTime', '-'))[:16].replace('T', ' ')
+        rows.append((name, entry.get('State', {}).get('Name', '?'),
+                     entry.get('PublicIpAddress') or entry.get('PrivateIpAddress') or '-',
+                     entry.get('InstanceType', '-'), launched))
+    return list(zip(names, format_table(rows)))
+
+def pick_instance(parser, project):
+    """Interactively pick one of the project's instances
+
+    Instances are listed from the instance cache straight away. If the cache is stale, the fleet is refreshed
+    in the background, and the list updated once it arrives.
+
+    :returns: The prefix-less instance name
+
+    """
+    import termios
+    from aws_ssh.picker import Picker
+    entries, stale = project.get_cached_fleet()
+    if not entries:
+        sys.stderr.write('Listing instances...\n')
+        project.get_fleet()
+        entries, stale = project.get_cached_fleet()[0], False
+    picker = Picker(get_picker_rows(entries), key=lambda row: row[1])
+
+    def revalidate():
+        try:
+            project.get_fleet(refresh=True)
+            picker.update(get_picker_rows(project.get_cached_fleet()[0]))
+        except Exception: # pylint: disable=broad-except
+            logger.debug('Unable to refresh the fleet', exc_info=True)
+            picker.update(picker.filter.items, status='refresh failed')
+
+    if stale:
+        picker.status = 'refreshing'
+        refresher = threading.Thread(target=revalidate, name='fleet-refresh')
+        refresher.daemon = True
+        refresher.start()
+    try:
+        row = picker.run()
+    except (OSError, termios.error) as exc: # No controlling terminal
+        logger.debug('Unable to show the picker: %s', exc)
+        parser.error('Instance name required')
+    if row is not None:
+        return row[0]
+    sys.exit(1)
+
+def get_project(parser, environment, project_name=None):
+    """Get a project by name, or else the project for the current directory, exiting with a usage error if
+    there is none
+
+    :param parser: The argument parser
+    :param environment: The environment
+    :param project_name: The name of the project, if qualified
+    :returns: The project
+
+    """
+    if not project_name:
+        return find_project(parser, environment)
+    try:
+        return environment.get_project(project_name)
+    except (UnknownProjectError, ProjectConfigNotFoundError):
+        return parser.error('No project named "{}" is registered.'.format(project_name))
+
+def resolve_instance(parser, project, instance_name, args):
+    """Get a running instance, refreshing cached details which say otherwise
+
+    :param parser: The argument parser
+    :param project: The project
+    :param instance_name: The prefix-less instance name
+    :param args: The parsed arguments, i.e., whether to refresh, and whether to start the instance
+    :returns: The instance
+
+    """
+    instance = lookup_instance(parser, project, instance_name, refresh=args.refresh)
+    if not instance.is_running and instance.cached:
+        logger.debug('Cached state of %s is %s. Refreshing...', instance.name, instance.state)
+        instance = lookup_instance(parser, project, instance_name, refresh=True)
+    ensure_running(parser, instance, start=args.start)
+    return instance
+
+def resolve_user(parser, project, instance_name, instance, args):
+    """Determine an instance's username, looking the instance up afresh if its cached address fails
+
+    :param parser: The argument parser
+    :param project: The project
+    :param instance_name: The prefix-less instance name
+    :param instance: The instance
+    :param args: The parsed arguments, i.e., whether to start the refreshed instance
+    :returns: The instance, which may have been refreshed, and its username
+
+    """
+    try:
+        return instance, instance.get_user_name()
+    except UsernameNotFoundError as exc:
+        if not instance.cached:
+            raise_unreachable(parser, exc)
+            raise
+    logger.debug('Unable to connect to cached address %s. Refreshing...', instance.ip)
+    instance = lookup_instance(parser, project, instance_name, refresh=True)
+    ensure_running(parser, instance, start=args.start)
+    try:
+        return instance, instance.get_user_name()
+    except UsernameNotFoundError as exc:
+        raise_unreachable(parser, exc)
+        raise
+
+def accepts_connections(ssh_args):
+    """Determine whether a resolved address accepts SSH connections, unless only a bastion can reach it
+
+    :param ssh_args: The resolved arguments
+    :returns: Whether ssh may connect
+
+    """
+    if any(option.startswith('ProxyJump=') for option in ssh_args.options):
+        return True
+    return wait_for_port(ssh_args.addr, SSH_PORT, timeout=CACHED_CONNECT_TIMEOUT,
+                         connect_timeout=CACHED_CONNECT_TIMEOUT)
+
+@timing.timed('get_ssh_args')
 def get_ssh_args(args):
-    """Get the arguments for SSH on the CLI"""
+    """Get the arguments for SSH on the CLI
+
+    A cached address is checked to accept connections before ssh is run, and looked up afresh otherwise, so
+    that the wrappers never have to retry ssh itself (which could reconnect after an established session
+    ended).
+
+    """
     parser = get_parser()
     args = parser.parse_args(args)
     if args.debug:
         logging.getLogger('aws_ssh').setLevel(logging.DEBUG)
+    if args.timings:
+        timing.show_table()
+    ssh_args = resolve_ssh_args(parser, args)
+    if ssh_args.cached and not accepts_connections(ssh_args):
+        logger.debug('Cached address %s does not accept connections. Refreshing...', ssh_args.addr)
+        args.refresh = True
+        ssh_args = resolve_ssh_args(parser, args)
+    return ssh_args
+
+def resolve_ssh_args(parser, args):
+    """Resolve the arguments for SSH, via the daemon if it's running
+
+    :param parser: The argument parser
+    :param args: The parsed arguments
+    :returns: The SSH arguments
+
+    """
+    if args.instance and not args.initialize:
+        with timing.span('daemon.query'):
+            answer = daemon.query(os.getcwd(), args.instance, refresh=args.refresh)
+        if answer is not None:
+            logger.debug('Resolved by the daemon: %s', answer)
+            return SSHArgs(answer['key'], answer['user'], answer['addr'], answer['cached'], answer['options'])
     environment = Environment()
     if not environment.is_initialized():
         logger.debug('User config not initialized.')
@@ -82,35 +328,131 @@ def get_ssh_args(args):
                                    properties['root'], properties['key'])
         sys.stderr.write('Initialized!\n')
         sys.exit(-1)
-    try:
-        project = environment.find_project(os.getcwd())
-    except ProjectConfigNotFoundError:
-        parser.error('No project configuration found. Run `{} --init` to initialize.'.format(APP_NAME))
-    if not args.instance:
-        parser.error('Instance name required')
+    project_name, instance_name = split_address(args.instance) if args.instance else (None, None)
+    project = get_project(parser, environment, project_name)
+    if not instance_name:
+        instance_name = pick_instance(parser, project)
     logger.debug('Project loaded: %s', project)
-    instance = project.get_instance(args.instance)
-    return project.key_path, instance.get_user_name(), instance.ip
+    instance = resolve_instance(parser, project, instance_name, args)
+    instance, user = resolve_user(parser, project, instance_name, instance, args)
+    return SSHArgs(project.key_path, user, instance.ip, instance.cached, instance.ssh_options)
 
 def print_ssh_args(out=sys.stdout):
     """Print the arguments for SSH to stdout and exit with a success error code."""
-    key, user, addr = get_ssh_args(sys.argv[1:])
-    sys.stderr.write('Connecting to {}\n'.format(addr))
-    out.write("-i {} {}@{}\n".format(key, user, addr))
-    sys.exit(170)
+    configure_logging()
+    timing.record('import', timing.LOADED_AT, timing.now())
+    try:
+        ssh_args = get_ssh_args(sys.argv[1:])
+    finally:
+        timing.report(version=__version__)
+    sys.stderr.write('Connecting to {}\n'.format(ssh_args.addr))
+    out.write("{}\n".format(' '.join(['-i', ssh_args.key] + list(ssh_args.options) +
+                                     ['{}@{}'.format(ssh_args.user, ssh_args.addr)])))
+    sys.exit(EXIT_CONNECT_CACHED if ssh_args.cached else EXIT_CONNECT)
+
+def run_daemon(args):
+    """Run the resolver daemon in the foreground"""
+    parser = argparse.ArgumentParser(prog='{} daemon'.format(APP_NAME),
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--debug', action='store_true', help='Enable debugging output')
+    parser.add_argument('--socket', default=daemon.DEFAULT_SOCKET_PATH, help='The socket to listen on')
+    parser.add_argument('--interval', type=int, default=daemon.DEFAULT_REFRESH_INTERVAL,
+                        help='The number of seconds between background refreshes of instance details')
+    args = parser.parse_args(args)
+    logging.getLogger('aws_ssh').setLevel(logging.DEBUG if args.debug else logging.INFO)
+    environment = Environment()
+    if not environment.is_initialized():
+        parser.error('No user configuration found. Run `{} --init` to initialize.'.format(APP_NAME))
+    daemon.serve(environment, path=args.socket, interval=args.interval)
+    return 0
+
+def run_exec(args):
+    """Run a command on several instances at once"""
+    parser = argparse.ArgumentParser(prog='{} exec'.format(APP_NAME),
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--debug', action='store_true', help='Enable debugging output')
+    parser.add_argument('-j', '--workers', type=int, default=execute.DEFAULT_WORKERS,
+                        help='The maximum number of instances to run the command on at once')
+    parser.add_argument('--connect-timeout', type=int, default=execute.DEFAULT_CONNECT_TIMEOUT,
+                        help='The number of seconds to wait for each SSH connection')
+    parser.add_argument('hosts', metavar='HOSTS',
+                        help='A comma-separated list of instance names or glob patterns')
+    parser.add_argument('command', nargs=argparse.REMAINDER, metavar='-- COMMAND',
+                        help='The command to run')
+    args = parser.parse_args(args)
+    if args.debug:
+        logging.getLogger('aws_ssh').setLevel(logging.DEBUG)
+    command = args.command[1:] if args.command[:1] == ['--'] else args.command
+    if not command:
+        parser.error('Command required')
+    project = find_project(parser, Environment())
+    names = execute.select_instance_names(project.get_fleet(), args.hosts)
+    if not names:
+        parser.error('No instances match "{}"'.format(args.hosts))
+    runner = execute.Runner(project, command, workers=args.workers, connect_timeout=args.connect_timeout)
+    results = runner.run(project.get_instances(names))
+    execute.write_summary(results)
+    return 0 if all(result.exit_code == 0 for result in results) else 1
+
+def run_export_ssh_config(args):
+    """Export all registered projects' instances as an includable ssh_config"""
+    from aws_ssh import sshconfig
+    parser = argparse.ArgumentParser(prog='{} export-ssh-config'.format(APP_NAME),
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--debug', action='store_true', help='Enable debugging output')
+    parser.add_argument('-o', '--output', default=sshconfig.DEFAULT_SSH_CONFIG, help='The file to write')
+    args = parser.parse_args(args)
+    if args.debug:
+        logging.getLogger('aws_ssh').setLevel(logging.DEBUG)
+    environment = Environment()
+    if not environment.is_initialized():
+        parser.error('No user configuration found. Run `{} --init` to initialize.'.format(APP_NAME))
+    added, changed, removed = sshconfig.export(environment, args.output)
+    sys.stderr.write('{} added, {} changed, {} removed. Include it from ~/.ssh/config with:\n'
+                     '    Include {}\n'.format(added, changed, removed, args.output))
+    return 0
+
+def run_complete(args):
+    """Print the completions of a partial instance address, one per line, for the shell completion scripts"""
+    from aws_ssh.completion import complete
+    for completion in complete(args[0] if args else '', os.getcwd()):
+        print(completion)
+    return 0
+
+COMMANDS = {
+    '--complete': run_complete,
+    'daemon': run_daemon,
+    'exec': run_exec,
+    'export-ssh-config': run_export_ssh_config,
+}
+
+def main():
+    """Run the given command, defaulting to printing the arguments for SSH"""
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        configure_logging()
+        sys.exit(COMMANDS[sys.argv[1]](sys.argv[2:]))
+    else:
+        print_ssh_args()
 
 def get_parser():
     """Get the command line argument parser"""
     parser = argparse.ArgumentParser(prog=APP_NAME, formatter_class=AwsshHelpFormatter)
     parser.add_argument('--debug', action='store_true', help='Enable debugging output')
     parser.add_argument("--init", dest="initialize", action="store_true", help="Initialize the project.")
+    parser.add_argument("--refresh", "--no-cache", dest="refresh", action="store_true",
+                        help="Bypass the instance cache and look up the instance in AWS.")
+    parser.add_argument("--start", action="store_true",
+                        help="Start the instance if it's stopped, and wait until it accepts SSH connections.")
+    parser.add_argument("--timings", action="store_true",
+                        help="Show where the time to resolve the instance was spent.")
     # TODO: Add hook to register project (like init, but sourced from existing .awssshrc file)
     for argname, argument in six.iteritems(ARGUMENTS):
         parser.add_argument("--{}".format(argument.switch), dest=argname, metavar=argument.metavar,
                             default=None, help=argument.description)
     parser.add_argument("instance", nargs="?", default=None, type=str, metavar="HOST",
-                        help="The name of the instance to connect to.")
+                        help="The name of the instance to connect to, optionally qualified by its project "
+                        "(PROJECT:HOST) to connect from any directory.")
     return parser
 
 if __name__ == "__main__":
-    print_ssh_args()
+    main()
@@ -0,0 +1,159 @@
+"""Shell completion of instance names
+
+Completions are answered from the name index, a sorted file of every known `project:instance` name, which is
+maintained as fleets are fetched. Answering costs a file read and a binary search, and never contacts AWS.
+
+"""
+
+import bisect
+import logging
+import os
+import os.path
+
+from aws_ssh.cache import DEFAULT_CACHE_DIR, write_file
+from aws_ssh.registry import Registry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_NAME_INDEX = os.path.join(DEFAULT_CACHE_DIR, 'names')
+
+class NameIndex(object):
+    """The names of every known instance, qualified by their project, persisted as sorted lines"""
+
+    def __init__(self, path=DEFAULT_NAME_INDEX):
+        """Initialize the index
+
+        :param path: The index file
+
+        """
+        self.path = os.path.expanduser(path)
+
+    def _read(self):
+        try:
+            with open(self.path) as indexfile:
+                return indexfile.read().splitlines()
+        except (IOError, OSError):
+            return []
+
+    def search(self, prefix):
+        """Find the qualified names starting with a prefix
+
+        :param prefix: The prefix, e.g. `project:we`
+        :returns: The matching names, sorted
+
+        """
+        names = self._read()
+        matches = []
+        for index in range(bisect.bisect_left(names, prefix), len(names)):
+            if not names[index].startswith(prefix):
+                break
+            matches.append(names[index])
+        return matches
+
+    def update(self, project_name, instance_names, replace=False):
+        """Index a project's instance names
+
+        :param project_name: The project name
+        :param instance_names: The prefix-less instance names
+        :param replace: Discard the project's other names (e.g., as the names are the complete fleet)
+
+        """
+        qualifier = '{}:'.format(project_name)
+        names = self._read()
+        if replace:
+            names = [name for name in names if not name.startswith(qualifier)]
+        updated = sorted(set(names).union(qualifier + name for name in instance_names))
+        if updated == names:
+            return
+        try:
+            write_file(self.path, ''.join(name + '\n' for name in updated))
+        except (IOError, OSError) as exc:
+            logger.warning('Unable to write the name index: %s', exc)
+
+def _next_row(rows, name, candidate, depth):
+    """Extend the edit distance matrix between a name and a candidate by the candidate's next character"""
+    previous, char = rows[-1], candidate[depth]
+    row = [depth + 1] + [0] * len(name)
+    for column in range(1, len(name) + 1):
+        cost = 0 if name[column - 1] == char else 1
+        row[column] = min(previous[column] + 1, row[column - 1] + 1, previous[column - 1] + cost)
+        if depth > 0 and column > 1 and name[column - 2] == char and name[column - 1] == candidate[depth - 1]:
+            row[column] = min(row[column], rows[-2][column - 2] + 1) # Transposition
+    return row
+
+def suggest(name, candidates, limit=3):
+    """Find the candidates closest to a (presumably misspelt) name, by Damerau-Levenshtein distance
+
+    Candidates are walked in sorted order, as if in a trie, so that the rows of the distance matrix are shared
+    between candidates with a common prefix, and prefixes already too distant are skipped altogether.
+
+    :param name: The name
+    :param candidates: The names that exist
+    :param limit: The maximum number of suggestions
+    :returns: The candidates within a few edits of the name, closest first
+
+    """
+    max_distance = max(1, len(name) // 3)
+    candidates = sorted(candidates)
+    rows = [list(range(len(name) + 1))] # Rows for each character of the previous candidate
+    previous = ''
+    scored = []
+    index = 0
+    while index < len(candidates):
+        candidate = candidates[index]
+        shared = 0
+        while shared < min(len(previous), len(candidate)) and previous[shared] == candidate[shared]:
+            shared += 1
+        del rows[shared + 1:]
+        previous = candidate
+        for depth in range(shared, len(candidate)):
+            rows.append(_next_row(rows, name, candidate, depth))
+            if min(rows[-1]) > max_distance: # So is every candidate sharing this prefix
+                prefix = candidate[:depth + 1]
+                while index < len(candidates) and candidates[index].startswith(prefix):
+                    index += 1
+                break
+        else:
+            if rows[-1][-1] <= max_distance:
+                scored.append((rows[-1][-1], candidate))
+            index += 1
+    return [candidate for _, candidate in sorted(scored)[:limit]]
+
+def find_project_name(path, registry):
+    """Find the registered project containing a path, without reading any project config
+
+    :param path: A directory
+    :param registry: The project registry
+    :returns: The name of the project with the deepest root containing the path, or `None` if there is none
+
+    """
+    path = os.path.abspath(path)
+    matches = [(len(entry['root']), name) for name, entry in registry.projects.items()
+               if path == entry['root'] or path.startswith(entry['root'].rstrip(os.sep) + os.sep)]
+    return max(matches)[1] if matches else None
+
+def complete(prefix, cwd, index=None, registry=None):
+    """Complete a partial instance address
+
+    Unqualified prefixes are completed against the instances of the project containing the working directory,
+    and against the names of all registered projects (as `project:`). Qualified prefixes are completed
+    against that project's instances.
+
+    :param prefix: The partial address
+    :param cwd: The working directory
+    :param index: The name index
+    :param registry: The project registry
+    :returns: The completions
+
+    """
+    index = index or NameIndex()
+    registry = registry or Registry()
+    if ':' in prefix:
+        return index.search(prefix)
+    completions = []
+    project_name = find_project_name(cwd, registry)
+    if project_name is not None:
+        qualifier = '{}:'.format(project_name)
+        completions.extend(name[len(qualifier):] for name in index.search(qualifier + prefix))
+    completions.extend('{}:'.format(name) for name in sorted(registry.projects) if name.startswith(prefix))
+    return completions
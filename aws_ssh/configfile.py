@@ -0,0 +1,145 @@
+"""Reading and writing INI configuration files
+
+Parsed configs are snapshotted as JSON, keyed by the source file's identity (inode, size, and
+modification time), so that unchanged files are loaded without re-parsing. Saves are atomic, so concurrent
+readers never see a half-written file, and merge only the changed entries into the file under an exclusive
+lock, so concurrent writers don't lose each other's changes.
+
+"""
+
+import hashlib
+import logging
+import os
+import os.path
+
+import six
+import configparser
+
+from aws_ssh.cache import DEFAULT_CACHE_DIR, locked, read_json, write_file, write_json
+
+logger = logging.getLogger(__name__)
+
+def _get_snapshot_path(path, cache_dir=DEFAULT_CACHE_DIR, extension='json'):
+    digest = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(os.path.expanduser(cache_dir), 'configs', '{}.{}'.format(digest, extension))
+
+def _get_identity(stat):
+    return [stat.st_ino, stat.st_size, getattr(stat, 'st_mtime_ns', stat.st_mtime)]
+
+def get_identity(path):
+    """Get the identity of a file, by which its snapshot is keyed
+
+    :param path: The file
+    :returns: The file's inode, size, and modification time, or `None` if it doesn't exist
+
+    """
+    try:
+        return _get_identity(os.stat(path))
+    except OSError:
+        return None
+
+def _get_section(config, section):
+    """Get a section's own options (i.e., without inherited defaults), or `None` if it doesn't exist"""
+    defaults = config.defaults()
+    if section == configparser.DEFAULTSECT:
+        return dict(defaults)
+    if not config.has_section(section):
+        return None
+    return {option: config.get(section, option, raw=True) for option in config.options(section)
+            if config.get(section, option, raw=True) != defaults.get(option)}
+
+def dump_config(config):
+    """Convert a config to a dict, suitable for `ConfigParser.read_dict`
+
+    :param config: The config
+    :returns: A dict mapping section names to their options
+
+    """
+    return {section: _get_section(config, section)
+            for section in [configparser.DEFAULTSECT] + config.sections()}
+
+def _write_snapshot(path, config, stat, cache_dir):
+    try:
+        snapshot = {'path': os.path.abspath(path), 'identity': _get_identity(stat),
+                    'sections': dump_config(config)}
+        write_json(_get_snapshot_path(path, cache_dir), snapshot)
+    except (IOError, OSError) as exc:
+        logger.debug('Unable to snapshot %s: %s', path, exc)
+
+def read_config(config, path, cache_dir=DEFAULT_CACHE_DIR):
+    """Read an INI file into a config, preferring an up-to-date snapshot
+
+    :param config: The config to populate
+    :param path: The INI file
+    :param cache_dir: The directory containing snapshots
+    :returns: Whether the file was read
+
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return False
+    snapshot = read_json(_get_snapshot_path(path, cache_dir))
+    if (snapshot and snapshot.get('path') == os.path.abspath(path)
+            and snapshot.get('identity') == _get_identity(stat)):
+        logger.debug('Loading snapshot of %s', path)
+        config.read_dict(snapshot['sections'])
+        return True
+    if not config.read(path):
+        return False
+    _write_snapshot(path, config, stat, cache_dir)
+    return True
+
+def write_config(config, path, cache_dir=DEFAULT_CACHE_DIR):
+    """Atomically write a config to an INI file, preserving the file's permissions
+
+    :param config: The config to write
+    :param path: The INI file
+    :param cache_dir: The directory containing snapshots
+
+    """
+    try:
+        mode = os.stat(path).st_mode & 0o777
+    except OSError:
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = 0o666 & ~umask
+    content = six.StringIO()
+    config.write(content)
+    write_file(path, content.getvalue(), mode=mode)
+    _write_snapshot(path, config, os.stat(path), cache_dir)
+
+def save_config(config, path, changes, cache_dir=DEFAULT_CACHE_DIR):
+    """Merge changed entries into an INI file
+
+    The file is re-read under an exclusive lock, so that entries written by other processes since this config
+    was loaded are kept. Readers never take the lock. The lock file lives alongside the snapshot, rather than
+    the INI file, so that project directories aren't littered.
+
+    :param config: The config containing the changes
+    :param path: The INI file
+    :param changes: The changed `(section, option)` pairs, where an option of `None` replaces the whole
+                    section
+    :param cache_dir: The directory containing snapshots
+
+    """
+    with locked(_get_snapshot_path(path, cache_dir, 'lock')):
+        merged = configparser.ConfigParser()
+        read_config(merged, path, cache_dir)
+        for section, option in changes:
+            _merge(config, merged, section, option)
+        write_config(merged, path, cache_dir)
+
+def _merge(source, target, section, option):
+    values = _get_section(source, section)
+    if option is None:
+        if values is None:
+            target.remove_section(section)
+        else:
+            target[section] = values
+    elif values is not None and option in values:
+        if _get_section(target, section) is None:
+            target.add_section(section)
+        target.set(section, option, values[option])
+    elif _get_section(target, section) is not None:
+        target.remove_option(section, option)
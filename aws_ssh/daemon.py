@@ -0,0 +1,270 @@
+"""A long-lived resolver, answering the CLI over a Unix domain socket
+
+The daemon keeps the environment, loaded projects, pooled AWS clients, and project fleets in memory, so that a
+warm lookup costs neither Python start-up, configuration parsing, nor an AWS round trip. Instances are
+answered from an in-memory index of each project's most recently fetched fleet, and configs are reloaded once
+their files change.
+
+The protocol is a single line of JSON in each direction. Requests are of the form
+`{"cwd": ..., "instance": ..., "refresh": ...}`, and responses are either `{"key": ..., "user": ...,
+"addr": ..., "cached": ..., "options": [...]}` or `{"error": ...}`.
+
+"""
+
+import json
+import logging
+import os
+import os.path
+import socket
+import threading
+import time
+
+import six
+from six.moves import socketserver
+
+from aws_ssh.configfile import get_identity
+from aws_ssh.errors import InstanceNotRunningError
+from aws_ssh.interfaces import DEFAULT_PROJECT_CONFIG, Environment, Instance, split_address
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET_PATH = '~/.aws-ssh/daemon.sock'
+DEFAULT_REFRESH_INTERVAL = 300 # Seconds
+CLIENT_TIMEOUT = 0.5 # Seconds to wait for the daemon before falling back to in-process resolution
+REQUEST_TIMEOUT = 30 # Seconds to wait for an answer, which may involve probing for the username
+
+def _read_line(sock, deadline):
+    """Read a line from a socket, giving up at the deadline rather than after any single quiet spell"""
+    data = b''
+    while not data.endswith(b'\n'):
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise socket.timeout('No answer within the request timeout')
+        sock.settimeout(remaining)
+        chunk = sock.recv(4096)
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+def query(cwd, instance_name, refresh=False, path=DEFAULT_SOCKET_PATH, timeout=CLIENT_TIMEOUT,
+          request_timeout=REQUEST_TIMEOUT):
+    """Ask the daemon to resolve an instance
+
+    :param cwd: The directory from which the project should be found
+    :param instance_name: The prefix-less instance name
+    :param refresh: Bypass cached instance details
+    :param path: The daemon's socket
+    :param timeout: The number of seconds to wait for a connection
+    :param request_timeout: The number of seconds to wait for the whole exchange, once connected
+    :returns: The resolved SSH arguments as a dict, or `None` if the daemon is unavailable or unable to answer
+
+    """
+    path = os.path.expanduser(path)
+    if not os.path.exists(path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        deadline = time.time() + request_timeout
+        request = {'cwd': cwd, 'instance': instance_name, 'refresh': refresh}
+        sock.settimeout(request_timeout)
+        sock.sendall((json.dumps(request) + '\n').encode('utf-8'))
+        response = json.loads(_read_line(sock, deadline).decode('utf-8'))
+    except (IOError, OSError, ValueError) as exc:
+        logger.debug('Daemon unavailable: %s', exc)
+        return None
+    finally:
+        sock.close()
+    if 'error' in response:
+        logger.debug('Daemon unable to resolve "%s": %s', instance_name, response['error'])
+        return None
+    return response
+
+def get_config_identity(root):
+    """Get the identity of a project's config file, which changes whenever the file does"""
+    return get_identity(os.path.join(root, DEFAULT_PROJECT_CONFIG))
+
+class Resolver(object):
+    """Resolves instances against an in-memory environment"""
+
+    def __init__(self, environment):
+        """Initialize the resolver
+
+        :param environment: The environment to which projects are registered
+
+        """
+        self.environment = environment
+        self._environment_identity = get_identity(environment.path)
+        self._lock = threading.Lock()
+        self._roots = {} # Directory or project name -> project root
+        self._projects = {} # Project root -> (project, lock, config identity)
+        self._indexes = {} # Project root -> {prefix-less instance name: API info}, from the latest fleet
+
+    def _check_environment(self):
+        """Start afresh if the user config changed, e.g., as a project was registered"""
+        identity = get_identity(self.environment.path)
+        if identity != self._environment_identity:
+            logger.info('%s changed. Reloading...', self.environment.path)
+            self.environment = Environment(self.environment.path)
+            self._environment_identity = identity
+            self._roots.clear()
+            self._projects.clear()
+            self._indexes.clear()
+
+    def _forget(self, root):
+        """Drop a project, and every directory resolved to it, so that it's reloaded on next use"""
+        self._projects.pop(root, None)
+        self._indexes.pop(root, None)
+        for key in [key for key, value in six.iteritems(self._roots) if value == root]:
+            del self._roots[key]
+
+    def get_project(self, cwd, project_name=None):
+        """Get the project for a directory, or by name, loading it on first use, or once its config changed
+
+        :param cwd: The directory from which the project should be found
+        :param project_name: The name of the project, which takes precedence over the directory
+        :returns: The project, and the lock serializing its use
+
+        """
+        key = '{}:'.format(project_name) if project_name else cwd
+        with self._lock:
+            self._check_environment()
+            root = self._roots.get(key)
+            if root is not None and get_config_identity(root) != self._projects[root][2]:
+                logger.info('Config of %s changed. Reloading...', self._projects[root][0])
+                self._forget(root)
+                root = None
+            if root is None:
+                if project_name:
+                    project = self.environment.get_project(project_name)
+                else:
+                    project = self.environment.find_project(cwd)
+                root = self._roots[key] = project.root
+                if root not in self._projects:
+                    self._projects[root] = (project, threading.Lock(), get_config_identity(root))
+            project, lock, _ = self._projects[root]
+            return project, lock
+
+    def _index(self, project, fleet):
+        """Index the uniquely-named instances of a freshly-fetched fleet"""
+        index = {name: instances[0] for name, instances in six.iteritems(fleet) if len(instances) == 1}
+        with self._lock:
+            if self._projects.get(project.root, (None,))[0] is project: # Rather than a reloaded project
+                self._indexes[project.root] = index
+
+    def _lookup(self, project, instance_name):
+        """Get an instance from the in-memory index, or `None` if it isn't indexed"""
+        resource = self._indexes.get(project.root, {}).get(instance_name)
+        if resource is None:
+            return None
+        logger.debug('Serving "%s" from the in-memory index', instance_name)
+        # Marked as cached, as the fleet may have changed since, so that a failed connection is retried afresh
+        return Instance('{}{}'.format(project.prefix, instance_name), resource, project, cached=True)
+
+    def resolve(self, cwd, instance_name, refresh=False):
+        """Resolve the SSH arguments for an instance
+
+        :param cwd: The directory from which the project should be found
+        :param instance_name: The prefix-less instance name, optionally qualified by its project
+        :param refresh: Bypass cached instance details
+        :returns: The SSH arguments as a dict
+
+        """
+        project_name, instance_name = split_address(instance_name)
+        project, lock = self.get_project(cwd, project_name)
+        with lock:
+            if refresh:
+                try:
+                    instance = project.get_instance(instance_name, refresh=True) # Fetching the fleet afresh
+                finally:
+                    self._index(project, project.get_fleet())
+            else:
+                instance = self._lookup(project, instance_name)
+                if instance is None:
+                    instance = project.get_instance(instance_name, refresh=refresh)
+            if not instance.is_running: # Leave starting the instance, or reporting the error, to the CLI
+                raise InstanceNotRunningError('{} is {}'.format(instance.name, instance.state))
+            instance.check_address()
+            return {'key': project.key_path, 'user': instance.get_user_name(), 'addr': instance.ip,
+                    'cached': instance.cached, 'options': instance.ssh_options}
+
+    def refresh(self):
+        """Refresh the fleets of all loaded projects"""
+        with self._lock:
+            projects = [(project, lock) for project, lock, _ in self._projects.values()]
+        for project, lock in projects:
+            try:
+                with lock:
+                    self._index(project, project.get_fleet(refresh=True))
+            except Exception: # pylint: disable=broad-except
+                logger.exception('Unable to refresh %s', project)
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            response = self.server.resolver.resolve(request['cwd'], request['instance'],
+                                                    refresh=request.get('refresh', False))
+        except Exception as exc: # pylint: disable=broad-except
+            logger.debug('Unable to answer request', exc_info=True)
+            response = {'error': '{}: {}'.format(exc.__class__.__name__, exc)}
+        self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+
+class ResolverServer(socketserver.ThreadingUnixStreamServer):
+    """Serves a resolver over a Unix domain socket"""
+
+    daemon_threads = True
+
+    def __init__(self, resolver, path=DEFAULT_SOCKET_PATH):
+        """Initialize the server, replacing any stale socket
+
+        :param resolver: The resolver answering requests
+        :param path: The socket to listen on
+
+        """
+        self.resolver = resolver
+        self.path = os.path.expanduser(path)
+        if not os.path.exists(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        umask = os.umask(0o077) # Only the owner may connect
+        try:
+            socketserver.ThreadingUnixStreamServer.__init__(self, self.path, _RequestHandler)
+        finally:
+            os.umask(umask)
+
+    def server_close(self):
+        socketserver.ThreadingUnixStreamServer.server_close(self)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def serve(environment, path=DEFAULT_SOCKET_PATH, interval=DEFAULT_REFRESH_INTERVAL):
+    """Run the daemon until interrupted
+
+    :param environment: The environment to which projects are registered
+    :param path: The socket to listen on
+    :param interval: The number of seconds between background fleet refreshes
+
+    """
+    resolver = Resolver(environment)
+    server = ResolverServer(resolver, path)
+    stopped = threading.Event()
+
+    def refresh_periodically():
+        while not stopped.wait(interval):
+            resolver.refresh()
+
+    refresher = threading.Thread(target=refresh_periodically, name='fleet-refresh')
+    refresher.daemon = True
+    refresher.start()
+    logger.info('Listening on %s', server.path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stopped.set()
+        server.server_close()
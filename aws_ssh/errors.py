@@ -4,6 +4,10 @@ class ProjectConfigNotFoundError(Exception):
     """Raised when a project config file cannot be found in the FS hierarchy"""
     pass
 
+class UnknownProjectError(Exception):
+    """No project is registered under the given name"""
+    pass
+
 class TooManyInstancesError(Exception):
     """Too many instances were returned when attempting to get just one"""
     pass
@@ -12,10 +16,30 @@ class NoInstanceFoundError(Exception):
     """No instance matching the given parameters was found"""
     pass
 
+class InstanceNotRunningError(Exception):
+    """The instance isn't running, or couldn't be started"""
+    pass
+
+class NoAddressError(Exception):
+    """The instance has no address on its route"""
+    pass
+
 class UsernameNotFoundError(Exception):
     """aws_ssh was unable to guess the username"""
     pass
 
+class HostUnreachableError(UsernameNotFoundError):
+    """The instance couldn't be reached while guessing the username"""
+    pass
+
+class HostKeyError(UsernameNotFoundError):
+    """The instance's host key didn't match the known one while guessing the username"""
+    pass
+
+class ProbeConfigError(UsernameNotFoundError):
+    """ssh rejected the options used to probe for the username"""
+    pass
+
 class SSHError(Exception):
     """Issues connecting to an instance via SSH"""
     pass
@@ -0,0 +1,117 @@
+"""Run commands on several instances at once"""
+
+from collections import namedtuple
+import fnmatch
+import logging
+import subprocess
+import sys
+import threading
+import time
+
+from aws_ssh.errors import InstanceNotRunningError, NoAddressError, UsernameNotFoundError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 10
+DEFAULT_CONNECT_TIMEOUT = 10 # Seconds
+
+Result = namedtuple('Result', 'name exit_code duration error')
+
+def select_instance_names(instance_names, patterns):
+    """Select the instance names matching any of the given patterns
+
+    :param instance_names: The prefix-less instance names to select from
+    :param patterns: A comma-separated list of instance names or glob patterns
+    :returns: The matching names, sorted
+
+    """
+    patterns = [pattern.strip() for pattern in patterns.split(',') if pattern.strip()]
+    return sorted(name for name in instance_names
+                  if any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns))
+
+class Runner(object):
+    """Runs a command on instances concurrently, streaming prefixed output"""
+
+    def __init__(self, project, command, workers=DEFAULT_WORKERS, connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 out=sys.stdout):
+        """Initialize the runner
+
+        :param project: The project owning the instances
+        :param command: The command to run, as a list of arguments
+        :param workers: The maximum number of instances to run the command on at once
+        :param connect_timeout: The number of seconds to wait for each SSH connection
+        :param out: The stream to which output is written
+
+        """
+        self.project = project
+        self.command = command
+        self.workers = workers
+        self.connect_timeout = connect_timeout
+        self.out = out
+        self._out_lock = threading.Lock()
+
+    def _write(self, name, line):
+        with self._out_lock:
+            self.out.write('{} | {}\n'.format(name, line.rstrip('\r\n')))
+            self.out.flush()
+
+    def get_command(self, instance):
+        """Get the SSH command line for an instance
+
+        :param instance: The instance to run the command on
+        :returns: The command line, as a list of arguments
+
+        """
+        return (['ssh', '-n', '-i', self.project.key_path, '-o', 'BatchMode=yes',
+                 '-o', 'ConnectTimeout={}'.format(self.connect_timeout)] + list(instance.ssh_options) +
+                ['{}@{}'.format(instance.get_user_name(), instance.ip), '--'] + list(self.command))
+
+    def run_one(self, name, instance):
+        """Run the command on a single instance
+
+        :param name: The prefix-less instance name
+        :param instance: The instance, or the exception raised when resolving it
+        :returns: The result
+
+        """
+        start = time.time()
+        if not isinstance(instance, Exception) and not instance.is_running:
+            instance = InstanceNotRunningError('{} is {}'.format(instance.name, instance.state))
+        if isinstance(instance, Exception):
+            return Result(name, None, 0, '{}: {}'.format(instance.__class__.__name__, instance))
+        try:
+            process = subprocess.Popen(self.get_command(instance), stdout=subprocess.PIPE,
+                                       stderr=subprocess.STDOUT)
+        except (OSError, NoAddressError, UsernameNotFoundError) as exc:
+            return Result(name, None, time.time() - start, '{}: {}'.format(exc.__class__.__name__, exc))
+        for line in iter(process.stdout.readline, b''):
+            self._write(name, line.decode('utf-8', 'replace'))
+        process.stdout.close()
+        return Result(name, process.wait(), time.time() - start, None)
+
+    def run(self, instances):
+        """Run the command on the given instances
+
+        :param instances: A dict mapping prefix-less instance names to instances
+        :returns: The results, in name order
+
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self.run_one, name, instances[name]) for name in sorted(instances)]
+            return [future.result() for future in futures]
+
+def write_summary(results, out=sys.stderr):
+    """Write a per-instance summary of exit codes and timings
+
+    :param results: The results of running a command
+    :param out: The stream to which the summary is written
+
+    """
+    width = max([len(result.name) for result in results] + [4])
+    out.write('{:<{width}}  {:>6}  {:>8}\n'.format('HOST', 'EXIT', 'SECONDS', width=width))
+    for result in results:
+        status = 'error' if result.error else result.exit_code
+        out.write('{:<{width}}  {:>6}  {:>8.2f}{}\n'.format(result.name, status, result.duration,
+                                                          '  ' + result.error if result.error else '',
+                                                          width=width))
@@ -0,0 +1,57 @@
+"""Infer instance usernames from their AMIs"""
+
+import fnmatch
+
+# Glob patterns (matched case-insensitively against an AMI's name) and the default username of the matching
+# distributions
+DEFAULT_IMAGE_USERNAMES = (
+    ('*ubuntu*', 'ubuntu'),
+    ('amzn*', 'ec2-user'),
+    ('al2023-*', 'ec2-user'),
+    ('*amazon linux*', 'ec2-user'),
+    ('*centos*', 'centos'),
+    ('debian*', 'admin'),
+    ('rhel*', 'ec2-user'),
+    ('*red hat*', 'ec2-user'),
+    ('suse*', 'ec2-user'),
+    ('*sles*', 'ec2-user'),
+    ('fedora*', 'fedora'),
+    ('rocky*', 'rocky'),
+    ('almalinux*', 'ec2-user'),
+    ('bitnami*', 'bitnami'),
+)
+
+# Platforms (as reported by `PlatformDetails`) with a single default username
+PLATFORM_USERNAMES = {
+    'red hat enterprise linux': 'ec2-user',
+    'suse linux': 'ec2-user',
+}
+
+def _match(patterns, value):
+    value = value.lower()
+    return set(username for pattern, username in patterns if fnmatch.fnmatchcase(value, pattern.lower()))
+
+def infer_username(image_id, platform=None, image=None, mappings=()):
+    """Infer the default username of an AMI
+
+    User-defined mappings take precedence over the built-in ones. Mappings may be keyed by AMI ID, or by a
+    glob pattern matched against the image name.
+
+    :param image_id: The AMI ID
+    :param platform: The instance's `PlatformDetails`, if known
+    :param image: The image's API info, if available
+    :param mappings: A sequence of user-defined (pattern, username) pairs
+    :returns: The username, or `None` if the image is unrecognized or matches several usernames
+
+    """
+    platform = (platform or (image or {}).get('PlatformDetails') or '').lower()
+    if platform.startswith('windows'):
+        return None
+    usernames = _match(mappings, image_id)
+    if not usernames and image and image.get('Name'):
+        usernames = _match(mappings, image['Name']) or _match(DEFAULT_IMAGE_USERNAMES, image['Name'])
+    if not usernames and platform in PLATFORM_USERNAMES:
+        usernames = set([PLATFORM_USERNAMES[platform]])
+    if len(usernames) == 1:
+        return usernames.pop()
+    return None
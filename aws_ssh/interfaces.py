@@ -1,25 +1,60 @@
 """Projects"""
 
-# pylint: disable=protected-access
+# pylint: disable=protected-access,too-many-lines
+# pexpect and tqdm are imported where they are used, so that connecting to a known instance never loads them.
 
+from collections import OrderedDict
 import logging
 import os
 import os.path
+import threading
+import time
 
-from pexpect import pxssh
 import six
 import configparser
-from tqdm import tqdm
 
-from aws_ssh import aws
-from aws_ssh.errors import NoConfigError, ProjectConfigNotFoundError, SSHError, UsernameNotFoundError
+from aws_ssh import aws, timing
+from aws_ssh.cache import (DEFAULT_CACHE_TTL, DEFAULT_MISS_TTL, ImageCache, InstanceCache, MissCache,
+                           RouteCache, trim_resource)
+from aws_ssh.completion import NameIndex, suggest
+from aws_ssh.configfile import read_config, save_config
+from aws_ssh.errors import (InstanceNotRunningError, NoAddressError, NoConfigError, NoInstanceFoundError,
+                            ProjectConfigNotFoundError, SSHError, TooManyInstancesError, UnknownProjectError,
+                            UsernameNotFoundError)
+from aws_ssh.images import infer_username
+from aws_ssh.multiplex import DEFAULT_CONTROL_PERSIST, format_options, get_control_options
+from aws_ssh.network import SSH_PORT, wait_for_port
+from aws_ssh.probe import PROBE_TIMEOUT, ProbeProcesses, check_failure, get_host_key_options
+from aws_ssh.ratelimit import Coalescer
+from aws_ssh.routing import DEFAULT_ROUTE, ROUTES, choose_route, get_addresses, get_network_id
+from aws_ssh.registry import Registry
 
 logger = logging.getLogger(__name__)
 
 DEFAULT_AWSSH_CONFIG = '~/.aws-ssh/config.ini'
 DEFAULT_PROJECT_CONFIG = '.awssshconfig'
+UNCONFIGURED_DIR_TTL = 60 # Seconds
+DEFAULT_START_TIMEOUT = 300 # Seconds to wait for a started instance to accept SSH connections
 
-class Environment(object):
+# The errors remembered by the miss cache, by name
+MISS_ERRORS = {error.__name__: error for error in (NoInstanceFoundError, TooManyInstancesError)}
+
+# Directory -> when it was found to have no project config at or above it
+_UNCONFIGURED_DIRS = {}
+
+def split_address(address):
+    """Split an instance address into its project and instance names
+
+    :param address: Either an instance name, or a `project:instance` pair
+    :returns: The project name (or `None` if unqualified), and the prefix-less instance name
+
+    """
+    if ':' in address:
+        project_name, instance_name = address.split(':', 1)
+        return project_name, instance_name
+    return None, address
+
+class Environment(object): # pylint: disable=too-many-instance-attributes,too-many-public-methods
     """User-level configuration"""
 
     @property
@@ -27,12 +62,89 @@ class Environment(object):
         """The base directory for all private keys"""
         return self._config['DEFAULT'].get('key_dir')
 
+    @property
+    def cache_ttl(self):
+        """The number of seconds for which resolved instances are cached"""
+        return self._config['DEFAULT'].getint('cache_ttl', DEFAULT_CACHE_TTL)
+
+    @property
+    def instance_cache(self):
+        """The cache of resolved instances"""
+        if self._instance_cache is None:
+            self._instance_cache = InstanceCache(ttl=self.cache_ttl)
+        return self._instance_cache
+
+    @property
+    def miss_cache(self):
+        """The cache of missing or ambiguous instance names, whose lifetime is set by `miss_cache_ttl`"""
+        if self._miss_cache is None:
+            ttl = self._config['DEFAULT'].getint('miss_cache_ttl', DEFAULT_MISS_TTL)
+            self._miss_cache = MissCache(ttl=ttl)
+        return self._miss_cache
+
+    @property
+    def coalescer(self):
+        """Coalesces the API requests of concurrent aws-ssh processes"""
+        if self._coalescer is None:
+            self._coalescer = Coalescer()
+        return self._coalescer
+
+    @property
+    def control_options(self):
+        """The ssh options for connection multiplexing, configured by `control_persist` (`no` to disable)"""
+        return get_control_options(self._config['DEFAULT'].get('control_persist', DEFAULT_CONTROL_PERSIST))
+
+    @property
+    def registry(self):
+        """The compiled project registry"""
+        if self._registry is None:
+            self._registry = Registry()
+        return self._registry
+
+    @property
+    def image_cache(self):
+        """The cache of AMI details"""
+        if self._image_cache is None:
+            self._image_cache = ImageCache()
+        return self._image_cache
+
+    @property
+    def route_cache(self):
+        """The cache of routes chosen to reach instances"""
+        if self._route_cache is None:
+            self._route_cache = RouteCache(ttl=self.cache_ttl)
+        return self._route_cache
+
+    @property
+    def name_index(self):
+        """The index of known instance names, for shell completion"""
+        if self._name_index is None:
+            self._name_index = NameIndex()
+        return self._name_index
+
+    @property
+    def image_usernames(self):
+        """User-defined (AMI ID or image name pattern, username) pairs, from the `usernames` section"""
+        if not self._config.has_section('usernames'):
+            return []
+        return [(pattern, self._config['usernames'][pattern]) for pattern in self._config.options('usernames')
+                if not self._config.has_option('DEFAULT', pattern)]
+
+    @timing.timed('Environment')
     def __init__(self, path=DEFAULT_AWSSH_CONFIG):
         self.path = os.path.expanduser(path)
+        self._instance_cache = None
+        self._miss_cache = None
+        self._coalescer = None
+        self._image_cache = None
+        self._route_cache = None
+        self._name_index = None
+        self._registry = None
         self._config = configparser.ConfigParser()
+        self._changes = set() # (section, option) pairs modified since the last save
         if os.path.exists(self.path):
             logger.info("Loading user config file: %s", self.path)
-            self._config.read(self.path)
+            read_config(self._config, self.path)
 
     def is_initialized(self):
         """Determine if the user has configured aws-ssh before."""
@@ -45,10 +157,14 @@ class Environment(object):
 
         """
         self._config['DEFAULT']['key_dir'] = os.path.expanduser(path)
+        self._changes.add(('DEFAULT', 'key_dir'))
 
     def add_project(self, project):
         """Add a project to the system"""
-        self._config["project_{}".format(project.name)] = {'root': project.root}
+        section = "project_{}".format(project.name)
+        self._config[section] = {'root': project.root}
+        self._changes.add((section, None))
+        self.registry.update(project)
 
     def create_project(self, name, prefix, profile_name, root_dir, key_file):
         """Create a project with the given parameters
@@ -68,30 +184,92 @@ class Environment(object):
         return project
 
     def save(self):
-        """Save the configuration to disk"""
-        if not os.path.exists(os.path.dirname(self.path)):
-            os.makedirs(os.path.dirname(self.path))
-        with open(self.path, 'w') as configfile:
-            self._config.write(configfile)
+        """Merge the changed settings into the configuration on disk"""
+        save_config(self._config, self.path, frozenset(self._changes))
+        self._changes.clear()
+
+    def match_project_root(self, path):
+        """Find the registered project root containing a path
+
+        :param path: A directory within a project
+        :returns: The deepest registered root containing the path, or `None` if there is none
+
+        """
+        path = os.path.abspath(path)
+        matches = [root for root in self.get_project_roots().values()
+                   if path == root or path.startswith(root.rstrip(os.sep) + os.sep)]
+        return max(matches, key=len) if matches else None
 
     def find_project(self, path):
         """Find the project configuration in the filesystem hierarchy
 
+        The nearest config wins. The path's ancestors are searched up to the deepest registered root that
+        contains the path, whose config is then taken without being searched for. The search only continues
+        beyond the root if the root has no config.
+
         :param path: The root directory for the project
         :returns: The project in the directory
 
         """
-        project = Project.load(path, self)
+        root = self.match_project_root(path)
+        try:
+            project = Project.load(path, self, root=root)
+        except ProjectConfigNotFoundError:
+            if root is None:
+                raise
+            logger.info('Registered project root %s has no config. Searching its ancestors...', root)
+            project = Project.load(path, self)
         if 'project_{}'.format(project.name) not in self._config:
             logger.info('Project "%s" is not registered. Registering...', project.name)
             self.add_project(project)
             self.save()
+        else:
+            self.registry.update(project) # May predate the registry
         return project
 
+    def get_project(self, name):
+        """Load a registered project by name, directly from its recorded root
+
+        :param name: The project name
+        :returns: The project
+
+        """
+        entry = self.registry.get(name)
+        root = entry['root'] if entry else self.get_project_roots().get(name)
+        if root is None:
+            raise UnknownProjectError(name)
+        project = Project.load_file(os.path.join(root, DEFAULT_PROJECT_CONFIG), self)
+        self.registry.update(project)
+        return project
+
+    def get_project_roots(self):
+        """Get the root directories of all registered projects
+
+        :returns: A dict mapping project names to their root directories
+
+        """
+        return {section[len('project_'):]: self._config[section]['root']
+                for section in self._config.sections()
+                if section.startswith('project_') and self._config.has_option(section, 'root')}
+
+    def get_projects(self):
+        """Load all registered projects, skipping any whose configuration is missing
+
+        :returns: The projects
+
+        """
+        projects = []
+        for name, root in sorted(six.iteritems(self.get_project_roots())):
+            if not os.path.isfile(os.path.join(root, DEFAULT_PROJECT_CONFIG)):
+                logger.warning('Project "%s" is registered, but has no config in %s', name, root)
+                continue
+            projects.append(Project.load(root, self))
+        return projects
+
     def __repr__(self):
         return "Environment[{}]".format(self.path)
 
-class Project(object):
+class Project(object): # pylint: disable=too-many-public-methods
     """A project"""
 
     _usernames = ['ubuntu', 'ec2-user', 'centos', 'root']
@@ -103,7 +281,7 @@ class Project(object):
 
     @name.setter
     def name(self, value):
-        self._config['DEFAULT']['name'] = value
+        self._set_default('name', value)
 
     @property
     def key(self):
@@ -112,7 +290,7 @@ class Project(object):
 
     @key.setter
     def key(self, value):
-        self._config['DEFAULT']['key'] = value
+        self._set_default('key', value)
 
     @property
     def prefix(self):
@@ -121,7 +299,7 @@ class Project(object):
 
     @prefix.setter
     def prefix(self, value):
-        self._config['DEFAULT']['prefix'] = value
+        self._set_default('prefix', value)
 
     @property
     def profile(self):
@@ -130,13 +308,46 @@ class Project(object):
 
     @profile.setter
     def profile(self, value):
-        self._config['DEFAULT']['profile'] = value
+        self._set_default('profile', value)
+
+    @property
+    def region(self):
+        """The AWS region for project API access, or `None` to use the profile's default"""
+        return self._config['DEFAULT'].get('region')
+
+    @property
+    def targets(self):
+        """The (profile, region) pairs across which the project's instances are spread
+
+        These are set via the `targets` option, as whitespace- or comma-separated `profile:region` entries. An
+        omitted profile is the project's own, and an omitted region is the profile's default.
+
+        """
+        value = self._config['DEFAULT'].get('targets')
+        if not value:
+            return [(self.profile, self.region)]
+        targets = []
+        for entry in value.replace(',', ' ').split():
+            profile, _, region = entry.partition(':')
+            targets.append((profile or self.profile, region or None))
+        return targets
+
+    @property
+    def targets_key(self):
+        """Identifies the instances the project resolves, i.e., its prefix and targets"""
+        targets = ['{}:{}'.format(profile, region or '') for profile, region in self.targets]
+        return ' '.join([self.prefix] + targets)
 
     @property
     def key_path(self):
         """Get the full path to the project's auth key"""
         return os.path.join(self._environment.key_dir, self.key)
 
+    @property
+    def ssh_options(self):
+        """Extra command line arguments for ssh connections to project instances"""
+        return format_options(self._environment.control_options)
+
     # pylint: disable=unused-argument,too-many-arguments
     def __init__(self, root, environment, name=None, prefix=None, profile=None, key=None, config=None):
         """Initialize a project.
@@ -151,6 +362,7 @@ class Project(object):
 
         """
         self._config = config or configparser.ConfigParser()
+        self._changes = set() # (section, option) pairs modified since the last save
         if config is None:
             logger.debug('No project config passed in, using initialized params')
             for field in ('name', 'prefix', 'profile', 'key'):
@@ -159,47 +371,88 @@ class Project(object):
                 setattr(self, field, locals()[field])
         self.root = os.path.expanduser(root)
         self._environment = environment
+        self._fleet = None
+        self.target_latencies = {} # (profile, region) -> seconds taken by its most recent API call
+        self._lock = threading.RLock() # Serializes config updates from concurrent instance operations
+
+    def _set_default(self, option, value):
+        self._config['DEFAULT'][option] = value
+        self._changes.add(('DEFAULT', option))
 
     @staticmethod
-    def find_config(directory):
+    @timing.timed('Project.find_config')
+    def find_config(directory, root=None):
         """Find the first project config in the ancestral path.
 
+        Each ancestor costs a single `stat`. Directories with no config at or above them are remembered for
+        `UNCONFIGURED_DIR_TTL` seconds, so repeated misses stop walking early.
+
         :param directory: The directory whose ancestors should be searched
+        :param root: A registered project root containing the directory, whose config is taken as found if no
+                     nearer config exists
 
         :returns: The absolute path to the project config file
         """
-        for fil in os.listdir(directory):
-            if fil == DEFAULT_PROJECT_CONFIG and os.path.isfile(os.path.join(directory, fil)):
-                return os.path.join(directory, fil)
-        parent_dir = os.path.abspath(os.path.join(directory, os.pardir))
-        if parent_dir == directory: # We've hit a filesystem root. No further to traverse.
-            raise ProjectConfigNotFoundError()
-        return Project.find_config(parent_dir)
+        directory = os.path.abspath(directory)
+        visited = []
+        now = time.time()
+        while now - _UNCONFIGURED_DIRS.get(directory, 0) > UNCONFIGURED_DIR_TTL:
+            config_path = os.path.join(directory, DEFAULT_PROJECT_CONFIG)
+            if directory == root or os.path.isfile(config_path):
+                return config_path
+            visited.append(directory)
+            parent_dir = os.path.dirname(directory)
+            if parent_dir == directory: # We've hit a filesystem root. No further to traverse.
+                break
+            directory = parent_dir
+        for visited_dir in visited:
+            _UNCONFIGURED_DIRS[visited_dir] = now
+        raise ProjectConfigNotFoundError()
 
     @classmethod
-    def load(cls, current_dir, environment):
+    @timing.timed('Project.load')
+    def load(cls, current_dir, environment, root=None):
         """Find and load the config file in the given directory's hierachy
 
         :param current_dir: The directory in which the search for a project config should start
         :param environment: The environment to which projects are registered
+        :param root: A registered project root containing the directory (see `find_config`)
         :returns: The project associated with the given path
 
         """
-        config_path = Project.find_config(current_dir)
+        return cls.load_file(Project.find_config(current_dir, root=root), environment)
+
+    @classmethod
+    @timing.timed('Project.load_file')
+    def load_file(cls, config_path, environment):
+        """Load the given project config file
+
+        :param config_path: The path to the project config file
+        :param environment: The environment to which projects are registered
+        :returns: The project
+
+        """
         logger.info('Loading project config file: %s', config_path)
         config = configparser.ConfigParser()
-        config.read(config_path)
+        if not read_config(config, config_path):
+            raise ProjectConfigNotFoundError(config_path)
         return cls(root=os.path.dirname(config_path), environment=environment, config=config)
 
     def set_instance_config(self, instance_name, **kwargs):
-        """Set the configuration of an instance
+        """Set options in the configuration of an instance, keeping its other options (e.g., its `route`)
 
         :param instance_name: The name of the instance
         :param kwargs: The various instance properties to write out
 
         """
-        self._config['instance_{}'.format(instance_name)] = kwargs
-        self.save()
+        with self._lock:
+            section = 'instance_{}'.format(instance_name)
+            if not self._config.has_section(section):
+                self._config.add_section(section)
+            for option, value in six.iteritems(kwargs):
+                self._config.set(section, option, str(value))
+                self._changes.add((section, option))
+            self.save()
 
     def get_instance_config(self, instance_name):
         """Get the configuration for an instance
@@ -213,23 +466,231 @@ class Project(object):
         except KeyError:
             raise NoConfigError(instance_name)
 
+    def forget_inferred_user_name(self, instance_name):
+        """Forget an instance's username if it was inferred from its AMI, which may since have changed
+
+        :param instance_name: The name of the instance
+
+        """
+        section = 'instance_{}'.format(instance_name)
+        with self._lock:
+            if not (self._config.has_section(section)
+                    and self._config[section].getboolean('username_inferred', False)):
+                return
+            logger.debug('Forgetting the inferred username of %s', instance_name)
+            for option in ('username', 'username_inferred'):
+                self._config.remove_option(section, option)
+                self._changes.add((section, option))
+            defaults = self._config.defaults()
+            if all(self._config.get(section, option, raw=True) == defaults.get(option)
+                   for option in self._config.options(section)):
+                self._config.remove_section(section) # Nothing else is set for the instance
+                self._changes.add((section, None))
+            self.save()
+
     def save(self):
-        """Save the project settings"""
-        with open(os.path.join(self.root, DEFAULT_PROJECT_CONFIG), 'w') as configfile:
-            self._config.write(configfile)
+        """Merge the changed project settings into the project config on disk"""
+        with self._lock:
+            save_config(self._config, os.path.join(self.root, DEFAULT_PROJECT_CONFIG),
+                        frozenset(self._changes))
+            self._changes.clear()
+
+    def get_fleet(self, refresh=False):
+        """Get the API info for every instance in the project
+
+        The fleet is fetched with a single paginated sweep per target, with the targets swept concurrently,
+        and is retained for the lifetime of the project, so that any number of instance lookups cost one round
+        of API calls. Every uniquely-named instance is also written to the instance cache, and every name to
+        the name index. Concurrent aws-ssh processes fetching the same fleet share a single sweep.
+
+        :param refresh: Discard any previously-fetched fleet
+        :returns: A dict mapping each prefix-less instance name to the list of matching instances
+
+        """
+        if self._fleet is None or refresh:
+            self._fleet, shared = self._environment.coalescer.call(
+                'fleet:{}'.format(self.targets_key),
+                lambda: aws.get_fleets(self.targets, self.prefix, latencies=self.target_latencies),
+                share=lambda fleet: {name: [trim_resource(instance) for instance in instances]
+                                     for name, instances in six.iteritems(fleet)})
+            logger.debug('Fetched %d instances for %s', len(self._fleet), self)
+            if shared: # The process that swept the fleet has updated the caches
+                return self._fleet
+            self._environment.instance_cache.update(
+                self.profile, self.region, self.prefix,
+                {name: instances[0] for name, instances in six.iteritems(self._fleet) if len(instances) == 1},
+                replace=True)
+            self._environment.name_index.update(self.name, self._fleet, replace=True)
+            self._environment.miss_cache.invalidate(self.profile, self.region, self.prefix)
+        return self._fleet
+
+    def get_cached_fleet(self):
+        """Get the project's instances from the instance cache, without contacting AWS
+
+        :returns: A dict mapping prefix-less instance names to their cached API info, and whether any are
+                  stale
+
+        """
+        return self._environment.instance_cache.get_all(self.profile, self.region, self.prefix)
 
-    def get_instance(self, instance_name):
+    @timing.timed('Project.get_instance')
+    def get_instance(self, instance_name, refresh=False):
         """Get the instance info for the project
 
+        Previously-resolved instances are served from the instance cache without contacting AWS, as are
+        recent failures to find the instance, or to tell it apart from others with the same name. Otherwise,
+        the instance is looked up in the project fleet or, for projects spanning several targets whose fleet
+        hasn't been fetched, in whichever target first reports it.
+
+        :param instance_name: The prefix-less instance name
+        :param refresh: Bypass the instance and miss caches
         :returns: The instance info
 
         """
-        return Instance("{}{}".format(self.prefix, instance_name),
-                        aws.get_instance_info(self.profile, self.prefix, instance_name), self)
+        result = self.lookup_instances([instance_name], refresh=refresh)[instance_name]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def lookup_instances(self, instance_names, refresh=False):
+        """Look up several instances at once, as `get_instance` does
+
+        Instances missing from the caches are found with one sweep of the project fleet, or as `get_instance`
+        finds them when only one is missing.
+
+        :param instance_names: The prefix-less instance names
+        :param refresh: Bypass the instance and miss caches, and the fleet fetched earlier
+        :returns: An ordered dict mapping each name to its instance, or to the `NoInstanceFoundError` or
+                  `TooManyInstancesError` raised when resolving it
+
+        """
+        cache = self._environment.instance_cache
+        misses = self._environment.miss_cache
+        results = OrderedDict()
+        pending = []
+        for instance_name in instance_names:
+            if refresh:
+                cache.invalidate(self.profile, self.region, self.prefix, instance_name)
+                misses.invalidate(self.profile, self.region, self.prefix, instance_name)
+                self.forget_inferred_user_name("{}{}".format(self.prefix, instance_name))
+            else:
+                resource = cache.get(self.profile, self.region, self.prefix, instance_name)
+                if resource is not None:
+                    logger.debug('Serving "%s" from the instance cache', instance_name)
+                    results[instance_name] = Instance("{}{}".format(self.prefix, instance_name), resource,
+                                                      self, cached=True)
+                    continue
+                error = misses.get(self.profile, self.region, self.prefix, instance_name)
+                if error in MISS_ERRORS:
+                    logger.debug('Serving "%s" from the miss cache', instance_name)
+                    results[instance_name] = MISS_ERRORS[error](instance_name)
+                    continue
+            results[instance_name] = None # Placeholder, preserving the order
+            pending.append(instance_name)
+        found = {}
+        if len(pending) == 1:
+            try:
+                found[pending[0]] = self._find_instance(pending[0], refresh=refresh)
+            except (NoInstanceFoundError, TooManyInstancesError) as exc:
+                found[pending[0]] = exc
+        elif pending:
+            fetched = self._fleet is None or refresh
+            fleet = self.get_fleet(refresh=refresh)
+            if not fetched and any(instance_name not in fleet for instance_name in pending):
+                self.get_fleet(refresh=True) # Some may have been launched since the fleet was fetched
+            found = self.get_instances(pending)
+        for instance_name, result in six.iteritems(found):
+            if isinstance(result, (NoInstanceFoundError, TooManyInstancesError)):
+                misses.set(self.profile, self.region, self.prefix, instance_name, result.__class__.__name__)
+            results[instance_name] = result
+        return results
+
+    def _find_instance(self, instance_name, refresh=False):
+        cache = self._environment.instance_cache
+        targets = self.targets
+        if self._fleet is None and len(targets) > 1:
+            def fetch():
+                return aws.find_instance(targets, self.prefix, instance_name, latencies=self.target_latencies)
+            resource, shared = self._environment.coalescer.call(
+                'instance:{}:{}'.format(self.targets_key, instance_name), fetch, share=trim_resource)
+            if shared:
+                return Instance("{}{}".format(self.prefix, instance_name), resource, self)
+            cache.set(self.profile, self.region, self.prefix, instance_name, resource)
+            self._environment.name_index.update(self.name, [instance_name])
+            return Instance("{}{}".format(self.prefix, instance_name), resource, self)
+        fetched = self._fleet is None or refresh
+        instances = self.get_fleet(refresh=refresh).get(instance_name, [])
+        if not instances and not fetched: # It may have been launched since the fleet was fetched
+            logger.debug('"%s" is not in the fleet as last fetched. Fetching it again...', instance_name)
+            instances = self.get_fleet(refresh=True).get(instance_name, [])
+        if not instances:
+            raise NoInstanceFoundError(instance_name)
+        if len(instances) > 1:
+            raise TooManyInstancesError(instance_name)
+        return Instance("{}{}".format(self.prefix, instance_name), instances[0], self)
+
+    def aget_instance(self, instance_name, refresh=False, executor=None):
+        """Get the instance info for the project, from within an event loop (see `aws_ssh.aio.get_instance`)
+
+        :param instance_name: The prefix-less instance name
+        :param refresh: Bypass the instance and miss caches
+        :param executor: The thread pool for the lookup, defaulting to a shared one
+        :returns: A coroutine resolving to the instance info
+
+        """
+        from aws_ssh import aio # Deferred, as it requires Python 3.5+
+        return aio.get_instance(self, instance_name, refresh=refresh, executor=executor)
+
+    def aresolve_many(self, instance_names, refresh=False, usernames=True, executor=None):
+        """Resolve several instances concurrently, from within an event loop (see `aws_ssh.aio.resolve_many`)
+
+        :param instance_names: The prefix-less instance names
+        :param refresh: Bypass the instance and miss caches
+        :param usernames: Also determine each instance's username
+        :param executor: The thread pool for blocking lookups, defaulting to a shared one
+        :returns: A coroutine resolving to an ordered dict mapping each name to its instance, or to the
+                  exception raised when resolving it
+
+        """
+        from aws_ssh import aio
+        return aio.resolve_many(self, instance_names, refresh=refresh, usernames=usernames, executor=executor)
+
+    def suggest_instance_names(self, instance_name, limit=3):
+        """Suggest the names of existing instances resembling one that doesn't exist, without contacting AWS
+
+        :param instance_name: The prefix-less instance name
+        :param limit: The maximum number of suggestions
+        :returns: The prefix-less names of the closest instances in the name index (or instance cache)
+
+        """
+        qualifier = '{}:'.format(self.name)
+        names = [name[len(qualifier):] for name in self._environment.name_index.search(qualifier)]
+        return suggest(instance_name, names or self.get_cached_fleet()[0], limit=limit)
+
+    def get_instances(self, instance_names):
+        """Get several instances from the project fleet at once
+
+        :param instance_names: The prefix-less instance names
+        :returns: A dict mapping each name to its instance, or to the exception raised when resolving it
+
+        """
+        fleet = self.get_fleet()
+        instances = {}
+        for instance_name in instance_names:
+            matches = fleet.get(instance_name, [])
+            if len(matches) == 1:
+                instances[instance_name] = Instance("{}{}".format(self.prefix, instance_name), matches[0],
+                                                    self)
+            elif matches:
+                instances[instance_name] = TooManyInstancesError(instance_name)
+            else:
+                instances[instance_name] = NoInstanceFoundError(instance_name)
+        return instances
 
     def ssh(self, instance_name):
         """SSH into the given instance"""
         # Don't use this for now
+        from pexpect import pxssh
         instance = self.get_instance(instance_name)
         logger.debug(instance)
         try:
@@ -248,23 +709,64 @@ class Project(object):
     def __str__(self):
         return '{cname}<{name}>'.format(cname=self.__class__.__name__, name=self.name)
 
-class Instance(object):
+class Instance(object): # pylint: disable=too-many-instance-attributes
     """A computer to which one can connect"""
 
     @property
     def ip(self):
-        """Get the canonical IP address for the instance.
+        """Get the address at which the instance is reached, according to its route"""
+        if self.route in ('private', 'bastion'):
+            return self.private_ip
+        if self.route == 'ipv6':
+            return get_addresses(self._aws_resource).get('ipv6')
+        return self.public_ip
 
-        In the future, this can be affected by user configuration to return the private IP.
+    @property
+    def route(self):
+        """The route by which the instance is reached, as configured by the `route` option"""
+        if self._route is None:
+            self._route = self._choose_route()
+        return self._route
 
-        """
-        return self.public_ip
+    @property
+    def bastion(self):
+        """The ProxyJump destination used by the `bastion` route, as configured by the `bastion` option"""
+        return self.get_setting('bastion')
+
+    @property
+    def route_options(self):
+        """The ssh options needed to follow the instance's route"""
+        if self.route == 'bastion' and self.bastion:
+            return OrderedDict([('ProxyJump', self.bastion)])
+        return OrderedDict()
+
+    @property
+    def options(self):
+        """The ssh options for connections to the instance, i.e., multiplexing and routing"""
+        options = OrderedDict(self._project._environment.control_options)
+        options.update(self.route_options)
+        return options
+
+    @property
+    def ssh_options(self):
+        """Extra command line arguments for ssh connections to the instance"""
+        return format_options(self.options)
+
+    @property
+    def state(self):
+        """The instance state name (e.g., `running` or `stopped`), or `None` if unknown"""
+        return self._aws_resource.get('State', {}).get('Name')
+
+    @property
+    def is_running(self):
+        """Whether the instance is running, assuming so if its state is unknown"""
+        return self.state in (None, 'running')
 
     @property
     def username(self):
         """The instances username"""
         try:
-            return self._project.get_instance_config(self.name)['username']
+            return self._project.get_instance_config(self.name).get('username')
         except NoConfigError:
             return None
 
@@ -272,42 +774,248 @@ class Instance(object):
     def username(self, value):
         self._project.set_instance_config(self.name, username=value)
 
-    def __init__(self, name, aws_resource, project):
+    def __init__(self, name, aws_resource, project, cached=False):
         """Initialize the instance
 
         :param name: The name of the instance
         :param aws_resource: The AWS API response
         :param project: The owning project
+        :param cached: Whether the AWS API response was served from the instance cache
 
         """
         self._aws_resource = aws_resource
         self._project = project
         self.name = name
-        self.public_ip = aws_resource['PublicIpAddress']
+        self.cached = cached
+        self.instance_id = aws_resource['InstanceId']
+        self.public_ip = aws_resource.get('PublicIpAddress') # Absent while the instance is stopped
+        self.private_ip = aws_resource.get('PrivateIpAddress')
+        self._route = None
+        self.target = tuple(aws_resource.get(aws.TARGET_FIELD) or (project.profile, project.region))
+
+    def get_setting(self, option, default=None):
+        """Get an instance setting, falling back to the project's
+
+        :param option: The setting name
+        :param default: The value if neither the instance nor the project sets it
+        :returns: The setting value
+
+        """
+        try:
+            return self._project.get_instance_config(self.name).get(option, default)
+        except NoConfigError:
+            return self._project._config['DEFAULT'].get(option, default)
+
+    def _choose_route(self):
+        route = self.get_setting('route', DEFAULT_ROUTE)
+        if route not in ROUTES:
+            logger.warning('Unknown route "%s" for %s. Using "%s".', route, self.name, DEFAULT_ROUTE)
+            return DEFAULT_ROUTE
+        if route != 'auto':
+            return route
+        cache = self._project._environment.route_cache
+        network_id = get_network_id()
+        if self.cached: # A fresh lookup re-probes, so that a failed connection picks a new route on retry
+            route = cache.get(network_id, self.instance_id)
+            if route is not None:
+                logger.debug('Using cached route for %s on %s: %s', self.name, network_id, route)
+                return route
+        route = choose_route(get_addresses(self._aws_resource), self.bastion)
+        if route is None:
+            logger.warning('No route to %s is reachable. Using "%s".', self.name, DEFAULT_ROUTE)
+            return DEFAULT_ROUTE
+        logger.debug('Chose route for %s on %s: %s', self.name, network_id, route)
+        cache.set(network_id, self.instance_id, route)
+        return route
+
+    def start(self, timeout=DEFAULT_START_TIMEOUT):
+        """Start the instance if it's stopped, and wait until it accepts SSH connections
+
+        The instance state is polled with an exponential backoff until it's running, at which point its new
+        address is cached and polled until it accepts TCP connections.
+
+        :param timeout: The number of seconds to wait overall
+        :raises InstanceNotRunningError: If the instance doesn't become reachable in time
 
+        """
+        deadline = time.time() + timeout
+        profile_name, region_name = self.target
+        if self.state == 'stopping':
+            aws.wait_for_state(profile_name, self.instance_id, ('stopped',), region_name=region_name,
+                               timeout=timeout)
+        if self.state in ('stopping', 'stopped'):
+            logger.info('Starting %s', self.name)
+            aws.start_instance(profile_name, self.instance_id, region_name=region_name)
+        resource = aws.wait_for_state(profile_name, self.instance_id, ('running',), region_name=region_name,
+                                      timeout=max(deadline - time.time(), 0))
+        resource[aws.TARGET_FIELD] = list(self.target)
+        self._aws_resource = resource
+        self.public_ip = resource.get('PublicIpAddress')
+        self.private_ip = resource.get('PrivateIpAddress')
+        self.cached = False
+        project = self._project
+        project._environment.instance_cache.set(project.profile, project.region, project.prefix,
+                                                self.name[len(project.prefix):], resource)
+        if self.ip is None:
+            raise InstanceNotRunningError('{} has no {} address'.format(self.name, self.route))
+        if self.route == 'bastion': # Only the bastion can reach the instance
+            return
+        if not wait_for_port(self.ip, SSH_PORT, timeout=max(deadline - time.time(), 0)):
+            raise InstanceNotRunningError('{} is running, but not accepting SSH connections'.format(
+                self.name))
+
+    def check_address(self):
+        """Ensure that the instance has an address on its route
+
+        :raises NoAddressError: If it hasn't, e.g., if the instance has no public address on the default route
+
+        """
+        if self.ip is None:
+            raise NoAddressError('{} has no {} address. Set `route = private`, `bastion`, or `auto` in {} to '
+                                 'reach it another way.'.format(self.name, self.route,
+                                                                DEFAULT_PROJECT_CONFIG))
+
+    def get_probe_args(self, username, timeout=PROBE_TIMEOUT):
+        """Get the command testing whether a username authenticates, without prompting for anything
+
+        :param username: The username to test
+        :param timeout: The number of seconds to wait for the connection
+        :returns: The ssh command, as a list, which exits with 0 if the username authenticated
+
+        """
+        return (['ssh', '-i', self._project.key_path, '-l', username, '-o', 'BatchMode=yes',
+                 '-o', 'ConnectTimeout={}'.format(timeout)]
+                + get_host_key_options() # First, as ssh takes the first value given for each option
+                + self.ssh_options + [self.ip, 'true'])
+
+    def get_image(self):
+        """Get the API info for the instance's AMI, consulting the image cache first
+
+        :returns: The image info, or `None` if it is unavailable
+
+        """
+        image_id = self._aws_resource.get('ImageId')
+        if not image_id:
+            return None
+        cache = self._project._environment.image_cache
+        image = cache.get(image_id)
+        if image is None:
+            image = aws.get_image_info(self.target[0], image_id, region_name=self.target[1])
+            if image is not None:
+                cache.set(image_id, image)
+        return image
+
+    def infer_user_name(self):
+        """Infer the username from the instance's AMI, without connecting to the instance
+
+        :returns: The username, or `None` if it cannot be unambiguously inferred
+
+        """
+        image_id = self._aws_resource.get('ImageId')
+        if not image_id:
+            return None
+        platform = self._aws_resource.get('PlatformDetails')
+        mappings = self._project._environment.image_usernames
+        username = infer_username(image_id, platform, mappings=mappings)
+        if username is None:
+            username = infer_username(image_id, platform, image=self.get_image(), mappings=mappings)
+        logger.debug('Inferred username for %s: %s', image_id, username)
+        return username
+
+    def set_user_name(self, username, inferred=False):
+        """Save the username, once it has authenticated
+
+        :param username: The username
+        :param inferred: Whether it was inferred from the instance's AMI, in which case it's forgotten when
+                         the instance is refreshed
+
+        """
+        if inferred:
+            self._project.set_instance_config(self.name, username=username, username_inferred='yes')
+        else:
+            self.username = username
+
+    def _probe_user_names(self, candidates):
+        """Probe candidate usernames concurrently, with non-interactive ssh logins
+
+        The first to authenticate wins, and the remaining probes are killed, as they are as soon as any probe
+        finds the instance unreachable (or its host key changed).
+
+        :param candidates: The usernames to try
+        :returns: The username which authenticated, or `None` if none did
+        :raises HostUnreachableError: If the instance couldn't be reached
+        :raises HostKeyError: If the instance's host key didn't match the known one
+
+        """
+        from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, as_completed
+        from tqdm import tqdm
+        logger.debug('Searching for username within: %s', candidates)
+        # Probes multiplex, so the successful probe's connection persists as the master for the real session
+        commands = OrderedDict((username, self.get_probe_args(username)) for username in candidates)
+        processes = ProbeProcesses()
+        executor = ThreadPoolExecutor(max_workers=len(candidates))
+        try:
+            with tqdm(total=len(candidates)) as progress:
+                progress.set_description('Trying {0}@{1}'.format(','.join(candidates), self.ip))
+                probes = {executor.submit(processes.run, command): username
+                          for username, command in commands.items()}
+                for probe in as_completed(probes, timeout=PROBE_TIMEOUT * 2):
+                    progress.update()
+                    try:
+                        failure, message = probe.result()
+                    except OSError:
+                        logger.debug('Unable to probe username: %s', probes[probe], exc_info=True)
+                        continue
+                    if failure is None:
+                        return probes[probe]
+                    logger.debug('Probe failed (%s) for username %s: %s', failure, probes[probe], message)
+                    check_failure(self.name, failure, message) # Every other username would fail the same way
+        except FutureTimeoutError:
+            logger.debug('Timed out probing usernames for %s', self.name)
+        finally:
+            processes.close()
+            executor.shutdown(wait=False)
+        return None
+
+    @timing.timed('Instance.get_user_name')
     def get_user_name(self):
         """Determine the username of for the instance
 
-        :returns: The username, raises `UsernameNotFoundError` otherwise.
+        A username inferred from the instance's AMI is tried first, on its own. If there is none, or it's
+        rejected, all the candidate usernames are probed concurrently. The username is only saved once it has
+        authenticated.
+
+        :returns: The username, raises `UsernameNotFoundError` (or its `HostUnreachableError` and
+                  `HostKeyError` subclasses) otherwise.
+        :raises NoAddressError: If the instance has no address to probe
 
         """
         if self.username:
             return self.username
-        logger.debug('Searching for username within: %s', self._project._usernames)
-        with tqdm(self._project._usernames) as usernames:
-            for username in usernames:
-                logger.debug('Trying username: %s', username)
-                usernames.set_description('Trying {0}@{1}'.format(username, self.ip))
-                try:
-                    session = pxssh.pxssh(env={'SSH_ASKPASS': ''})
-                    session.login(self.ip, username, ssh_key=self._project.key_path, login_timeout=10,
-                                  quiet=True, auto_prompt_reset=False)
-                    session.logout()
-                    self.username = username
-                    return username
-                except pxssh.ExceptionPxssh:
-                    logger.debug('Auth failed for username: %s', username)
-        raise UsernameNotFoundError()
+        self.check_address()
+        candidates = self._project._usernames
+        inferred = self.infer_user_name()
+        if inferred is not None:
+            if self._probe_user_names([inferred]) == inferred:
+                self.set_user_name(inferred, inferred=True)
+                return inferred
+            logger.debug('Inferred username %s was rejected. Probing the others...', inferred)
+            candidates = [username for username in candidates if username != inferred]
+        username = self._probe_user_names(candidates) if candidates else None
+        if username is None:
+            raise UsernameNotFoundError()
+        self.set_user_name(username)
+        return username
+
+    def aget_user_name(self, executor=None):
+        """Determine the username for the instance, from within an event loop (see `aio.get_user_name`)
+
+        :param executor: The thread pool for blocking lookups, defaulting to a shared one
+        :returns: A coroutine resolving to the username
+
+        """
+        from aws_ssh import aio
+        return aio.get_user_name(self, executor=executor)
 
     def __repr__(self):
         return str(self.__dict__)
@@ -0,0 +1,50 @@
+"""OpenSSH connection multiplexing
+
+Connections to an instance share a single master connection (and thus a single TCP and SSH handshake) via a
+control socket under `~/.aws-ssh/cm/`. The master outlives the connection that created it for a configurable
+period, so that repeat connections, scp, and rsync are near-instant.
+
+"""
+
+from collections import OrderedDict
+import os
+import os.path
+
+from aws_ssh.cache import make_dirs
+
+DEFAULT_CONTROL_DIR = '~/.aws-ssh/cm'
+DEFAULT_CONTROL_PERSIST = '10m'
+
+def get_control_options(persist=DEFAULT_CONTROL_PERSIST, directory=DEFAULT_CONTROL_DIR):
+    """Get the ssh options enabling connection multiplexing, creating the control socket directory if needed
+
+    :param persist: How long an idle master connection is kept open (an OpenSSH ControlPersist value), or `no`
+        to disable multiplexing
+    :param directory: The directory containing the control sockets
+    :returns: An ordered dict of ssh options
+
+    """
+    if persist == 'no':
+        return OrderedDict()
+    directory = os.path.expanduser(directory)
+    if not os.path.isdir(directory):
+        make_dirs(directory) # Tolerating another process creating it at the same time
+        os.chmod(directory, 0o700) # Only the owner may use the control sockets
+    return OrderedDict([
+        ('ControlMaster', 'auto'),
+        # %C hashes the local host, remote host, port, and user, keeping the path short enough for a socket
+        ('ControlPath', os.path.join(directory, '%C')),
+        ('ControlPersist', persist),
+    ])
+
+def format_options(options):
+    """Format ssh options as command line arguments
+
+    :param options: A dict of ssh options
+    :returns: The arguments, as a list
+
+    """
+    args = []
+    for key, value in options.items():
+        args.extend(['-o', '{}={}'.format(key, value)])
+    return args
@@ -0,0 +1,36 @@
+"""Network reachability checks"""
+
+import logging
+import socket
+import time
+
+logger = logging.getLogger(__name__)
+
+SSH_PORT = 22
+INITIAL_DELAY = 0.25 # Seconds between the first attempts, doubling thereafter
+MAX_DELAY = 4 # Seconds
+
+def wait_for_port(host, port=SSH_PORT, timeout=120, connect_timeout=2):
+    """Wait until a TCP port accepts connections, backing off exponentially between attempts
+
+    :param host: The host to connect to
+    :param port: The port to connect to
+    :param timeout: The number of seconds to wait overall
+    :param connect_timeout: The number of seconds to wait for each connection attempt
+    :returns: Whether the port accepted a connection before the timeout
+
+    """
+    deadline = time.time() + timeout
+    delay = INITIAL_DELAY
+    while True:
+        attempt_timeout = min(connect_timeout, max(deadline - time.time(), 0.1))
+        try:
+            connection = socket.create_connection((host, port), timeout=attempt_timeout)
+            connection.close()
+            return True
+        except (socket.error, socket.timeout) as exc:
+            logger.debug('%s:%d not ready: %s', host, port, exc)
+        if time.time() + delay > deadline:
+            return False
+        time.sleep(delay)
+        delay = min(delay * 2, MAX_DELAY)
@@ -0,0 +1,295 @@
+"""An interactive, fuzzy-filtering picker, drawn on the controlling terminal
+
+The picker is drawn on `/dev/tty` rather than stdout, as the shell wrappers capture the CLI's stdout. Its
+items may be replaced while it's open (e.g., once a background refresh completes) without interrupting the
+user.
+
+"""
+
+import fcntl
+import heapq
+import operator
+import os
+import select
+import struct
+import termios
+import threading
+
+DEFAULT_HEIGHT = 15 # Rows of matches shown at once
+POLL_INTERVAL = 0.1 # Seconds between checks for replaced items
+
+# Key bindings
+ENTER = ('\r', '\n')
+CANCEL = ('\x1b', '\x03', '\x04', '\x07') # Escape, ^C, ^D, ^G
+UP = ('\x1b[A', '\x1bOA', '\x10') # Arrow, ^P
+DOWN = ('\x1b[B', '\x1bOB', '\x0e') # Arrow, ^N
+BACKSPACE = ('\x7f', '\x08')
+CLEAR = ('\x15',) # ^U
+
+def fuzzy_score(query, text):
+    """Score how well a query matches some text, as a case-insensitive subsequence
+
+    Consecutive matches and matches at the start of words score higher, and skipped characters lower.
+
+    :param query: The query
+    :param text: The text to match
+    :returns: The score, where higher is better, or `None` if the text doesn't match
+
+    """
+    text = text.lower()
+    score = 0
+    position = 0
+    for char in query.lower():
+        index = text.find(char, position)
+        if index < 0:
+            return None
+        if index == position > 0:
+            score += 3
+        if index == 0 or not text[index - 1].isalnum():
+            score += 2
+        score -= min(index - position, 3)
+        position = index + 1
+    return score
+
+class FuzzyFilter(object):
+    """Filters items by a query, only rescanning the previous matches while the query is being extended"""
+
+    def __init__(self, items, key=lambda item: item):
+        """Initialize the filter
+
+        :param items: The items to filter
+        :param key: A function getting the text to match from an item
+
+        """
+        self.key = key
+        self.items = []
+        self._query = None
+        self._matches = []
+        self.set_items(items)
+
+    def set_items(self, items):
+        """Replace the items to filter
+
+        :param items: The items
+
+        """
+        self.items = list(items)
+        self._query = None
+        self._matches = self.items
+
+    def filter(self, query, limit=None):
+        """Get the items matching a query, best first
+
+        :param query: The query
+        :param limit: The maximum number of items to return
+        :returns: The number of matching items, and the best matches
+
+        """
+        candidates = self.items
+        if self._query is not None and query.startswith(self._query):
+            candidates = self._matches
+        scored = []
+        for item in candidates:
+            text = self.key(item)
+            score = fuzzy_score(query, text)
+            if score is not None:
+                scored.append((-score, len(text), text, item))
+        self._query = query
+        self._matches = [entry[3] for entry in scored]
+        sort_key = operator.itemgetter(0, 1, 2)
+        best = heapq.nsmallest(limit, scored, key=sort_key) if limit else sorted(scored, key=sort_key)
+        return len(scored), [entry[3] for entry in best]
+
+class Picker(object): # pylint: disable=too-many-instance-attributes
+    """An interactive picker"""
+
+    def __init__(self, items, key=lambda item: item, height=DEFAULT_HEIGHT, prompt='> '):
+        """Initialize the picker
+
+        :param items: The items to pick from
+        :param key: A function getting the text to display (and match) for an item
+        :param height: The number of matches shown at once
+        :param prompt: The text preceding the query
+
+        """
+        self.filter = FuzzyFilter(items, key)
+        self.key = key
+        self.height = height
+        self.prompt = prompt
+        self.query = ''
+        self.selected = 0
+        self.status = ''
+        self._count = 0
+        self._matches = []
+        self._pending = None
+        self._lock = threading.Lock()
+        self._refilter()
+
+    def update(self, items, status=''):
+        """Replace the items, from any thread
+
+        :param items: The new items
+        :param status: A note shown alongside the match count
+
+        """
+        with self._lock:
+            self._pending = (list(items), status)
+
+    def _apply_update(self):
+        with self._lock:
+            pending, self._pending = self._pending, None
+        if pending is None:
+            return False
+        selected = self._matches[self.selected] if self._matches else None
+        self.filter.set_items(pending[0])
+        self.status = pending[1]
+        self._refilter()
+        if selected in self._matches: # Keep the selection stable across refreshes
+            self.selected = self._matches.index(selected)
+        return True
+
+    def _refilter(self):
+        self._count, self._matches = self.filter.filter(self.query, limit=self.height)
+        self.selected = min(self.selected, max(len(self._matches) - 1, 0))
+
+    def handle_key(self, key):
+        """Handle a key press
+
+        :param key: The key, or escape sequence
+        :returns: `True` to pick the selection, `False` to cancel, or `None` to continue
+
+        """
+        if key in ENTER:
+            return bool(self._matches)
+        if key in CANCEL:
+            return False
+        if key in UP:
+            self.selected = max(self.selected - 1, 0)
+        elif key in DOWN:
+            self.selected = min(self.selected + 1, max(len(self._matches) - 1, 0))
+        elif key in BACKSPACE:
+            self.query = self.query[:-1]
+            self.selected = 0
+            self._refilter()
+        elif key in CLEAR:
+            self.query = ''
+            self.selected = 0
+            self._refilter()
+        elif len(key) == 1 and key >= ' ' and key != '\x7f':
+            self.query += key
+            self.selected = 0
+            self._refilter()
+        return None
+
+    @property
+    def selection(self):
+        """The selected item, or `None` if nothing matches"""
+        return self._matches[self.selected] if self._matches else None
+
+    def render(self, width):
+        """Render the picker
+
+        :param width: The terminal width
+        :returns: The lines to draw, starting with the prompt
+
+        """
+        counts = '  {}/{}{}'.format(self._count, len(self.filter.items),
+                                    ' ({})'.format(self.status) if self.status else '')
+        lines = [(self.prompt + self.query + counts)[:width - 1]]
+        for index in range(self.height):
+            if index >= len(self._matches):
+                lines.append('')
+                continue
+            text = self.key(self._matches[index])[:width - 3]
+            lines.append('\x1b[7m> {}\x1b[0m'.format(text) if index == self.selected else '  ' + text)
+        return lines
+
+    def run(self, tty_path='/dev/tty'):
+        """Show the picker until something is picked or the user cancels
+
+        :param tty_path: The terminal to draw on and read keys from
+        :returns: The picked item, or `None` if cancelled
+
+        """
+        descriptor = os.open(tty_path, os.O_RDWR | os.O_NOCTTY)
+        attributes = termios.tcgetattr(descriptor)
+        try:
+            raw = termios.tcgetattr(descriptor)
+            raw[3] &= ~(termios.ICANON | termios.ECHO) # Unbuffered input, without echo
+            termios.tcsetattr(descriptor, termios.TCSANOW, raw)
+            os.write(descriptor, b'\n' * self.height + '\x1b[{}A'.format(self.height).encode('ascii'))
+            try:
+                return self._loop(descriptor)
+            except KeyboardInterrupt:
+                return None
+            finally:
+                os.write(descriptor, b'\r\x1b[J') # Erase the picker
+        finally:
+            termios.tcsetattr(descriptor, termios.TCSANOW, attributes)
+            os.close(descriptor)
+
+    def _loop(self, descriptor):
+        self._draw(descriptor)
+        while True:
+            readable = select.select([descriptor], [], [], POLL_INTERVAL)[0]
+            redraw = self._apply_update()
+            if readable:
+                data = os.read(descriptor, 1024).decode('utf-8', 'ignore')
+                for key in split_keys(data):
+                    result = self.handle_key(key)
+                    if result is not None:
+                        return self.selection if result else None
+                redraw = True
+            if redraw:
+                self._draw(descriptor)
+
+    def _draw(self, descriptor):
+        width = get_width(descriptor)
+        lines = self.render(width)
+        output = '\r' + '\n'.join('\x1b[2K' + line for line in lines)
+        output += '\x1b[{}A\r\x1b[{}C'.format(len(lines) - 1, len(self.prompt) + len(self.query))
+        os.write(descriptor, output.encode('utf-8'))
+
+def format_table(rows):
+    """Align rows of text into columns
+
+    :param rows: The rows, as tuples of strings
+    :returns: The aligned lines
+
+    """
+    if not rows:
+        return []
+    widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+    return ['  '.join(value.ljust(width) for value, width in zip(row, widths)).rstrip() for row in rows]
+
+def split_keys(data):
+    """Split terminal input into individual keys, keeping escape sequences together
+
+    :param data: The input
+    :returns: The keys
+
+    """
+    keys = []
+    index = 0
+    while index < len(data):
+        if data[index] == '\x1b' and data[index + 1:index + 2] in ('[', 'O') and index + 2 < len(data):
+            keys.append(data[index:index + 3])
+            index += 3
+        else:
+            keys.append(data[index])
+            index += 1
+    return keys
+
+def get_width(descriptor, default=80):
+    """Get the width of a terminal
+
+    :param descriptor: The terminal's file descriptor
+    :param default: The width if it can't be determined
+    :returns: The number of columns
+
+    """
+    try:
+        columns = struct.unpack('hhhh', fcntl.ioctl(descriptor, termios.TIOCGWINSZ, b'\0' * 8))[1]
+    except (IOError, OSError):
+        return default
+    return columns or default
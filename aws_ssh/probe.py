@@ -0,0 +1,167 @@
+"""Non-interactive checks of whether a username authenticates with an instance
+
+Each check runs `ssh ... true` in batch mode, which fails rather than prompting, and classifies any failure
+from ssh's exit status and error output. Failures that would befall every username (an unreachable host, a
+changed host key, or options the local ssh doesn't support) are told apart from rejected usernames, so that a
+search for the username can end at once.
+
+Probes record new host keys in `/dev/null`, listed before the user's known hosts files, so that concurrent
+probes never write to the user's `known_hosts`. OpenSSH 7.6 and later accept a new host key while still
+refusing a changed one. Older versions (or unrecognized ssh implementations) can only accept any key, so
+their probes don't become the master connection which the real session would reuse, leaving the real session
+to check the host key itself.
+
+"""
+
+import logging
+import os
+import re
+import subprocess
+import tempfile
+import threading
+
+from aws_ssh.errors import HostKeyError, HostUnreachableError, ProbeConfigError
+
+logger = logging.getLogger(__name__)
+
+# Failure kinds
+AUTH_FAILED = 'auth'
+NETWORK_FAILED = 'network'
+HOST_KEY_FAILED = 'host-key'
+CONFIG_FAILED = 'config'
+
+PROBE_TIMEOUT = 10 # Seconds to wait for each probe to connect
+SSH_ERROR = 255 # ssh's exit status for its own errors, as opposed to those of the remote command
+HOST_KEY_ERRORS = ('Host key verification failed', 'REMOTE HOST IDENTIFICATION HAS CHANGED')
+NETWORK_ERRORS = ('ssh: connect to host', 'Could not resolve hostname', 'Network is unreachable',
+                  'No route to host', 'Connection timed out')
+CONFIG_ERRORS = ('Bad configuration option', 'unsupported option', 'Unsupported option')
+
+ACCEPT_NEW_VERSION = (7, 6) # The first OpenSSH version supporting `StrictHostKeyChecking=accept-new`
+USER_KNOWN_HOSTS = ('~/.ssh/known_hosts', '~/.ssh/known_hosts2') # ssh's default `UserKnownHostsFile`
+
+_VERSION_LOCK = threading.Lock()
+_versions = {} # ssh command -> OpenSSH version, or `None` if unrecognized
+
+def get_ssh_version(command='ssh'):
+    """Get the version of the local OpenSSH client, running it once per process
+
+    :param command: The ssh command
+    :returns: The (major, minor) version, or `None` if it isn't OpenSSH, or can't be run
+
+    """
+    with _VERSION_LOCK:
+        if command not in _versions:
+            try:
+                process = subprocess.Popen([command, '-V'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+                output = process.communicate()[0].decode('utf-8', 'replace')
+            except OSError as exc:
+                logger.debug('Unable to run %s: %s', command, exc)
+                output = ''
+            match = re.search(r'OpenSSH_(\d+)\.(\d+)', output)
+            _versions[command] = (int(match.group(1)), int(match.group(2))) if match else None
+            logger.debug('ssh version: %s', _versions[command])
+        return _versions[command]
+
+def get_host_key_options():
+    """Get the ssh options with which a probe checks the instance's host key
+
+    :returns: The options, as a list of command line arguments
+
+    """
+    files = ' '.join((os.devnull,) + USER_KNOWN_HOSTS) # New host keys are added to the first
+    version = get_ssh_version()
+    if version is not None and version >= ACCEPT_NEW_VERSION:
+        return ['-o', 'StrictHostKeyChecking=accept-new', '-o', 'UserKnownHostsFile={}'.format(files)]
+    # Any host key is accepted, so this connection mustn't be shared with the real session
+    return ['-o', 'StrictHostKeyChecking=no', '-o', 'UserKnownHostsFile={}'.format(files),
+            '-o', 'ControlMaster=no']
+
+def classify(returncode, stderr):
+    """Classify the outcome of a probe
+
+    A session that was opened, but whose command failed, counts as a rejected username: some AMIs accept
+    logins as `root` only to print the username to use instead.
+
+    :param returncode: The ssh exit status
+    :param stderr: The ssh error output
+    :returns: `None` if the username authenticated, otherwise the kind of failure
+
+    """
+    if returncode == 0:
+        return None
+    if returncode == SSH_ERROR:
+        if any(message in stderr for message in CONFIG_ERRORS):
+            return CONFIG_FAILED
+        if any(message in stderr for message in HOST_KEY_ERRORS):
+            return HOST_KEY_FAILED
+        if any(message in stderr for message in NETWORK_ERRORS):
+            return NETWORK_FAILED
+    return AUTH_FAILED
+
+def describe(stderr):
+    """Get the gist of a probe's error output, i.e., its last non-empty line"""
+    lines = [line.strip() for line in stderr.splitlines() if line.strip()]
+    return lines[-1] if lines else ''
+
+def check_failure(name, failure, message):
+    """Raise an error for a probe failure that every username would meet
+
+    :param name: The instance name
+    :param failure: The kind of failure
+    :param message: The gist of ssh's error output
+    :raises HostUnreachableError: If the instance couldn't be reached
+    :raises HostKeyError: If the instance's host key didn't match the known one
+    :raises ProbeConfigError: If ssh rejected the probe's options
+
+    """
+    if failure == NETWORK_FAILED:
+        raise HostUnreachableError('Unable to reach {}: {}'.format(name, message))
+    if failure == HOST_KEY_FAILED:
+        raise HostKeyError('The host key of {} has changed: {}'.format(name, message))
+    if failure == CONFIG_FAILED:
+        raise ProbeConfigError('Unable to probe {name} for its username, as ssh rejected an option '
+                               '({message}). Set `username` in the [instance_{name}] section of its project '
+                               'config.'.format(name=name, message=message))
+
+class ProbeProcesses(object):
+    """Runs probes as ssh processes, tracking those in flight so that the losers can be killed"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._processes = []
+        self._closed = False
+
+    def run(self, args):
+        """Run a probe to completion
+
+        :param args: The probe's ssh command
+        :returns: The kind of failure (or `None` if the username authenticated), and the gist of ssh's error
+                  output
+        :raises OSError: If the probes have been torn down, or ssh can't be run
+
+        """
+        # ssh's error output goes to a file rather than a pipe, which a backgrounded master connection could
+        # hold open
+        with open(os.devnull, 'r+b') as devnull, tempfile.TemporaryFile() as errors:
+            with self._lock:
+                if self._closed:
+                    raise OSError('Probe cancelled')
+                process = subprocess.Popen(args, stdin=devnull, stdout=devnull, stderr=errors)
+                self._processes.append(process)
+            returncode = process.wait()
+            errors.seek(0)
+            stderr = errors.read().decode('utf-8', 'replace')
+        return classify(returncode, stderr), describe(stderr)
+
+    def close(self):
+        """Kill every probe still in flight"""
+        with self._lock:
+            self._closed = True
+            processes, self._processes = self._processes, []
+        for process in processes:
+            if process.poll() is None:
+                try:
+                    process.kill()
+                except OSError:
+                    logger.debug('Unable to kill probe process', exc_info=True)
@@ -0,0 +1,183 @@
+"""Limits on the EC2 API load generated by every aws-ssh process on the machine
+
+Under heavy use (e.g., automation opening many sessions at once), EC2 throttles requests with
+`RequestLimitExceeded`. Requests are paced by a token bucket persisted in `~/.aws-ssh/`, so that all processes
+draw from the same budget, and identical requests made concurrently by several processes are coalesced into
+one, whose result they all share.
+
+The pace is set by the `api_rate` and `api_burst` settings of `~/.aws-ssh/config.ini`, which the
+`AWS_SSH_API_RATE` and `AWS_SSH_API_BURST` environment variables override.
+
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import time
+
+import configparser
+
+from aws_ssh.cache import DEFAULT_CACHE_DIR, locked, read_json, write_json
+from aws_ssh.configfile import get_identity, read_config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKET = '~/.aws-ssh/ratelimit.json'
+DEFAULT_RATE = 5 # Requests per second, sustained
+DEFAULT_BURST = 20 # Requests made back to back before pacing begins
+DEFAULT_INFLIGHT_DIR = os.path.join(DEFAULT_CACHE_DIR, 'inflight')
+DEFAULT_CONFIG = '~/.aws-ssh/config.ini' # The user config, as for `interfaces.Environment`
+RATE_VARIABLE = 'AWS_SSH_API_RATE' # Overrides `api_rate`
+BURST_VARIABLE = 'AWS_SSH_API_BURST' # Overrides `api_burst`
+
+_LIMITS_LOCK = threading.Lock()
+_limits = {} # Config path -> its identity, and the (rate, burst) it configures
+
+def _read_limit(variable, convert, default):
+    value = os.environ.get(variable)
+    if value is None:
+        return default
+    try:
+        limit = convert(value)
+    except ValueError:
+        limit = 0
+    if limit <= 0:
+        logger.warning('Ignoring %s=%s, which is not a positive number', variable, value)
+        return default
+    return limit
+
+def _read_config(path, cache_dir):
+    config = configparser.ConfigParser()
+    if not read_config(config, path, cache_dir=cache_dir):
+        return DEFAULT_RATE, DEFAULT_BURST
+    try:
+        rate = config['DEFAULT'].getfloat('api_rate', DEFAULT_RATE)
+        burst = config['DEFAULT'].getint('api_burst', DEFAULT_BURST)
+    except ValueError:
+        rate = burst = 0
+    if rate <= 0 or burst <= 0:
+        logger.warning('Ignoring the api_rate and api_burst settings in %s, which must be positive numbers',
+                       path)
+        return DEFAULT_RATE, DEFAULT_BURST
+    return rate, burst
+
+def get_limits(path=DEFAULT_CONFIG, cache_dir=DEFAULT_CACHE_DIR):
+    """Get the pace of API requests, as configured by the `api_rate` and `api_burst` settings, unless the
+    environment overrides them
+
+    The config is only read again once it changes.
+
+    :param path: The user config
+    :param cache_dir: The directory containing config snapshots
+    :returns: The number of requests per second, and the number made back to back before pacing begins
+
+    """
+    path = os.path.expanduser(path)
+    identity = get_identity(path)
+    with _LIMITS_LOCK:
+        if path not in _limits or _limits[path][0] != identity:
+            _limits[path] = identity, _read_config(path, cache_dir)
+        rate, burst = _limits[path][1]
+    return _read_limit(RATE_VARIABLE, float, rate), _read_limit(BURST_VARIABLE, int, burst)
+
+class TokenBucket(object):
+    """A rate limit shared between processes
+
+    Each request reserves a token, going into debt if none are left, and then waits until its token would have
+    been refilled. Concurrent requests therefore queue up, spaced evenly, rather than retrying in a herd.
+
+    """
+
+    def __init__(self, path=DEFAULT_BUCKET, rate=DEFAULT_RATE, burst=DEFAULT_BURST):
+        """Initialize the bucket
+
+        :param path: The file holding the bucket's state (its lock file alongside)
+        :param rate: The number of tokens refilled per second
+        :param burst: The number of tokens the bucket holds when full
+
+        """
+        self.path = os.path.expanduser(path)
+        self.rate = rate
+        self.burst = burst
+
+    def reserve(self):
+        """Reserve a token
+
+        :returns: The number of seconds to wait before using it
+
+        """
+        with locked(self.path + '.lock', required=False):
+            state = read_json(self.path) or {}
+            now = time.time()
+            elapsed = max(now - state.get('updated', now), 0)
+            tokens = min(state.get('tokens', self.burst) + elapsed * self.rate, self.burst) - 1
+            try:
+                write_json(self.path, {'tokens': tokens, 'updated': now})
+            except (IOError, OSError) as exc:
+                logger.debug('Unable to write the rate limit: %s', exc)
+        return max(-tokens, 0) / float(self.rate)
+
+    def acquire(self):
+        """Wait until a request may be made"""
+        delay = self.reserve()
+        if delay:
+            logger.debug('Waiting %.2fs for the API rate limit', delay)
+            time.sleep(delay)
+
+class Coalescer(object): # pylint: disable=too-few-public-methods
+    """Coalesces identical requests made concurrently by several processes into one, whose result they share
+
+    The first process to make a request holds a lock for the request's key until it completes. Processes
+    making the same request in the meantime mark that they have joined it, and wait for the lock. The result
+    is only written out if some process joined, which then takes it rather than repeating the request.
+
+    """
+
+    def __init__(self, directory=DEFAULT_INFLIGHT_DIR):
+        """Initialize the coalescer
+
+        :param directory: The directory in which results are shared
+
+        """
+        self.directory = os.path.expanduser(directory)
+
+    def call(self, key, fetch, share=None):
+        """Make a request, unless an identical one in flight in another process completes first
+
+        :param key: Identifies the request
+        :param fetch: Makes the request, returning its result
+        :param share: Converts the result into the JSON-serializable form shared with other processes,
+                      defaulting to the result itself
+        :returns: The result (or, if shared, its shared form), and whether it was shared by another process
+
+        """
+        path = self._get_path(key)
+        joined = path + '.joined'
+        requested = time.time()
+        with locked(path + '.lock', required=False, on_wait=lambda: self._join(key, joined)):
+            shared = read_json(path)
+            if shared is not None and shared.get('key') == key and shared.get('completed_at', 0) >= requested:
+                logger.debug('Sharing the result of a concurrent request for %s', key)
+                return shared['result'], True
+            result = fetch()
+            if os.path.exists(joined):
+                try:
+                    os.remove(joined)
+                    write_json(path, {'key': key, 'completed_at': time.time(),
+                                      'result': share(result) if share else result})
+                except (IOError, OSError) as exc:
+                    logger.debug('Unable to share the result for %s: %s', key, exc)
+        return result, False
+
+    def _get_path(self, key):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.directory, '{}.json'.format(digest))
+
+    @staticmethod
+    def _join(key, joined):
+        logger.debug('Waiting for a concurrent request for %s', key)
+        try:
+            open(joined, 'a').close()
+        except (IOError, OSError) as exc:
+            logger.debug('Unable to join the request for %s: %s', key, exc)
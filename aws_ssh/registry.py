@@ -0,0 +1,67 @@
+"""The compiled project registry
+
+A JSON index of every registered project's root directory, so that any project can be found by name, from any
+directory, without walking the filesystem or parsing the user config. Project settings aren't duplicated here:
+they're always read from the project's own config, whose parsed snapshot is just as quick to load.
+
+"""
+
+import logging
+import os.path
+
+from aws_ssh.cache import locked, read_json, write_json
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REGISTRY = '~/.aws-ssh/registry.json'
+
+class Registry(object):
+    """Maps project names to their root directories"""
+
+    @property
+    def projects(self):
+        """The registered projects, as a dict mapping names to their entries"""
+        if self._projects is None:
+            self._projects = read_json(self.path) or {}
+        return self._projects
+
+    def __init__(self, path=DEFAULT_REGISTRY):
+        """Initialize the registry
+
+        :param path: The registry file
+
+        """
+        self.path = os.path.expanduser(path)
+        self._projects = None
+
+    def get(self, name):
+        """Get a registered project's entry
+
+        :param name: The project name
+        :returns: A dict of the project's root, or `None` if it is not registered
+
+        """
+        return self.projects.get(name)
+
+    def update(self, project):
+        """Register a project, writing the registry only if the project's entry changed
+
+        The registry is re-read under an exclusive lock, so that projects registered concurrently by other
+        processes are kept.
+
+        :param project: The project
+
+        """
+        entry = {'root': project.root}
+        if self.projects.get(project.name) == entry:
+            return
+        try:
+            with locked(self.path + '.lock'):
+                projects = read_json(self.path) or {}
+                projects[project.name] = entry
+                write_json(self.path, projects)
+        except (IOError, OSError) as exc:
+            logger.warning('Unable to write the project registry: %s', exc)
+            self.projects[project.name] = entry
+            return
+        self._projects = projects
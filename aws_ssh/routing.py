@@ -0,0 +1,135 @@
+"""Choosing the route by which an instance is reached
+
+Each project, or instance, picks a route via the `route` option:
+
+* `public` (the default) connects to the public IPv4 address
+* `private` connects to the private IPv4 address (e.g., over a VPN or from within the VPC)
+* `ipv6` connects to the IPv6 address
+* `bastion` connects to the private IPv4 address through the `bastion` host, via ssh's ProxyJump
+* `auto` measures the TCP connect latency of every candidate route concurrently, and picks the fastest. The
+  bastion is only used if no address is directly reachable. Decisions are cached per local network.
+
+"""
+
+from collections import OrderedDict
+import logging
+import socket
+import struct
+import time
+
+from aws_ssh.network import SSH_PORT
+
+logger = logging.getLogger(__name__)
+
+ROUTES = ('public', 'private', 'ipv6', 'bastion', 'auto')
+DEFAULT_ROUTE = 'public'
+PROBE_TIMEOUT = 1 # Seconds to wait for each candidate route to accept a connection
+
+def get_addresses(resource):
+    """Get the addresses at which an instance may be directly reached
+
+    :param resource: The instance's API info
+    :returns: An ordered dict mapping direct routes to addresses, omitting those the instance lacks
+
+    """
+    ipv6 = resource.get('Ipv6Address')
+    if not ipv6:
+        for interface in resource.get('NetworkInterfaces', []):
+            for address in interface.get('Ipv6Addresses', []):
+                ipv6 = ipv6 or address.get('Ipv6Address')
+    addresses = OrderedDict([('public', resource.get('PublicIpAddress')),
+                             ('private', resource.get('PrivateIpAddress')),
+                             ('ipv6', ipv6)])
+    return OrderedDict((route, address) for route, address in addresses.items() if address)
+
+def split_bastion(bastion):
+    """Split a ProxyJump destination into the host and port to probe
+
+    :param bastion: The bastion, as `[user@]host[:port]`
+    :returns: The host and port
+
+    """
+    host = bastion.rsplit('@', 1)[-1]
+    if host.startswith('['): # [IPv6 address]:port
+        host, _, port = host[1:].partition(']')
+        port = port.lstrip(':')
+    elif host.count(':') == 1:
+        host, port = host.split(':')
+    else:
+        port = None
+    return host, int(port) if port else SSH_PORT
+
+def measure_latency(host, port=SSH_PORT, timeout=PROBE_TIMEOUT):
+    """Measure how long a TCP connection takes to establish
+
+    :param host: The host to connect to
+    :param port: The port to connect to
+    :param timeout: The number of seconds to wait
+    :returns: The number of seconds taken, or `None` if the host is unreachable
+
+    """
+    started = time.time()
+    try:
+        socket.create_connection((host, port), timeout=timeout).close()
+    except (socket.error, socket.timeout) as exc:
+        logger.debug('%s:%d is unreachable: %s', host, port, exc)
+        return None
+    return time.time() - started
+
+def choose_route(addresses, bastion=None, timeout=PROBE_TIMEOUT):
+    """Choose the fastest reachable route, probing all candidates concurrently
+
+    :param addresses: An ordered dict mapping direct routes to addresses, as from `get_addresses`
+    :param bastion: The bastion, as `[user@]host[:port]`, if one is configured
+    :param timeout: The number of seconds to wait for each candidate
+    :returns: The route, or `None` if nothing is reachable
+
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    candidates = OrderedDict((route, (address, SSH_PORT)) for route, address in addresses.items())
+    if bastion:
+        candidates['bastion'] = split_bastion(bastion)
+    if not candidates:
+        return None
+    with ThreadPoolExecutor(max_workers=len(candidates)) as executor:
+        futures = OrderedDict((route, executor.submit(measure_latency, host, port, timeout))
+                              for route, (host, port) in candidates.items())
+    latencies = OrderedDict((route, future.result()) for route, future in futures.items())
+    logger.debug('Route latencies: %s', latencies)
+    direct = [(latency, route) for route, latency in latencies.items()
+              if latency is not None and route != 'bastion']
+    if direct:
+        return min(direct)[1]
+    if latencies.get('bastion') is not None and 'private' in addresses:
+        return 'bastion'
+    return None
+
+def _get_default_gateway():
+    try:
+        with open('/proc/net/route') as routes:
+            next(routes) # Header
+            for line in routes:
+                fields = line.split()
+                if fields[1] == '00000000' and int(fields[3], 16) & 2: # Default destination, via a gateway
+                    return '{}/{}'.format(fields[0], socket.inet_ntoa(struct.pack('<L', int(fields[2], 16))))
+    except (IOError, OSError, IndexError, ValueError, StopIteration):
+        pass
+    return None
+
+def _get_local_address():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.connect(('192.0.2.1', 9)) # Selects the outbound interface without sending anything
+        return sock.getsockname()[0]
+    except (socket.error, OSError):
+        return None
+    finally:
+        sock.close()
+
+def get_network_id():
+    """Identify the local network, so that route decisions are only reused where they were made
+
+    :returns: The interface and default gateway where available, otherwise the local outbound address
+
+    """
+    return _get_default_gateway() or _get_local_address() or 'unknown'
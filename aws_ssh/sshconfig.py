@@ -0,0 +1,128 @@
+"""Export instances as a static OpenSSH client configuration
+
+The generated file can be included from `~/.ssh/config`, so that plain `ssh` can connect to project instances
+without running aws-ssh at all.
+
+"""
+
+from collections import OrderedDict
+import logging
+import os.path
+
+import six
+
+from aws_ssh.cache import write_file
+from aws_ssh.interfaces import Instance
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SSH_CONFIG = '~/.aws-ssh/ssh_config'
+HEADER = '# Generated by aws-ssh export-ssh-config. Manual changes will be overwritten.\n'
+PROJECT_MARKER = '# aws-ssh project: '
+
+def render_host(alias, project_name, hostname, identity_file, user=None, options=None):
+    """Render the configuration block for a single host
+
+    :param alias: The host alias (i.e., the instance name)
+    :param project_name: The name of the owning project
+    :param hostname: The address of the instance
+    :param identity_file: The private key used to authenticate
+    :param user: The username, if known
+    :param options: A dict of additional ssh options
+    :returns: The block, as text
+
+    """
+    lines = ['Host {}'.format(alias),
+             '    {}{}'.format(PROJECT_MARKER, project_name),
+             '    HostName {}'.format(hostname)]
+    if user:
+        lines.append('    User {}'.format(user))
+    lines.extend(['    IdentityFile {}'.format(identity_file),
+                  '    IdentitiesOnly yes'])
+    lines.extend('    {} {}'.format(key, value) for key, value in (options or {}).items())
+    return '\n'.join(lines) + '\n'
+
+def parse_config(text):
+    """Split a generated configuration into its host blocks
+
+    :param text: The configuration file contents
+    :returns: An ordered dict mapping host aliases to their blocks
+
+    """
+    blocks = OrderedDict()
+    alias = None
+    for line in text.splitlines(True):
+        if line.startswith('Host '):
+            alias = line[len('Host '):].strip()
+            blocks[alias] = ''
+        if alias is not None and line.strip():
+            blocks[alias] += line
+    return blocks
+
+def get_block_project(block):
+    """Get the name of the project that generated a host block
+
+    :param block: The host block
+    :returns: The project name, or `None` if the block isn't marked
+
+    """
+    for line in block.splitlines():
+        if line.strip().startswith(PROJECT_MARKER):
+            return line.strip()[len(PROJECT_MARKER):]
+    return None
+
+def get_project_blocks(project):
+    """Render the host blocks for every instance in a project
+
+    :param project: The project
+    :returns: A dict mapping host aliases to their blocks
+
+    """
+    blocks = {}
+    for name, resources in six.iteritems(project.get_fleet()):
+        if len(resources) != 1:
+            logger.warning('Skipping "%s%s", which names %d instances', project.prefix, name, len(resources))
+            continue
+        instance = Instance('{}{}'.format(project.prefix, name), resources[0], project)
+        if instance.ip is None:
+            logger.debug('Skipping "%s", which has no %s address', instance.name, instance.route)
+            continue
+        user = instance.username or instance.infer_user_name()
+        blocks[instance.name] = render_host(instance.name, project.name, instance.ip, project.key_path, user,
+                                            instance.options)
+    return blocks
+
+def export(environment, path=DEFAULT_SSH_CONFIG):
+    """Write the host blocks for all registered projects, only rewriting the file if something changed
+
+    Blocks belonging to projects that fail to resolve are left untouched.
+
+    :param environment: The environment to which projects are registered
+    :param path: The configuration file to write
+    :returns: The number of added, changed, and removed hosts
+
+    """
+    path = os.path.expanduser(path)
+    existing = OrderedDict()
+    if os.path.exists(path):
+        with open(path) as configfile:
+            existing = parse_config(configfile.read())
+    blocks = OrderedDict((alias, block) for alias, block in six.iteritems(existing)
+                         if get_block_project(block) is not None)
+    for project in environment.get_projects():
+        try:
+            project_blocks = get_project_blocks(project)
+        except Exception: # pylint: disable=broad-except
+            logger.exception('Unable to resolve %s. Keeping its existing hosts.', project)
+            continue
+        for alias in [alias for alias, block in six.iteritems(blocks)
+                      if get_block_project(block) == project.name and alias not in project_blocks]:
+            del blocks[alias]
+        for alias in sorted(project_blocks):
+            blocks[alias] = project_blocks[alias]
+    added = len([alias for alias in blocks if alias not in existing])
+    changed = len([alias for alias in blocks if alias in existing and existing[alias] != blocks[alias]])
+    removed = len([alias for alias in existing if alias not in blocks])
+    if added or changed or removed or not os.path.exists(path):
+        write_file(path, HEADER + ''.join('\n' + block for block in blocks.values()))
+    return added, changed, removed
@@ -0,0 +1,135 @@
+"""Lightweight span timing, for finding where a slow connection spends its time
+
+Spans are recorded for the whole process, are nested per thread, and cost two clock reads each. They are
+reported as a table (with `--timings`) and/or appended as a JSON line to the file named by the
+`AWS_SSH_TIMINGS_FILE` environment variable, for aggregation across machines.
+
+"""
+
+from collections import deque
+from contextlib import contextmanager
+import functools
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+TIMINGS_FILE_ENV = 'AWS_SSH_TIMINGS_FILE'
+MAX_SPANS = 1000 # Only the most recent spans are kept, bounding the memory of the long-lived daemon
+
+now = getattr(time, 'perf_counter', time.time) # pylint: disable=invalid-name
+
+LOADED_AT = now() # When the timing module, which the CLI imports first, was loaded
+
+_spans = deque(maxlen=MAX_SPANS) # Finished (name, depth, start, seconds) tuples
+_local = threading.local()
+_settings = {'table': False}
+
+def record(name, start, end, depth=None):
+    """Record a finished span
+
+    :param name: The span name
+    :param start: When the span started, from `now()`
+    :param end: When the span ended, from `now()`
+    :param depth: The span's nesting depth, defaulting to that of the current thread's open spans
+
+    """
+    if depth is None:
+        depth = getattr(_local, 'depth', 0)
+    _spans.append((name, depth, start, end - start))
+
+@contextmanager
+def span(name):
+    """Time a block of code
+
+    :param name: The span name
+
+    """
+    depth = getattr(_local, 'depth', 0)
+    _local.depth = depth + 1
+    start = now()
+    try:
+        yield
+    finally:
+        _local.depth = depth
+        record(name, start, now(), depth)
+
+def timed(name):
+    """Time each call of the decorated function
+
+    :param name: The span name
+
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def get_spans():
+    """Get the finished spans, in the order in which they started
+
+    :returns: (name, depth, start, seconds) tuples
+
+    """
+    return sorted(_spans, key=lambda entry: (entry[2], entry[1]))
+
+def reset():
+    """Discard all finished spans"""
+    _spans.clear()
+
+def show_table():
+    """Report the spans as a table on stderr when the process finishes"""
+    _settings['table'] = True
+
+def format_table(spans):
+    """Format spans as an indented table
+
+    :param spans: (name, depth, start, seconds) tuples
+    :returns: The lines of the table
+
+    """
+    width = max([len(name) + 2 * depth for name, depth, _, _ in spans] + [len('SPAN')])
+    lines = ['{}  {:>9}'.format('SPAN'.ljust(width), 'MS')]
+    for name, depth, _, seconds in spans:
+        lines.append('{}  {:>9.1f}'.format(('  ' * depth + name).ljust(width), seconds * 1000))
+    return lines
+
+def write_record(path, spans, **fields):
+    """Append the spans to a file, as one JSON line
+
+    :param path: The file
+    :param spans: (name, depth, start, seconds) tuples
+    :param fields: Extra fields to include in the record
+
+    """
+    entry = {'time': time.time(), 'host': socket.gethostname(),
+             'spans': [{'name': name, 'depth': depth, 'ms': round(seconds * 1000, 3)}
+                       for name, depth, _, seconds in spans]}
+    entry.update(fields)
+    with open(os.path.expanduser(path), 'a') as timingsfile:
+        timingsfile.write(json.dumps(entry, sort_keys=True) + '\n') # A single write, as others may append
+
+def report(out=None, **fields):
+    """Report the spans as configured, by `show_table` and the `AWS_SSH_TIMINGS_FILE` environment variable
+
+    :param out: Where the table is written, defaulting to stderr
+    :param fields: Extra fields to include in the JSON record
+
+    """
+    path = os.environ.get(TIMINGS_FILE_ENV)
+    if not (_settings['table'] or path):
+        return
+    spans = get_spans()
+    out = out or sys.stderr
+    if _settings['table']:
+        out.write('\n'.join(format_table(spans)) + '\n')
+    if path:
+        try:
+            write_record(path, spans, **fields)
+        except (IOError, OSError) as exc:
+            out.write('Unable to write timings to {}: {}\n'.format(path, exc))
@@ -0,0 +1,5 @@
+"""Connect latency benchmarks, run against a local EC2 stand-in and a fake SSH target
+
+Run `python -m benchmarks.run --help` from the repository root.
+
+"""
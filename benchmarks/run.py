@@ -0,0 +1,350 @@
+"""Benchmark connect latency, reporting the p50 and p99 of each stage
+
+Each scenario is run several times per fleet size. Stages are the spans recorded by `aws_ssh.timing`, so the
+report breaks each scenario down the same way as `aws-ssh --timings`.
+
+Regressions fail the run (with exit code 1) when either:
+
+- a stage's p50 exceeds its p50 in a baseline saved by an earlier run (`--save`, then `--baseline`) by more
+  than `--max-regression`,
+- a stage's p50 exceeds a multiple of another stage's p50 in the same run, as set by a ratios file
+  (`--ratios`), a JSON object mapping `scenario:stage` to an object mapping reference stages to the maximum
+  multiple. A reference is either `scenario:stage`, at the same fleet size, or `scenario:fleet:stage`. As
+  both are measured on the same machine, ratios hold on slower machines (e.g., CI) too, or
+- a stage's p99 exceeds its budget in a budgets file (`--budgets`), a JSON object mapping `scenario:stage` to
+  milliseconds.
+
+"""
+from __future__ import print_function
+
+import argparse
+from collections import OrderedDict
+import contextlib
+import json
+import math
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+
+from aws_ssh import aws, cli, interfaces, timing
+from benchmarks.stubs import StubEC2Client, make_fleet, make_tree, write_fake_ssh
+
+PROFILE = 'benchmark'
+PREFIX = 'bench-'
+USERNAME = 'ec2-user' # Not the first candidate, so that probing tries several usernames
+INSTANCE_NAME = 'node{:05d}'
+
+DEFAULT_FLEET_SIZES = (10, 1000, 50000)
+QUICK_FLEET_SIZES = (10, 1000)
+DEFAULT_ITERATIONS = 20
+QUICK_ITERATIONS = 5
+DEFAULT_DEPTH = 20 # Directories between the project root and the working directory
+DEFAULT_MAX_REGRESSION = 0.25 # Fraction by which a stage's p50 may exceed the baseline
+MIN_REGRESSION_MS = 1.0 # Smaller absolute changes are noise
+
+TOTAL = 'total'
+
+def percentile(values, percent):
+    """Get a percentile of some values, by the nearest-rank method
+
+    :param values: The values
+    :param percent: The percentile, from 0 to 100
+    :returns: The value
+
+    """
+    values = sorted(values)
+    return values[max(int(math.ceil(percent / 100.0 * len(values))) - 1, 0)]
+
+class Workspace(object): # pylint: disable=too-many-instance-attributes
+    """A throwaway home directory and project, with a deep directory tree beneath the project root"""
+
+    def __init__(self, fleet_size, depth, api_latency, ssh_latency):
+        """Create the workspace
+
+        :param fleet_size: The number of instances in the project's fleet
+        :param depth: The number of directories between the project root and the working directory
+        :param api_latency: The number of seconds each EC2 call takes
+        :param ssh_latency: The number of seconds each SSH login attempt takes
+
+        """
+        self.directory = tempfile.mkdtemp(prefix='aws-ssh-benchmark-')
+        self.home = os.path.join(self.directory, 'home')
+        self.root = os.path.join(self.directory, 'project')
+        self.cwd = make_tree(self.root, depth)
+        self.config_path = os.path.join(self.root, interfaces.DEFAULT_PROJECT_CONFIG)
+        self.instance_name = INSTANCE_NAME.format(fleet_size // 2)
+        self.client = StubEC2Client(make_fleet(PREFIX, fleet_size), latency=api_latency)
+        self.bin = os.path.join(self.directory, 'bin')
+        os.makedirs(self.bin)
+        write_fake_ssh(self.bin, USERNAME, latency=ssh_latency)
+        os.makedirs(os.path.join(self.home, '.aws-ssh'))
+        with open(os.path.join(self.home, '.aws-ssh', 'config.ini'), 'w') as configfile:
+            configfile.write('[DEFAULT]\nkey_dir = {}\ncontrol_persist = no\n'.format(self.directory))
+
+    def write_project(self, username=None):
+        """Write the project config, recording the instance's username if given"""
+        with open(self.config_path, 'w') as configfile:
+            configfile.write('[DEFAULT]\nname = bench\nprefix = {}\nprofile = {}\nkey = bench.pem\n'.format(
+                PREFIX, PROFILE))
+            if username:
+                configfile.write('\n[instance_{}{}]\nusername = {}\n'.format(PREFIX, self.instance_name,
+                                                                             username))
+
+    def clear_caches(self):
+        """Remove all on-disk and in-process caches"""
+        shutil.rmtree(os.path.join(self.home, '.aws-ssh', 'cache'), ignore_errors=True)
+        interfaces._UNCONFIGURED_DIRS.clear() # pylint: disable=protected-access
+
+    @contextlib.contextmanager
+    def activate(self):
+        """Point aws-ssh at the workspace, the EC2 stand-in, and the fake SSH target"""
+        home, path, cwd, stderr = os.environ.get('HOME'), os.environ.get('PATH', ''), os.getcwd(), sys.stderr
+        os.environ['HOME'] = self.home
+        os.environ['PATH'] = os.pathsep.join([self.bin, path])
+        os.chdir(self.cwd)
+        aws.reset_pool()
+        aws._CLIENTS[(PROFILE, None, 'ec2')] = self.client # pylint: disable=protected-access
+        wait_for_port = cli.wait_for_port
+        cli.wait_for_port = lambda *args, **kwargs: True # The fake SSH target accepts every connection
+        sys.stderr = open(os.devnull, 'w') # Progress bars and warnings
+        try:
+            yield
+        finally:
+            sys.stderr.close()
+            sys.stderr = stderr
+            cli.wait_for_port = wait_for_port
+            os.environ['PATH'] = path
+            aws.reset_pool()
+            os.chdir(cwd)
+            if home is None:
+                del os.environ['HOME']
+            else:
+                os.environ['HOME'] = home
+
+    def close(self):
+        """Remove the workspace"""
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+def bench_find_config(workspace):
+    """Find the project config from deep beneath the project root"""
+    workspace.write_project(USERNAME)
+
+    def run():
+        interfaces._UNCONFIGURED_DIRS.clear() # pylint: disable=protected-access
+        interfaces.Project.find_config(workspace.cwd)
+    return run
+
+def bench_get_instance_info(workspace):
+    """Look up a single instance in EC2"""
+    def run():
+        aws.get_instance_info(PROFILE, PREFIX, workspace.instance_name)
+    return run
+
+def bench_connect_cold(workspace):
+    """Connect with empty caches and an unknown username, i.e., a fleet sweep and username probing"""
+    def run():
+        workspace.write_project()
+        workspace.clear_caches()
+        with timing.span(TOTAL):
+            cli.get_ssh_args([workspace.instance_name])
+    return run
+
+def bench_connect_warm(workspace):
+    """Connect with the instance and its username cached, i.e., without any network round trip"""
+    workspace.write_project(USERNAME)
+    workspace.clear_caches()
+    cli.get_ssh_args([workspace.instance_name])
+
+    def run():
+        with timing.span(TOTAL):
+            cli.get_ssh_args([workspace.instance_name])
+    return run
+
+SCENARIOS = OrderedDict([
+    ('find_config', bench_find_config),
+    ('get_instance_info', bench_get_instance_info),
+    ('connect_cold', bench_connect_cold),
+    ('connect_warm', bench_connect_warm),
+])
+
+def run_scenario(scenario, workspace, iterations):
+    """Run a scenario repeatedly
+
+    :param scenario: The scenario, which prepares the workspace and returns the function to time
+    :param workspace: The workspace
+    :param iterations: The number of runs
+    :returns: An ordered dict mapping each stage to its durations, in milliseconds
+
+    """
+    stages = OrderedDict()
+    with workspace.activate():
+        run = scenario(workspace)
+        for _ in range(iterations):
+            timing.reset()
+            run()
+            durations = OrderedDict()
+            for name, _, _, seconds in timing.get_spans():
+                durations[name] = durations.get(name, 0) + seconds * 1000
+            for name, duration in durations.items():
+                stages.setdefault(name, []).append(duration)
+    return stages
+
+def run_benchmarks(scenarios, fleet_sizes, iterations, depth, api_latency, ssh_latency):
+    """Run the benchmarks
+
+    :returns: An ordered dict mapping `scenario:fleet_size:stage` keys to dicts of p50 and p99 milliseconds
+
+    """
+    results = OrderedDict()
+    for fleet_size in fleet_sizes:
+        workspace = Workspace(fleet_size, depth, api_latency, ssh_latency)
+        try:
+            for name in scenarios:
+                stages = run_scenario(SCENARIOS[name], workspace, iterations)
+                for stage, durations in stages.items():
+                    results['{}:{}:{}'.format(name, fleet_size, stage)] = {
+                        'p50': percentile(durations, 50), 'p99': percentile(durations, 99)}
+        finally:
+            workspace.close()
+    return results
+
+def format_results(results):
+    """Format the results as a table
+
+    :param results: The results, as returned by `run_benchmarks`
+    :returns: The lines of the table
+
+    """
+    rows = [('SCENARIO', 'FLEET', 'STAGE', 'P50 MS', 'P99 MS')]
+    for key, result in results.items():
+        scenario, fleet_size, stage = key.split(':', 2)
+        rows.append((scenario, fleet_size, stage,
+                     '{:.2f}'.format(result['p50']), '{:.2f}'.format(result['p99'])))
+    widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+    return ['  '.join(value.ljust(width) if column < 3 else value.rjust(width)
+                      for column, (value, width) in enumerate(zip(row, widths))) for row in rows]
+
+def get_reference_key(reference, fleet_size):
+    """Get the results key of a reference stage
+
+    :param reference: Either `scenario:stage`, at the given fleet size, or `scenario:fleet:stage`
+    :param fleet_size: The fleet size of the stage compared with the reference
+    :returns: The key
+
+    """
+    if reference.count(':') == 2:
+        return reference
+    scenario, stage = reference.split(':', 1)
+    return '{}:{}:{}'.format(scenario, fleet_size, stage)
+
+def compare_ratios(key, results, ratios):
+    """Compare a stage with the reference stages that bound it
+
+    :param key: The stage's `scenario:fleet_size:stage` key
+    :param results: The results, as returned by `run_benchmarks`
+    :param ratios: A dict mapping reference stages to the maximum multiple of their p50
+    :returns: A description of each regression
+
+    """
+    regressions = []
+    fleet_size = key.split(':', 2)[1]
+    for reference, ratio in sorted(ratios.items()):
+        reference_key = get_reference_key(reference, fleet_size)
+        if reference_key not in results: # Not run this time
+            continue
+        p50, reference_p50 = results[key]['p50'], results[reference_key]['p50']
+        if p50 > max(reference_p50 * ratio, reference_p50 + MIN_REGRESSION_MS):
+            regressions.append('{}: p50 of {:.2f}ms exceeds {} times the {:.2f}ms of {}'.format(
+                key, p50, ratio, reference_p50, reference_key))
+    return regressions
+
+def find_regressions(results, baseline=None, max_regression=DEFAULT_MAX_REGRESSION, budgets=None,
+                     ratios=None):
+    """Compare results against a baseline, budgets, and ratios to other stages
+
+    :param results: The results, as returned by `run_benchmarks`
+    :param baseline: Earlier results, as returned by `run_benchmarks`
+    :param max_regression: The fraction by which a stage's p50 may exceed the baseline
+    :param budgets: A dict mapping `scenario:stage` keys to the maximum p99 in milliseconds
+    :param ratios: A dict mapping `scenario:stage` keys to dicts mapping reference stages to the maximum
+                   multiple of their p50
+    :returns: A description of each regression
+
+    """
+    regressions = []
+    for key, result in results.items():
+        previous = (baseline or {}).get(key)
+        if previous is not None:
+            limit = max(previous['p50'] * (1 + max_regression), previous['p50'] + MIN_REGRESSION_MS)
+            if result['p50'] > limit:
+                regressions.append('{}: p50 of {:.2f}ms exceeds the baseline of {:.2f}ms'.format(
+                    key, result['p50'], previous['p50']))
+        scenario, _, stage = key.split(':', 2)
+        bounds = (ratios or {}).get('{}:{}'.format(scenario, stage))
+        if bounds:
+            regressions.extend(compare_ratios(key, results, bounds))
+        budget = (budgets or {}).get('{}:{}'.format(scenario, stage))
+        if budget is not None and result['p99'] > budget:
+            regressions.append('{}: p99 of {:.2f}ms exceeds the budget of {:.2f}ms'.format(
+                key, result['p99'], budget))
+    return regressions
+
+def read_json(path):
+    """Read a JSON file"""
+    with open(path) as jsonfile:
+        return json.load(jsonfile)
+
+def get_parser():
+    """Get the command line argument parser"""
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.run', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--quick', action='store_true',
+                        help='Use smaller fleets and fewer iterations, e.g. for CI')
+    parser.add_argument('--scenario', dest='scenarios', action='append', choices=list(SCENARIOS),
+                        help='A scenario to run (repeatable). Defaults to all')
+    parser.add_argument('--fleet-sizes', help='Comma-separated fleet sizes. Defaults to {}'.format(
+        ','.join(str(size) for size in DEFAULT_FLEET_SIZES)))
+    parser.add_argument('--iterations', type=int,
+                        help='Runs per scenario and fleet size. Defaults to {}'.format(DEFAULT_ITERATIONS))
+    parser.add_argument('--depth', type=int, default=DEFAULT_DEPTH,
+                        help='Directories between the project root and the working directory')
+    parser.add_argument('--api-latency', type=float, default=0.0, help='Milliseconds per EC2 call')
+    parser.add_argument('--ssh-latency', type=float, default=0.0, help='Milliseconds per SSH login attempt')
+    parser.add_argument('--save', metavar='FILE', help='Save the results as a baseline')
+    parser.add_argument('--baseline', metavar='FILE', help='Fail if any stage regressed from this baseline')
+    parser.add_argument('--max-regression', type=float, default=DEFAULT_MAX_REGRESSION,
+                        help="The fraction by which a stage's p50 may exceed the baseline")
+    parser.add_argument('--budgets', metavar='FILE', help="Fail if any stage's p99 exceeds its budget")
+    parser.add_argument('--ratios', metavar='FILE',
+                        help="Fail if any stage's p50 exceeds its maximum multiple of a reference stage's")
+    return parser
+
+def main(args=None):
+    """Run the benchmarks from the command line
+
+    :returns: The exit code
+
+    """
+    args = get_parser().parse_args(args)
+    if args.fleet_sizes:
+        fleet_sizes = [int(size) for size in args.fleet_sizes.split(',')]
+    else:
+        fleet_sizes = QUICK_FLEET_SIZES if args.quick else DEFAULT_FLEET_SIZES
+    iterations = args.iterations or (QUICK_ITERATIONS if args.quick else DEFAULT_ITERATIONS)
+    results = run_benchmarks(args.scenarios or list(SCENARIOS), fleet_sizes, iterations, args.depth,
+                             args.api_latency / 1000, args.ssh_latency / 1000)
+    print('\n'.join(format_results(results)))
+    if args.save:
+        with open(args.save, 'w') as outfile:
+            json.dump(results, outfile, indent=2)
+    regressions = find_regressions(results, read_json(args.baseline) if args.baseline else None,
+                                   args.max_regression, read_json(args.budgets) if args.budgets else None,
+                                   read_json(args.ratios) if args.ratios else None)
+    for regression in regressions:
+        print('REGRESSION {}'.format(regression), file=sys.stderr)
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
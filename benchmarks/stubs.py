@@ -0,0 +1,167 @@
+"""Local stand-ins for EC2 and SSH targets, with injectable latency"""
+
+import fnmatch
+import os
+import os.path
+import time
+
+DEFAULT_PAGE_SIZE = 1000 # Instances per `describe_instances` page, as with EC2's maximum
+
+def make_fleet(prefix, size, image_id='ami-benchmark'):
+    """Generate the API info for a synthetic fleet
+
+    :param prefix: The name prefix shared by all instances
+    :param size: The number of instances
+    :param image_id: The AMI of every instance
+    :returns: The instances' API info, named `<prefix>node00000` onwards
+
+    """
+    return [{
+        'InstanceId': 'i-{:017x}'.format(index),
+        'ImageId': image_id,
+        'State': {'Code': 16, 'Name': 'running'},
+        'InstanceType': 't3.micro',
+        'LaunchTime': '2020-01-01T00:00:00.000Z',
+        'PrivateIpAddress': '10.{}.{}.{}'.format(index >> 16 & 255, index >> 8 & 255, index & 255),
+        'PublicIpAddress': '52.{}.{}.{}'.format(index >> 16 & 255, index >> 8 & 255, index & 255),
+        'Tags': [{'Key': 'Name', 'Value': '{}node{:05d}'.format(prefix, index)}],
+    } for index in range(size)]
+
+def make_tree(root, depth):
+    """Create a chain of nested directories
+
+    :param root: The directory in which to create the chain
+    :param depth: The number of nested directories
+    :returns: The deepest directory
+
+    """
+    path = os.path.join(root, *['level{}'.format(level) for level in range(depth)])
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    return path
+
+def get_name(instance):
+    """Get the value of an instance's `Name` tag"""
+    for tag in instance.get('Tags', []):
+        if tag['Key'] == 'Name':
+            return tag['Value']
+    return None
+
+class StubEC2Client(object):
+    """Answers the subset of the EC2 API used by aws-ssh from a synthetic fleet
+
+    Every call sleeps for the configured latency first, as a round trip to EC2 would.
+
+    """
+
+    def __init__(self, instances, latency=0.0, page_size=DEFAULT_PAGE_SIZE):
+        """Initialize the stub
+
+        :param instances: The fleet's API info
+        :param latency: The number of seconds each call takes
+        :param page_size: The number of instances per `describe_instances` page
+
+        """
+        self.instances = sorted(instances, key=get_name)
+        self.latency = latency
+        self.page_size = page_size
+        self.calls = 0
+        self._matches = {} # Filters -> matching instances, so that paging doesn't refilter the fleet
+        self._by_name = {}
+        for instance in self.instances:
+            self._by_name.setdefault(get_name(instance), []).append(instance)
+
+    def _call(self):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _filter(self, filters):
+        key = repr(filters)
+        if key not in self._matches:
+            self._matches[key] = self._match(filters)
+        return self._matches[key]
+
+    def _match(self, filters):
+        instances = self.instances
+        for entry in filters or []:
+            values = entry['Values']
+            if entry['Name'] == 'tag:Name':
+                if all('*' not in pattern and '?' not in pattern for pattern in values):
+                    instances = [instance for name in values for instance in self._by_name.get(name, [])]
+                else:
+                    instances = [instance for instance in instances if any(
+                        fnmatch.fnmatchcase(get_name(instance), pattern) for pattern in values)]
+            elif entry['Name'] == 'instance-state-name':
+                instances = [instance for instance in instances if instance['State']['Name'] in values]
+        return instances
+
+    # pylint: disable=invalid-name
+    def describe_instances(self, Filters=None, NextToken=None, MaxResults=None):
+        """Describe the instances matching the filters, one page at a time"""
+        self._call()
+        instances = self._filter(Filters)
+        start = int(NextToken or 0)
+        end = start + (MaxResults or self.page_size)
+        response = {'Reservations': [{'Instances': [instance]} for instance in instances[start:end]]}
+        if end < len(instances):
+            response['NextToken'] = str(end)
+        return response
+
+    def get_paginator(self, operation_name):
+        """Get a paginator for `describe_instances`"""
+        assert operation_name == 'describe_instances'
+        return _StubPaginator(self)
+
+    def describe_images(self, ImageIds=None): # pylint: disable=invalid-name,unused-argument
+        """Describe images, none of which are visible (as with a private, unshared AMI)"""
+        self._call()
+        return {'Images': []}
+
+    def start_instances(self, InstanceIds=None): # pylint: disable=invalid-name,unused-argument
+        """Start instances, which are already running"""
+        self._call()
+        return {}
+
+class _StubPaginator(object): # pylint: disable=too-few-public-methods
+    def __init__(self, client):
+        self.client = client
+
+    def paginate(self, **kwargs):
+        """Yield each page of the response"""
+        token = None
+        while True:
+            page = self.client.describe_instances(NextToken=token, **kwargs)
+            yield page
+            token = page.get('NextToken')
+            if token is None:
+                break
+
+FAKE_SSH = """#!/bin/sh
+# Accepts a single username, as the fake target of username probes
+if [ "$1" = -V ]; then echo "OpenSSH_9.0p1, OpenSSL 3.0.0" >&2; exit 0; fi
+user=
+while [ $# -gt 0 ]; do
+    if [ "$1" = -l ]; then user=$2; fi
+    shift
+done
+{sleep}
+if [ "$user" = {username} ]; then exit 0; fi
+echo "$user@target: Permission denied (publickey)." >&2
+exit 255
+"""
+
+def write_fake_ssh(directory, username, latency=0.0):
+    """Write a stand-in for the `ssh` command used by username probes, accepting a single username
+
+    :param directory: The directory in which to write it, to be put at the front of the `PATH`
+    :param username: The username that authenticates
+    :param latency: The number of seconds each login attempt takes
+    :returns: The path of the stand-in
+
+    """
+    path = os.path.join(directory, 'ssh')
+    with open(path, 'w') as sshfile:
+        sshfile.write(FAKE_SSH.format(username=username, sleep='sleep {}'.format(latency) if latency else ''))
+    os.chmod(path, 0o755)
+    return path
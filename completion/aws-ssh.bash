@@ -0,0 +1,36 @@
+# bash completion for aws-ssh. Source this file, e.g. from ~/.bashrc:
+#     source /path/to/aws-ssh.bash
+
+_aws_ssh() {
+    local cur prev
+    if declare -F _get_comp_words_by_ref >/dev/null; then
+        _get_comp_words_by_ref -n : cur prev
+    else
+        cur="${COMP_WORDS[COMP_CWORD]}"
+        prev="${COMP_WORDS[COMP_CWORD-1]}"
+    fi
+    case "$prev" in
+        --name|--profile|--key|--prefix|--root)
+            return
+            ;;
+    esac
+    if [[ "$cur" == -* ]]; then
+        COMPREPLY=($(compgen -W "--help --debug --init --refresh --no-cache --start --name --profile --key
+                                 --prefix --root" -- "$cur"))
+        return
+    fi
+    COMPREPLY=()
+    if [ "$COMP_CWORD" -eq 1 ]; then
+        COMPREPLY=($(compgen -W "daemon exec export-ssh-config" -- "$cur"))
+    fi
+    local IFS=$'\n'
+    COMPREPLY+=($(aws-ssh-cli --complete "$cur" 2>/dev/null))
+    if declare -F __ltrim_colon_completions >/dev/null; then
+        __ltrim_colon_completions "$cur"
+    fi
+    if [ "${#COMPREPLY[@]}" -eq 1 ] && [[ "${COMPREPLY[0]}" == *: ]]; then
+        compopt -o nospace 2>/dev/null
+    fi
+}
+
+complete -F _aws_ssh aws-ssh awssh ssh-ec2
@@ -0,0 +1,17 @@
+# fish completion for aws-ssh. Place this file in ~/.config/fish/completions/
+
+for command in aws-ssh awssh ssh-ec2
+    complete -c $command -f
+    complete -c $command -n '__fish_is_first_arg' -a '(aws-ssh-cli --complete (commandline -ct) 2>/dev/null)'
+    complete -c $command -n '__fish_is_first_arg' -a 'daemon exec export-ssh-config'
+    complete -c $command -l debug -d 'Enable debugging output'
+    complete -c $command -l init -d 'Initialize the project'
+    complete -c $command -l refresh -d 'Bypass the instance cache'
+    complete -c $command -l no-cache -d 'Bypass the instance cache'
+    complete -c $command -l start -d 'Start the instance if it is stopped'
+    complete -c $command -l name -x -d 'The name of the initialized project'
+    complete -c $command -l profile -x -d 'The AWS profile to use'
+    complete -c $command -l key -x -d 'The name of the private key used for authentication'
+    complete -c $command -l prefix -x -d 'The shared prefix for all EC2 instance names'
+    complete -c $command -l root -x -a '(__fish_complete_directories)' -d 'The root directory for the project'
+end
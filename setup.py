@@ -19,6 +19,7 @@ REQUIREMENTS = [
 
 if sys.version_info <= (3,):
     REQUIREMENTS.append('configparser>=3.5.0') # Using the beta for PyPy compatibility
+    REQUIREMENTS.append('futures')
 
 with open('aws_ssh/__init__.py', "r") as f:
     VERSION = re.search(r"^__version__\s*=\s*[\"']([^\"']*)[\"']", f.read(), re.MULTILINE).group(1)
@@ -42,12 +43,12 @@ setup(name='aws-ssh',
       url='https://github.com/arusahni/aws-ssh',
       license='MIT',
       package_data={'': ['LICENSE']},
-      packages=find_packages(exclude=['ez_setup', 'examples', 'tests']),
+      packages=find_packages(exclude=['ez_setup', 'examples', 'tests', 'benchmarks']),
       include_package_data=True,
       zip_safe=True,
       install_requires=REQUIREMENTS,
       entry_points={
-          'console_scripts': ['aws-ssh-cli=aws_ssh.cli:print_ssh_args'],
+          'console_scripts': ['aws-ssh-cli=aws_ssh.cli:main'],
       },
       scripts=['bin/awssh', 'bin/aws-ssh', 'bin/ssh-ec2'],
       extras_require={
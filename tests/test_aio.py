@@ -0,0 +1,202 @@
+# pylint: disable=redefined-outer-name,no-self-use,unused-argument,protected-access,missing-docstring
+import asyncio
+import json
+import sys
+import time
+try:
+    from unittest.mock import MagicMock, patch
+except ImportError:
+    from mock import MagicMock, patch
+
+import pytest
+from configparser import ConfigParser  # pylint: disable=import-error
+
+if sys.version_info < (3, 5):
+    pytest.skip('The asyncio interface requires Python 3.5+', allow_module_level=True)
+
+from aws_ssh import aio, errors
+from aws_ssh.interfaces import Instance, Project
+from test_aws import SAMPLE_INSTANCE_BODY # pylint: disable=import-error
+
+# Exits with 0 for the accepted usernames after the given delays, and otherwise fails as ssh would
+PROBE_SCRIPT = ('import sys, time; time.sleep(float(sys.argv[2])); '
+                'sys.exit(0 if sys.argv[1] in {accepted!r} else sys.stderr.write({error!r}) and 255)')
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+@pytest.fixture
+def environment():
+    environment = MagicMock()
+    environment.key_dir = '/path/to/key'
+    environment.control_options = {}
+    environment.instance_cache.get.return_value = None
+    environment.miss_cache.get.return_value = None
+    environment.coalescer.call.side_effect = lambda key, fetch, share=None: (fetch(), False)
+    return environment
+
+@pytest.fixture
+def project(environment):
+    config = ConfigParser()
+    config.read_dict({'DEFAULT': {'key': 'foo.pem', 'prefix': 'foo-', 'profile': 'testing', 'name': 'foo'}})
+    with patch('aws_ssh.interfaces.save_config'):
+        yield Project('/path/to/foo', environment, config=config)
+
+@pytest.fixture
+def aws_resource():
+    return json.loads(SAMPLE_INSTANCE_BODY)
+
+@pytest.fixture
+def fleet_mock(aws_resource):
+    with patch('aws_ssh.aws.get_fleets') as fleet_mock:
+        fleet_mock.return_value = {'web': [aws_resource], 'data': [aws_resource], 'dup': [aws_resource] * 2}
+        yield fleet_mock
+
+def fake_probes(accepted, delays=None, error='Permission denied (publickey).'):
+    """Patch the probe command with a script accepting the given usernames"""
+    delays = delays or {}
+    def get_probe_args(instance, username, timeout=10):
+        return [sys.executable, '-c', PROBE_SCRIPT.format(accepted=list(accepted), error=error), username,
+                str(delays.get(username, 0))]
+    return patch.object(Instance, 'get_probe_args', get_probe_args)
+
+class TestResolution(object):
+    """Test resolving instances"""
+
+    def test_aget_instance(self, project, fleet_mock):
+        instance = run(project.aget_instance('web'))
+        assert instance.name == 'foo-web'
+        assert fleet_mock.call_count == 1
+
+    def test_aget_instance_missing(self, project, fleet_mock):
+        with pytest.raises(errors.NoInstanceFoundError):
+            run(project.aget_instance('compute'))
+
+    def test_aresolve_many(self, project, fleet_mock, environment):
+        results = run(project.aresolve_many(['web', 'data', 'dup', 'compute', 'web'], usernames=False))
+        assert list(results) == ['web', 'data', 'dup', 'compute']
+        assert results['web'].name == 'foo-web'
+        assert results['data'].name == 'foo-data'
+        assert isinstance(results['dup'], errors.TooManyInstancesError)
+        assert isinstance(results['compute'], errors.NoInstanceFoundError)
+        assert fleet_mock.call_count == 1 # One sweep, however many names
+        environment.miss_cache.set.assert_any_call('testing', None, 'foo-', 'compute', 'NoInstanceFoundError')
+
+    def test_aresolve_many_cached(self, project, fleet_mock, environment, aws_resource):
+        environment.instance_cache.get.side_effect = lambda profile, region, prefix, name: (
+            aws_resource if name == 'web' else None)
+        environment.miss_cache.get.side_effect = lambda profile, region, prefix, name: (
+            'TooManyInstancesError' if name == 'dup' else None)
+        results = run(project.aresolve_many(['web', 'dup'], usernames=False))
+        assert results['web'].cached
+        assert isinstance(results['dup'], errors.TooManyInstancesError)
+        assert not fleet_mock.called
+
+    def test_aresolve_many_refresh(self, project, fleet_mock, environment):
+        results = run(project.aresolve_many(['web'], refresh=True, usernames=False))
+        assert not results['web'].cached
+        assert not environment.instance_cache.get.called
+        assert fleet_mock.called
+
+    def test_aresolve_many_usernames(self, project, fleet_mock, aws_resource):
+        project._usernames = ['ubuntu', 'ec2-user']
+        fleet_mock.return_value['other'] = [dict(aws_resource, ImageId='ami-other')]
+        def infer(instance):
+            return 'admin' if instance._aws_resource['ImageId'] == 'ami-other' else None
+        with fake_probes(['ec2-user', 'admin']), patch.object(Instance, 'infer_user_name', infer):
+            results = run(project.aresolve_many(['web', 'other']))
+        assert results['web'].username == 'ec2-user'
+        assert results['other'].username == 'admin'
+
+    def test_aresolve_many_no_username(self, project, fleet_mock):
+        project._usernames = ['ubuntu']
+        with fake_probes([]), patch.object(Instance, 'infer_user_name', return_value=None):
+            results = run(project.aresolve_many(['web']))
+        assert isinstance(results['web'], errors.UsernameNotFoundError)
+
+    def test_aresolve_many_no_address(self, project, fleet_mock, aws_resource):
+        project._usernames = ['ubuntu']
+        fleet_mock.return_value['private'] = [{key: value for key, value in aws_resource.items()
+                                               if key != 'PublicIpAddress'}]
+        with fake_probes(['ubuntu']), patch.object(Instance, 'infer_user_name', return_value=None):
+            results = run(project.aresolve_many(['web', 'private']))
+        assert results['web'].username == 'ubuntu'
+        assert isinstance(results['private'], errors.NoAddressError)
+
+class TestUsernames(object):
+    """Test discovering usernames"""
+
+    @pytest.fixture
+    def instance(self, project, aws_resource):
+        with patch.object(Instance, 'infer_user_name', return_value=None):
+            yield Instance('foo-web', aws_resource, project)
+
+    def test_configured(self, instance):
+        instance._project._config['instance_foo-web'] = {'username': 'admin'}
+        with patch('asyncio.create_subprocess_exec') as exec_mock:
+            assert run(instance.aget_user_name()) == 'admin'
+            assert not exec_mock.called
+
+    def test_inferred(self, instance):
+        instance._project._usernames = ['ubuntu', 'admin']
+        with patch.object(Instance, 'infer_user_name', return_value='admin'), fake_probes(['ubuntu', 'admin']), \
+                patch.object(aio, 'probe_username', wraps=aio.probe_username) as probe_mock:
+            assert run(instance.aget_user_name()) == 'admin' # Verified on its own, before any other is probed
+        assert [probe_call[0][1] for probe_call in probe_mock.call_args_list] == ['admin']
+        assert instance.username == 'admin'
+        assert instance._project.get_instance_config('foo-web')['username_inferred'] == 'yes'
+
+    def test_inferred_rejected(self, instance):
+        instance._project._usernames = ['ubuntu', 'admin']
+        with patch.object(Instance, 'infer_user_name', return_value='admin'), fake_probes(['ubuntu']):
+            assert run(instance.aget_user_name()) == 'ubuntu'
+        assert not instance._project.get_instance_config('foo-web').get('username_inferred')
+
+    def test_first_wins(self, instance):
+        instance._project._usernames = ['ubuntu', 'ec2-user', 'root']
+        with fake_probes(['ubuntu', 'ec2-user'], delays={'ubuntu': 0, 'ec2-user': 30}):
+            assert run(aio.get_user_name(instance)) == 'ubuntu' # Rather than waiting on the slower probe
+        assert instance.username == 'ubuntu'
+
+    def test_none(self, instance):
+        instance._project._usernames = ['ubuntu', 'root']
+        with fake_probes([]), pytest.raises(errors.UsernameNotFoundError):
+            run(aio.get_user_name(instance))
+
+    def test_unreachable(self, instance):
+        instance._project._usernames = ['ubuntu', 'ec2-user', 'root']
+        error = 'ssh: connect to host 52.90.39.59 port 22: Connection refused'
+        with fake_probes([], delays={'ec2-user': 30, 'root': 30}, error=error):
+            start = time.time()
+            with pytest.raises(errors.HostUnreachableError):
+                run(aio.get_user_name(instance))
+            assert time.time() - start < 10 # Rather than waiting on the other probes
+
+    def test_probe(self, instance):
+        with fake_probes(['ubuntu']):
+            assert run(aio.probe_username(instance, 'ubuntu')) == (None, '')
+            assert run(aio.probe_username(instance, 'root')) == ('auth', 'Permission denied (publickey).')
+
+    def test_probe_timeout(self, instance):
+        with fake_probes(['ubuntu'], delays={'ubuntu': 30}):
+            assert run(aio.probe_username(instance, 'ubuntu', timeout=0.1))[0] == 'auth'
+
+    def test_get_probe_args(self, instance):
+        instance._project._environment.control_options = {'ControlMaster': 'auto'}
+        with patch('aws_ssh.probe.get_ssh_version', return_value=(8, 9)):
+            assert instance.get_probe_args('ubuntu', timeout=5) == [
+                'ssh', '-i', '/path/to/key/foo.pem', '-l', 'ubuntu',
+                '-o', 'BatchMode=yes', '-o', 'ConnectTimeout=5', '-o', 'StrictHostKeyChecking=accept-new',
+                '-o', 'UserKnownHostsFile=/dev/null ~/.ssh/known_hosts ~/.ssh/known_hosts2',
+                '-o', 'ControlMaster=auto', '52.90.39.59', 'true']
+
+    def test_get_probe_args_old_ssh(self, instance):
+        instance._project._environment.control_options = {'ControlMaster': 'auto'}
+        with patch('aws_ssh.probe.get_ssh_version', return_value=(7, 4)):
+            args = instance.get_probe_args('ubuntu', timeout=5)
+        assert 'StrictHostKeyChecking=no' in args
+        assert args.index('ControlMaster=no') < args.index('ControlMaster=auto') # ssh takes the first value
@@ -1,18 +1,27 @@
 """Test the AWS module"""
 # pylint: disable=redefined-outer-name,no-self-use,unused-argument,protected-access,missing-docstring,invalid-name,line-too-long
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 import json
+import threading
 try:
-    from unittest.mock import patch
+    from unittest.mock import ANY, MagicMock, patch
 except ImportError:
-    from mock import patch
+    from mock import ANY, MagicMock, patch
 
+from botocore.exceptions import ClientError
 import pytest
 
 from aws_ssh import aws, errors
 
 SessionVars = namedtuple('SessionVars', 'session instance client describe_instances')
 
+@pytest.fixture(autouse=True)
+def pool():
+    aws.reset_pool()
+    yield
+    aws.reset_pool()
+
 @pytest.fixture
 def session_vars():
     with patch('boto3.session.Session') as session_mock:
@@ -26,13 +35,69 @@ def test_get_session():
         aws.get_session('foobar')
         session_mock.assert_called_with(profile_name='foobar')
 
+def test_get_session_region():
+    with patch('boto3.session.Session') as session_mock:
+        aws.get_session('foobar', 'eu-west-1')
+        session_mock.assert_called_with(profile_name='foobar', region_name='eu-west-1')
+
+def test_get_session_pooled():
+    with patch('boto3.session.Session') as session_mock:
+        session = aws.get_session('foobar')
+        assert aws.get_session('foobar') is session
+        assert session_mock.call_count == 1
+        aws.get_session('foobar', 'eu-west-1')
+        aws.get_session('other')
+        assert session_mock.call_count == 3
+
+def test_get_client_pooled(session_vars):
+    client = aws.get_client('foobar')
+    assert aws.get_client('foobar', 'ec2') is client
+    session_vars.client.assert_called_once_with('ec2', config=ANY)
+    aws.get_client('foobar', 's3')
+    assert session_vars.client.call_count == 2
+
+def test_get_client_threads(session_vars):
+    session_vars.client.side_effect = lambda service_name, config=None: MagicMock()
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        clients = list(executor.map(lambda _: aws.get_client('foobar'), range(32)))
+    assert len(set(id(client) for client in clients)) == 1
+    assert session_vars.session.call_count == 1
+
+def test_get_client_retries(session_vars):
+    client = aws.get_client('foobar')
+    config = session_vars.client.call_args[1]['config']
+    assert config.retries == {'mode': 'adaptive', 'max_attempts': 10}
+    client.meta.events.register.assert_called_with('before-call', aws._throttle)
+
+def test_throttle():
+    with patch('aws_ssh.aws.get_rate_limiter') as limiter_mock:
+        aws._throttle(model=None, params={})
+        limiter_mock.return_value.acquire.assert_called_with()
+
+def test_get_rate_limiter():
+    with patch('aws_ssh.aws._RATE_LIMITER', None), patch('aws_ssh.aws.get_limits') as limits_mock:
+        limits_mock.return_value = (5, 20)
+        limiter = aws.get_rate_limiter()
+        assert aws.get_rate_limiter() is limiter
+        limits_mock.return_value = (2, 4)
+        limiter = aws.get_rate_limiter()
+        assert (limiter.rate, limiter.burst) == (2, 4)
+
+def test_reset_pool(session_vars):
+    aws.get_client('foobar')
+    aws.reset_pool()
+    aws.get_client('foobar')
+    assert session_vars.session.call_count == 2
+
 def test_get_instance_info(session_vars):
     session_vars.describe_instances.return_value = get_sample_response()
     info = aws.get_instance_info('foobar', 'test-', 'name')
 
     session_vars.session.assert_called_with(profile_name='foobar')
-    session_vars.client.assert_called_with('ec2')
-    assert session_vars.describe_instances.called
+    session_vars.client.assert_called_with('ec2', config=ANY)
+    session_vars.describe_instances.assert_called_with(Filters=[{'Name': 'tag:Name', 'Values': ['test-name']},
+                                                                {'Name': 'instance-state-name',
+                                                                 'Values': ['pending', 'running', 'stopping', 'stopped']}])
     assert info['PublicIpAddress'] == '52.90.39.59'
 
 def test_get_instance_info_empty(session_vars):
@@ -45,6 +110,133 @@ def test_get_instance_info_multiple(session_vars):
     with pytest.raises(errors.TooManyInstancesError):
         aws.get_instance_info('foobar', 'test-', 'name')
 
+def test_get_instance_info_separate_reservations(session_vars):
+    response = get_sample_response()
+    response['Reservations'].append(get_sample_response()['Reservations'][0])
+    session_vars.describe_instances.return_value = response
+    with pytest.raises(errors.TooManyInstancesError):
+        aws.get_instance_info('foobar', 'test-', 'name')
+
+def test_get_fleet(session_vars):
+    paginator = session_vars.client.return_value.get_paginator.return_value
+    named = lambda name: dict(json.loads(SAMPLE_INSTANCE_BODY), Tags=[{'Key': 'Name', 'Value': name}])
+    paginator.paginate.return_value = [
+        {'Reservations': [{'Instances': [named('test-web'), named('test-data')]}]},
+        {'Reservations': [{'Instances': [named('test-web'), dict(named('other'), Tags=[])]}]},
+    ]
+    fleet = aws.get_fleet('foobar', 'test-')
+    session_vars.client.return_value.get_paginator.assert_called_with('describe_instances')
+    paginator.paginate.assert_called_with(Filters=[{'Name': 'tag:Name', 'Values': ['test-*']}, aws.STATE_FILTER])
+    assert sorted(fleet.keys()) == ['data', 'web']
+    assert len(fleet['web']) == 2
+    assert len(fleet['data']) == 1
+
+def test_get_fleets_merged():
+    fleets = {
+        ('foo', 'us-east-1'): {'web': [{'InstanceId': 'i-1'}]},
+        ('bar', 'eu-west-1'): {'web': [{'InstanceId': 'i-2'}], 'data': [{'InstanceId': 'i-3'}]},
+    }
+    latencies = {}
+    with patch('aws_ssh.aws.get_fleet', side_effect=lambda profile, prefix, region_name: fleets[(profile, region_name)]):
+        fleet = aws.get_fleets(list(fleets), 'test-', latencies=latencies)
+    assert sorted(instance['InstanceId'] for instance in fleet['web']) == ['i-1', 'i-2']
+    assert fleet['data'] == [{'InstanceId': 'i-3', aws.TARGET_FIELD: ['bar', 'eu-west-1']}]
+    assert sorted(latencies) == sorted(fleets)
+
+def test_get_fleets_concurrent():
+    barrier = threading.Barrier(3, timeout=5)
+    def get_fleet(profile, prefix, region_name):
+        barrier.wait() # Deadlocks unless every target is swept at once
+        return {}
+    with patch('aws_ssh.aws.get_fleet', side_effect=get_fleet):
+        assert aws.get_fleets([('foo', 'a'), ('foo', 'b'), ('foo', 'c')], 'test-') == {}
+
+def test_get_fleets_partial_failure():
+    def get_fleet(profile, prefix, region_name):
+        if region_name == 'a':
+            raise Exception('Unauthorized')
+        return {'web': [{'InstanceId': 'i-1'}]}
+    with patch('aws_ssh.aws.get_fleet', side_effect=get_fleet):
+        assert list(aws.get_fleets([('foo', 'a'), ('foo', 'b')], 'test-')) == ['web']
+
+def test_get_fleets_failure():
+    with patch('aws_ssh.aws.get_fleet', side_effect=Exception('Unauthorized')):
+        with pytest.raises(Exception):
+            aws.get_fleets([('foo', 'a'), ('foo', 'b')], 'test-')
+
+def test_find_instance_first_match():
+    stalled = threading.Event()
+    def get_instance_info(profile, prefix, name, region_name):
+        if region_name == 'slow':
+            stalled.wait(5)
+            raise errors.NoInstanceFoundError()
+        return {'InstanceId': 'i-1'}
+    latencies = {}
+    with patch('aws_ssh.aws.get_instance_info', side_effect=get_instance_info):
+        instance = aws.find_instance([('foo', 'slow'), ('foo', 'fast')], 'test-', 'web', latencies=latencies)
+    stalled.set()
+    assert instance == {'InstanceId': 'i-1', aws.TARGET_FIELD: ['foo', 'fast']}
+    assert ('foo', 'fast') in latencies
+
+def test_find_instance_missing():
+    with patch('aws_ssh.aws.get_instance_info', side_effect=errors.NoInstanceFoundError()):
+        with pytest.raises(errors.NoInstanceFoundError):
+            aws.find_instance([('foo', 'a'), ('foo', 'b')], 'test-', 'web')
+
+def test_find_instance_duplicated():
+    with patch('aws_ssh.aws.get_instance_info', side_effect=errors.TooManyInstancesError()):
+        with pytest.raises(errors.TooManyInstancesError):
+            aws.find_instance([('foo', 'a'), ('foo', 'b')], 'test-', 'web')
+
+def test_find_instance_error():
+    def get_instance_info(profile, prefix, name, region_name):
+        if region_name == 'a':
+            raise ValueError('Unauthorized')
+        raise errors.NoInstanceFoundError()
+    with patch('aws_ssh.aws.get_instance_info', side_effect=get_instance_info):
+        with pytest.raises(ValueError):
+            aws.find_instance([('foo', 'a'), ('foo', 'b')], 'test-', 'web')
+
+def test_start_instance(session_vars):
+    aws.start_instance('foobar', 'i-123')
+    session_vars.client.return_value.start_instances.assert_called_with(InstanceIds=['i-123'])
+
+def described(*states):
+    return [{'Reservations': [{'Instances': [{'InstanceId': 'i-123', 'State': {'Name': state}}]}]}
+            for state in states]
+
+def test_wait_for_state(session_vars):
+    session_vars.describe_instances.side_effect = described('pending', 'pending', 'running')
+    with patch('time.sleep') as sleep_mock:
+        instance = aws.wait_for_state('foobar', 'i-123', ('running',))
+    assert instance['State']['Name'] == 'running'
+    session_vars.describe_instances.assert_called_with(InstanceIds=['i-123'])
+    assert [args[0][0] for args in sleep_mock.call_args_list] == [0.5, 1.0]
+
+def test_wait_for_state_timeout(session_vars):
+    session_vars.describe_instances.side_effect = described('pending')
+    with pytest.raises(errors.InstanceNotRunningError):
+        aws.wait_for_state('foobar', 'i-123', ('running',), timeout=0)
+
+def test_get_instance_name():
+    assert aws.get_instance_name(json.loads(SAMPLE_INSTANCE_BODY)) == 'project-compute'
+    assert aws.get_instance_name({}) is None
+
+def test_get_image_info(session_vars):
+    describe_images = session_vars.client.return_value.describe_images
+    describe_images.return_value = {'Images': [{'ImageId': 'ami-d05e75b8', 'Name': 'ubuntu'}]}
+    assert aws.get_image_info('foobar', 'ami-d05e75b8')['Name'] == 'ubuntu'
+    describe_images.assert_called_with(ImageIds=['ami-d05e75b8'])
+
+def test_get_image_info_missing(session_vars):
+    session_vars.client.return_value.describe_images.return_value = {'Images': []}
+    assert aws.get_image_info('foobar', 'ami-d05e75b8') is None
+
+def test_get_image_info_error(session_vars):
+    error = ClientError({'Error': {'Code': 'InvalidAMIID.NotFound', 'Message': 'nope'}}, 'DescribeImages')
+    session_vars.client.return_value.describe_images.side_effect = error
+    assert aws.get_image_info('foobar', 'ami-d05e75b8') is None
+
 def get_sample_response(instance_count=1):
     response = {'Reservations': [{'Instances': []}]}
     if instance_count == 0:
@@ -0,0 +1,57 @@
+# pylint: disable=redefined-outer-name,no-self-use,unused-argument,protected-access,missing-docstring
+import os
+
+from benchmarks import run
+from benchmarks.stubs import StubEC2Client, make_fleet
+
+def test_stub_client():
+    client = StubEC2Client(make_fleet('foo-', 25), page_size=10)
+    response = client.describe_instances(Filters=[{'Name': 'tag:Name', 'Values': ['foo-node00003']}])
+    assert [reservation['Instances'][0]['InstanceId'] for reservation in response['Reservations']] == [
+        'i-00000000000000003']
+    pages = list(client.get_paginator('describe_instances').paginate(
+        Filters=[{'Name': 'tag:Name', 'Values': ['foo-*']}]))
+    assert [len(page['Reservations']) for page in pages] == [10, 10, 5]
+    assert client.calls == 4
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert run.percentile(values, 50) == 50
+    assert run.percentile(values, 99) == 99
+    assert run.percentile([3.0], 99) == 3.0
+
+def test_find_regressions():
+    results = {'connect_warm:10:total': {'p50': 20.0, 'p99': 30.0},
+               'find_config:10:Project.find_config': {'p50': 0.2, 'p99': 0.9}}
+    baseline = {'connect_warm:10:total': {'p50': 10.0, 'p99': 15.0},
+                'find_config:10:Project.find_config': {'p50': 0.1, 'p99': 0.2}}
+    assert run.find_regressions(results) == []
+    assert run.find_regressions(results, baseline) == [
+        'connect_warm:10:total: p50 of 20.00ms exceeds the baseline of 10.00ms']
+    assert run.find_regressions(results, budgets={'find_config:Project.find_config': 0.5}) == [
+        'find_config:10:Project.find_config: p99 of 0.90ms exceeds the budget of 0.50ms']
+
+def test_find_regressions_ratios():
+    results = {'connect_warm:10:total': {'p50': 2.0, 'p99': 3.0},
+               'connect_warm:50000:total': {'p50': 9.0, 'p99': 12.0},
+               'connect_cold:50000:total': {'p50': 100.0, 'p99': 150.0}}
+    ratios = {'connect_warm:total': {'connect_warm:10:total': 3, 'connect_cold:total': 0.5,
+                                     'get_instance_info:aws.get_instance_info': 1}}
+    assert run.find_regressions(results, ratios=ratios) == [
+        'connect_warm:50000:total: p50 of 9.00ms exceeds 3 times the 2.00ms of connect_warm:10:total']
+    results['connect_warm:50000:total']['p50'] = 1.0 # Within the noise floor
+    results['connect_warm:10:total']['p50'] = 0.2
+    assert run.find_regressions(results, ratios=ratios) == []
+
+def test_get_reference_key():
+    assert run.get_reference_key('connect_cold:total', '50000') == 'connect_cold:50000:total'
+    assert run.get_reference_key('connect_warm:10:total', '50000') == 'connect_warm:10:total'
+
+def test_run_benchmarks():
+    cwd, home = os.getcwd(), os.environ.get('HOME')
+    results = run.run_benchmarks(list(run.SCENARIOS), [10], 2, 3, 0, 0)
+    assert (os.getcwd(), os.environ.get('HOME')) == (cwd, home)
+    for stage in ('Project.find_config', 'aws.get_fleet', 'Instance.get_user_name', 'total'):
+        assert 'connect_cold:10:{}'.format(stage) in results
+    assert 'aws.get_fleet' not in [key.split(':')[2] for key in results if key.startswith('connect_warm:')]
+    assert 'get_instance_info:10:aws.get_instance_info' in results
@@ -0,0 +1,232 @@
+"""Test the cache module"""
+# pylint: disable=redefined-outer-name,no-self-use,unused-argument,protected-access,missing-docstring,invalid-name,line-too-long
+import json
+import os
+import threading
+try:
+    from unittest.mock import MagicMock, patch
+except ImportError:
+    from mock import MagicMock, patch
+
+import pytest
+
+from aws_ssh import cache
+from test_aws import SAMPLE_INSTANCE_BODY # pylint: disable=import-error
+
+@pytest.fixture
+def instance_cache(tmpdir):
+    return cache.InstanceCache(str(tmpdir), ttl=60)
+
+@pytest.fixture
+def aws_resource():
+    return json.loads(SAMPLE_INSTANCE_BODY)
+
+def test_locked(tmpdir):
+    path = os.path.join(str(tmpdir), 'nested', 'file.lock')
+    entered = threading.Event()
+    release = threading.Event()
+    order = []
+
+    def hold():
+        with cache.locked(path):
+            entered.set()
+            release.wait()
+            order.append('first')
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    entered.wait()
+    def wait():
+        with cache.locked(path):
+            order.append('second')
+
+    waiter = threading.Thread(target=wait)
+    waiter.start()
+    waiter.join(0.2)
+    assert order == []
+    release.set()
+    thread.join()
+    waiter.join()
+    assert order == ['first', 'second']
+
+def test_locked_on_wait(tmpdir):
+    path = os.path.join(str(tmpdir), 'file.lock')
+    on_wait = MagicMock()
+    with cache.locked(path, on_wait=on_wait):
+        pass
+    assert not on_wait.called
+    entered = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        with cache.locked(path):
+            entered.set()
+            release.wait()
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    entered.wait()
+    on_wait.side_effect = release.set
+    with cache.locked(path, on_wait=on_wait):
+        assert on_wait.called
+    thread.join()
+
+def test_locked_unavailable(tmpdir):
+    tmpdir.join('nested').write('') # A file where the directory should be
+    path = os.path.join(str(tmpdir), 'nested', 'file.lock')
+    with pytest.raises(OSError):
+        with cache.locked(path):
+            pass
+    with cache.locked(path, required=False): # Proceeds unlocked
+        pass
+
+def test_write_read_json(tmpdir):
+    path = os.path.join(str(tmpdir), 'nested', 'data.json')
+    cache.write_json(path, {'foo': [1, 2]})
+    assert cache.read_json(path) == {'foo': [1, 2]}
+    assert os.listdir(os.path.dirname(path)) == ['data.json']
+
+def test_read_json_missing(tmpdir):
+    assert cache.read_json(os.path.join(str(tmpdir), 'missing.json')) is None
+
+def test_read_json_corrupt(tmpdir):
+    path = tmpdir.join('corrupt.json')
+    path.write('{"foo": ')
+    assert cache.read_json(str(path)) is None
+
+def test_get_missing(instance_cache):
+    assert instance_cache.get('testing', None, 'foo-', 'web') is None
+
+def test_set_get(instance_cache, aws_resource):
+    instance_cache.set('testing', None, 'foo-', 'web', aws_resource)
+    entry = instance_cache.get('testing', None, 'foo-', 'web')
+    assert entry['PublicIpAddress'] == '52.90.39.59'
+    assert entry['InstanceId'] == 'i-0958008e'
+    assert 'Tags' not in entry
+
+def test_keyed_by_target(instance_cache, aws_resource):
+    instance_cache.set('testing', None, 'foo-', 'web', aws_resource)
+    assert instance_cache.get('other', None, 'foo-', 'web') is None
+    assert instance_cache.get('testing', 'eu-west-1', 'foo-', 'web') is None
+    assert instance_cache.get('testing', None, 'bar-', 'web') is None
+
+def test_expired(instance_cache, aws_resource):
+    with patch('aws_ssh.cache.time.time') as time_mock:
+        time_mock.return_value = 1000
+        instance_cache.set('testing', None, 'foo-', 'web', aws_resource)
+        time_mock.return_value = 1061
+        assert instance_cache.get('testing', None, 'foo-', 'web') is None
+
+def test_disabled(tmpdir, aws_resource):
+    instance_cache = cache.InstanceCache(str(tmpdir), ttl=0)
+    instance_cache.set('testing', None, 'foo-', 'web', aws_resource)
+    assert instance_cache.get('testing', None, 'foo-', 'web') is None
+
+def test_update(instance_cache, aws_resource):
+    instance_cache.set('testing', None, 'foo-', 'web', aws_resource)
+    instance_cache.update('testing', None, 'foo-', {'data': aws_resource, 'compute': aws_resource})
+    for name in ('web', 'data', 'compute'):
+        assert instance_cache.get('testing', None, 'foo-', name) is not None
+
+def test_invalidate(instance_cache, aws_resource):
+    instance_cache.set('testing', None, 'foo-', 'web', aws_resource)
+    instance_cache.set('testing', None, 'foo-', 'data', aws_resource)
+    instance_cache.invalidate('testing', None, 'foo-', 'web')
+    assert instance_cache.get('testing', None, 'foo-', 'web') is None
+    assert instance_cache.get('testing', None, 'foo-', 'data') is not None
+
+def test_image_cache(tmpdir):
+    image_cache = cache.ImageCache(str(tmpdir))
+    assert image_cache.get('ami-123') is None
+    image_cache.set('ami-123', {'ImageId': 'ami-123', 'Name': 'ubuntu', 'BlockDeviceMappings': []})
+    assert image_cache.get('ami-123') == {'ImageId': 'ami-123', 'Name': 'ubuntu'}
+
+def test_route_cache(tmpdir):
+    route_cache = cache.RouteCache(str(tmpdir), ttl=60)
+    assert route_cache.get('eth0/192.168.1.1', 'i-123') is None
+    route_cache.set('eth0/192.168.1.1', 'i-123', 'private')
+    assert route_cache.get('eth0/192.168.1.1', 'i-123') == 'private'
+    assert route_cache.get('eth0/10.0.0.1', 'i-123') is None
+
+def test_route_cache_expired(tmpdir):
+    route_cache = cache.RouteCache(str(tmpdir), ttl=60)
+    with patch('aws_ssh.cache.time.time') as time_mock:
+        time_mock.return_value = 1000
+        route_cache.set('eth0/192.168.1.1', 'i-123', 'private')
+        time_mock.return_value = 1061
+        assert route_cache.get('eth0/192.168.1.1', 'i-123') is None
+
+def test_get_all(instance_cache, aws_resource):
+    assert instance_cache.get_all('testing', None, 'foo-') == ({}, True)
+    with patch('aws_ssh.cache.time.time') as time_mock:
+        time_mock.return_value = 1000
+        instance_cache.update('testing', None, 'foo-', {'web': aws_resource, 'data': aws_resource})
+        entries, stale = instance_cache.get_all('testing', None, 'foo-')
+        assert sorted(entries) == ['data', 'web']
+        assert not stale
+        time_mock.return_value = 1061
+        entries, stale = instance_cache.get_all('testing', None, 'foo-')
+        assert sorted(entries) == ['data', 'web']
+        assert stale
+
+def test_update_replace(instance_cache, aws_resource):
+    instance_cache.update('testing', None, 'foo-', {'web': aws_resource, 'data': aws_resource})
+    instance_cache.update('testing', None, 'foo-', {'data': aws_resource}, replace=True)
+    assert sorted(instance_cache.get_all('testing', None, 'foo-')[0]) == ['data']
+
+def test_get_reads_shard(instance_cache, aws_resource):
+    instance_cache.update('testing', None, 'foo-', {'node{}'.format(index): aws_resource for index in range(1000)})
+    shard_dir = instance_cache._shard_dir('testing', None, 'foo-')
+    assert 200 < len(os.listdir(shard_dir)) <= 256
+    with patch('aws_ssh.cache.read_json', wraps=cache.read_json) as read_mock:
+        assert instance_cache.get('testing', None, 'foo-', 'node500')['InstanceId'] == 'i-0958008e'
+    read_mock.assert_called_once_with(os.path.join(shard_dir, '{}.json'.format(cache.get_shard('node500'))))
+
+def test_update_replace_shards(instance_cache, aws_resource):
+    instance_cache.update('testing', None, 'foo-', {'web': aws_resource, 'data': aws_resource})
+    instance_cache.update('testing', None, 'foo-', {'data': aws_resource}, replace=True)
+    assert instance_cache.get('testing', None, 'foo-', 'web') is None
+    assert os.listdir(instance_cache._shard_dir('testing', None, 'foo-')) == [
+        '{}.json'.format(cache.get_shard('data'))]
+
+@pytest.fixture
+def miss_cache(tmpdir):
+    return cache.MissCache(str(tmpdir), ttl=30)
+
+def test_miss_cache(miss_cache):
+    assert miss_cache.get('testing', None, 'foo-', 'web') is None
+    with patch('aws_ssh.cache.time.time') as time_mock:
+        time_mock.return_value = 1000
+        miss_cache.set('testing', None, 'foo-', 'web', 'NoInstanceFoundError')
+        assert miss_cache.get('testing', None, 'foo-', 'web') == 'NoInstanceFoundError'
+        assert miss_cache.get('testing', 'eu-west-1', 'foo-', 'web') is None
+        assert miss_cache.get('testing', None, 'foo-', 'data') is None
+        time_mock.return_value = 1031
+        assert miss_cache.get('testing', None, 'foo-', 'web') is None
+
+def test_miss_cache_prunes(miss_cache):
+    with patch('aws_ssh.cache.time.time') as time_mock:
+        time_mock.return_value = 1000
+        miss_cache.set('testing', None, 'foo-', 'web', 'NoInstanceFoundError')
+        miss_cache.set('testing', None, 'bar-', 'web', 'NoInstanceFoundError')
+        time_mock.return_value = 1031
+        miss_cache.set('testing', None, 'foo-', 'data', 'TooManyInstancesError')
+    assert list(cache.read_json(miss_cache.path).values()) == [
+        {'data': {'error': 'TooManyInstancesError', 'cached_at': 1031}}]
+
+def test_miss_cache_invalidate(miss_cache):
+    miss_cache.set('testing', None, 'foo-', 'web', 'NoInstanceFoundError')
+    miss_cache.set('testing', None, 'foo-', 'data', 'NoInstanceFoundError')
+    miss_cache.set('testing', None, 'bar-', 'web', 'NoInstanceFoundError')
+    miss_cache.invalidate('testing', None, 'foo-', 'web')
+    assert miss_cache.get('testing', None, 'foo-', 'web') is None
+    assert miss_cache.get('testing', None, 'foo-', 'data') == 'NoInstanceFoundError'
+    miss_cache.invalidate('testing', None, 'foo-')
+    assert miss_cache.get('testing', None, 'foo-', 'data') is None
+    assert miss_cache.get('testing', None, 'bar-', 'web') == 'NoInstanceFoundError'
+    miss_cache.invalidate('testing', None, 'baz-')
+
+def test_miss_cache_disabled(tmpdir):
+    miss_cache = cache.MissCache(str(tmpdir), ttl=0)
+    miss_cache.set('testing', None, 'foo-', 'web', 'NoInstanceFoundError')
+    assert miss_cache.get('testing', None, 'foo-', 'web') is None
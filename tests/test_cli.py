@@ -1,20 +1,42 @@
 # pylint: disable=redefined-outer-name,no-self-use,unused-argument,protected-access,missing-docstring,invalid-name,line-too-long
 from collections import namedtuple
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
 try:
-    from unittest.mock import MagicMock, PropertyMock, patch, mock_open
+    from unittest.mock import ANY, MagicMock, PropertyMock, patch, mock_open
 except ImportError:
-    from mock import MagicMock, PropertyMock, patch, mock_open
+    from mock import ANY, MagicMock, PropertyMock, patch, mock_open
 
 import pytest
 import six
 from six.moves.configparser import ConfigParser  # pylint: disable=import-error
 
-from aws_ssh import cli
+from aws_ssh import cli, timing
+from aws_ssh.cache import InstanceCache
+from aws_ssh.errors import (HostUnreachableError, InstanceNotRunningError, NoAddressError, NoInstanceFoundError,
+                            ProbeConfigError, TooManyInstancesError, UnknownProjectError, UsernameNotFoundError)
 from aws_ssh.interfaces import Environment
 from fixtures import * # pylint: disable=import-error,wildcard-import
+from test_aws import SAMPLE_INSTANCE_BODY # pylint: disable=import-error
 
 EnvironmentVars = namedtuple('EnvironmentVars', 'env config, config_values')
 
+@pytest.fixture(autouse=True)
+def query_mock():
+    with patch('aws_ssh.daemon.query') as query_mock:
+        query_mock.return_value = None
+        yield query_mock
+
+@pytest.fixture(autouse=True)
+def port_mock():
+    with patch('aws_ssh.cli.wait_for_port') as port_mock:
+        port_mock.return_value = True
+        yield port_mock
+
 @pytest.fixture
 def env_mock():
     with patch('aws_ssh.cli.Environment') as env_mock:
@@ -46,7 +68,7 @@ def prompt_mock():
 
 def test_print_ssh_args(exit_mock):
     with patch('aws_ssh.cli.get_ssh_args') as get_args:
-        get_args.return_value = ('/path/to/test_key', 'test_user', '0.0.0.0')
+        get_args.return_value = cli.SSHArgs('/path/to/test_key', 'test_user', '0.0.0.0', False, [])
         outstream = six.StringIO()
         cli.print_ssh_args(out=outstream)
         assert isinstance(get_args.call_args[0][0], list)
@@ -54,6 +76,77 @@ def test_print_ssh_args(exit_mock):
         assert output == '-i /path/to/test_key test_user@0.0.0.0'
         exit_mock.assert_called_with(170)
 
+def test_print_ssh_args_options(exit_mock):
+    with patch('aws_ssh.cli.get_ssh_args') as get_args:
+        get_args.return_value = cli.SSHArgs('/path/to/test_key', 'test_user', '0.0.0.0', False,
+                                            ['-o', 'ControlMaster=auto', '-o', 'ControlPath=/path/to/cm/%C'])
+        outstream = six.StringIO()
+        cli.print_ssh_args(out=outstream)
+        output = outstream.getvalue().strip()
+        assert output == '-i /path/to/test_key -o ControlMaster=auto -o ControlPath=/path/to/cm/%C test_user@0.0.0.0'
+
+def test_print_ssh_args_cached(exit_mock):
+    with patch('aws_ssh.cli.get_ssh_args') as get_args:
+        get_args.return_value = cli.SSHArgs('/path/to/test_key', 'test_user', '0.0.0.0', True, [])
+        cli.print_ssh_args(out=six.StringIO())
+        exit_mock.assert_called_with(171)
+
+def test_print_ssh_args_timings(exit_mock):
+    with patch('aws_ssh.cli.get_ssh_args') as get_args, patch('aws_ssh.timing.report') as report_mock:
+        get_args.side_effect = SystemExit(2)
+        with pytest.raises(SystemExit):
+            cli.print_ssh_args(out=six.StringIO())
+        report_mock.assert_called_with(version=ANY)
+    assert 'import' in [name for name, _, _, _ in timing.get_spans()]
+
+def test_get_ssh_args_timings(env_mock, query_mock):
+    query_mock.return_value = {'key': '/path/to/key.pem', 'user': 'test_user', 'addr': '0.0.0.0', 'cached': True,
+                               'options': []}
+    timing.reset()
+    with patch('aws_ssh.timing.show_table') as show_mock:
+        cli.get_ssh_args(['fooinst'])
+        assert not show_mock.called
+        cli.get_ssh_args(['--timings', 'fooinst'])
+        assert show_mock.called
+    names = [name for name, _, _, _ in timing.get_spans()]
+    assert names == ['get_ssh_args', 'daemon.query'] * 2
+
+def test_main_default(exit_mock):
+    with patch('aws_ssh.cli.print_ssh_args') as print_mock, patch('sys.argv', ['aws-ssh-cli', 'web']):
+        cli.main()
+        print_mock.assert_called_with()
+
+def test_main_command(exit_mock):
+    with patch.dict(cli.COMMANDS, {'daemon': MagicMock(return_value=0)}), patch('sys.argv', ['aws-ssh-cli', 'daemon', '--debug']):
+        cli.main()
+        cli.COMMANDS['daemon'].assert_called_with(['--debug'])
+        exit_mock.assert_called_with(0)
+
+def test_run_complete(capsys):
+    with patch('aws_ssh.completion.complete') as complete_mock, patch('os.getcwd') as getcwd_mock:
+        complete_mock.return_value = ['data', 'web', 'foo:']
+        assert cli.run_complete(['w']) == 0
+        complete_mock.assert_called_with('w', getcwd_mock.return_value)
+        assert cli.run_complete([]) == 0
+        complete_mock.assert_called_with('', getcwd_mock.return_value)
+    assert capsys.readouterr().out == 'data\nweb\nfoo:\n' * 2
+
+def test_run_exec(env_mock):
+    project = env_mock.return_value.find_project.return_value
+    project.get_fleet.return_value = {'web-1': [], 'web-2': [], 'data': []}
+    with patch('aws_ssh.execute.Runner') as runner_mock, patch('aws_ssh.execute.write_summary'):
+        runner_mock.return_value.run.return_value = [cli.execute.Result('web-1', 0, 1, None)]
+        assert cli.run_exec(['-j', '3', 'web-*', '--', 'uptime', '-p']) == 0
+        runner_mock.assert_called_with(project, ['uptime', '-p'], workers=3, connect_timeout=10)
+        project.get_instances.assert_called_with(['web-1', 'web-2'])
+        runner_mock.return_value.run.return_value = [cli.execute.Result('web-1', 255, 1, None)]
+        assert cli.run_exec(['web-*', '--', 'uptime']) == 1
+
+def test_run_exec_no_match(env_mock):
+    env_mock.return_value.find_project.return_value.get_fleet.return_value = {'data': []}
+    with pytest.raises(SystemExit):
+        cli.run_exec(['web-*', '--', 'uptime'])
+
 def test_init_environment():
     with patch('aws_ssh.cli.prompt_for_arg') as prompt_mock:
         environment = Environment()
@@ -111,15 +204,61 @@ def test_get_ssh_args_init_with_args(env_mock, exit_mock):
         exit_mock.assert_called_with(-1)
 
 def test_get_ssh_args_no_instance_name(env_mock):
-    with patch('os.getcwd') as cwd_mock:
+    with patch('os.getcwd') as cwd_mock, patch('aws_ssh.cli.pick_instance') as pick_mock:
         cwd_mock.return_value = '/path/to/cwd'
         project = MagicMock()
         env_mock.is_initialized.return_value = True
         env_mock.return_value.find_project.return_value = project
-        with pytest.raises(SystemExit):
-            cli.get_ssh_args([])
+        pick_mock.return_value = 'fooinst'
+        cli.get_ssh_args([])
         env_mock.return_value.find_project.assert_called_with('/path/to/cwd')
-        project.get_instance.assert_not_called()
+        pick_mock.assert_called_with(ANY, project)
+        project.get_instance.assert_called_with('fooinst', refresh=False)
+
+def test_get_picker_rows():
+    rows = cli.get_picker_rows({
+        'web': {'State': {'Name': 'running'}, 'PublicIpAddress': '52.0.0.1', 'InstanceType': 't3.micro',
+                'LaunchTime': '2016-05-12T19:38:00.000Z'},
+        'database': {'State': {'Name': 'stopped'}, 'PrivateIpAddress': '10.0.0.1'},
+    })
+    assert rows == [('database', 'database  stopped  10.0.0.1  -         -'),
+                    ('web', 'web       running  52.0.0.1  t3.micro  2016-05-12 19:38')]
+
+def test_pick_instance_no_terminal():
+    project = MagicMock()
+    project.get_cached_fleet.return_value = ({'web': {}}, False)
+    with patch('aws_ssh.picker.Picker.run', side_effect=OSError('No such device or address')):
+        with pytest.raises(SystemExit):
+            cli.pick_instance(cli.get_parser(), project)
+
+def test_pick_instance_cancelled():
+    project = MagicMock()
+    project.get_cached_fleet.return_value = ({'web': {}}, False)
+    with patch('aws_ssh.picker.Picker.run', return_value=None):
+        with pytest.raises(SystemExit):
+            cli.pick_instance(cli.get_parser(), project)
+
+def test_pick_instance_empty_cache():
+    project = MagicMock()
+    project.get_cached_fleet.side_effect = [({}, True), ({'web': {}}, False)]
+    with patch('aws_ssh.picker.Picker.run', side_effect=lambda: ('web', 'web')):
+        assert cli.pick_instance(cli.get_parser(), project) == 'web'
+    project.get_fleet.assert_called_once_with()
+
+def test_pick_instance_stale():
+    project = MagicMock()
+    project.get_cached_fleet.side_effect = [({'web': {}}, True), ({'web': {}, 'data': {}}, False)]
+    refreshed = threading.Event()
+    project.get_fleet.side_effect = lambda refresh: refreshed.set()
+    with patch('aws_ssh.picker.Picker.update') as update_mock, patch('aws_ssh.picker.Picker.run') as run_mock:
+        run_mock.side_effect = lambda: refreshed.wait(5) and ('web', 'web')
+        assert cli.pick_instance(cli.get_parser(), project) == 'web'
+    project.get_fleet.assert_called_once_with(refresh=True)
+    for _ in range(50):
+        if update_mock.called:
+            break
+        time.sleep(0.01)
+    assert [name for name, _ in update_mock.call_args[0][0]] == ['data', 'web']
 
 def test_get_ssh_args_instance_name(env_mock, exit_mock):
     with patch('os.getcwd') as cwd_mock:
@@ -133,14 +272,254 @@ def test_get_ssh_args_instance_name(env_mock, exit_mock):
         ip_mock = PropertyMock(return_value='0.0.0.0')
         type(instance).ip = ip_mock
         instance.get_user_name.return_value = 'test_user'
+        instance.cached = False
         project.get_instance.return_value = instance
+        instance.ssh_options = ['-o', 'ControlMaster=auto']
         args = cli.get_ssh_args(['fooinst'])
         env_mock.return_value.find_project.assert_called_with('/path/to/cwd')
-        project.get_instance.assert_called_with('fooinst')
+        project.get_instance.assert_called_with('fooinst', refresh=False)
         key_path_mock.assert_called_with()
         instance.get_user_name.assert_called_with()
         ip_mock.assert_called_with()
-        assert len(args) == 3
-        assert args[0] == '/path/to/key.pem'
-        assert args[1] == 'test_user'
-        assert args[2] == '0.0.0.0'
+        assert len(args) == 5
+        assert args.key == '/path/to/key.pem'
+        assert args.user == 'test_user'
+        assert args.addr == '0.0.0.0'
+        assert not args.cached
+        assert args.options == ['-o', 'ControlMaster=auto']
+
+def test_get_ssh_args_daemon(env_mock, query_mock):
+    with patch('os.getcwd') as cwd_mock:
+        cwd_mock.return_value = '/path/to/cwd'
+        query_mock.return_value = {'key': '/path/to/key.pem', 'user': 'test_user', 'addr': '0.0.0.0', 'cached': True,
+                                   'options': []}
+        args = cli.get_ssh_args(['fooinst'])
+    query_mock.assert_called_with('/path/to/cwd', 'fooinst', refresh=False)
+    assert not env_mock.called
+    assert args == cli.SSHArgs('/path/to/key.pem', 'test_user', '0.0.0.0', True, [])
+
+def test_get_ssh_args_daemon_stale(env_mock, query_mock, port_mock):
+    port_mock.return_value = False
+    stale = {'key': '/path/to/key.pem', 'user': 'test_user', 'addr': '0.0.0.0', 'cached': True, 'options': []}
+    query_mock.side_effect = [stale, dict(stale, addr='0.0.0.1', cached=False)]
+    args = cli.get_ssh_args(['fooinst'])
+    port_mock.assert_called_once_with('0.0.0.0', 22, timeout=cli.CACHED_CONNECT_TIMEOUT,
+                                      connect_timeout=cli.CACHED_CONNECT_TIMEOUT)
+    query_mock.assert_called_with(ANY, 'fooinst', refresh=True)
+    assert args.addr == '0.0.0.1'
+    assert not args.cached
+
+def test_get_ssh_args_cached_unreachable(env_mock, port_mock):
+    project = env_mock.return_value.find_project.return_value
+    stale, fresh = MagicMock(cached=True, ip='0.0.0.0', ssh_options=[]), MagicMock(cached=False, ip='0.0.0.1')
+    project.get_instance.side_effect = [stale, fresh]
+    port_mock.return_value = False
+    args = cli.get_ssh_args(['fooinst'])
+    project.get_instance.assert_called_with('fooinst', refresh=True)
+    assert args.addr == '0.0.0.1'
+    assert port_mock.call_count == 1 # The fresh address is left to ssh
+
+def test_get_ssh_args_cached_bastion(env_mock, port_mock):
+    instance = env_mock.return_value.find_project.return_value.get_instance.return_value
+    instance.cached = True
+    instance.ssh_options = ['-o', 'ProxyJump=bastion.example.com']
+    assert cli.get_ssh_args(['fooinst']).cached
+    assert not port_mock.called # Only the bastion can reach the instance
+
+def test_get_ssh_args_qualified(env_mock):
+    project = env_mock.return_value.get_project.return_value
+    project.get_instance.return_value.cached = False
+    cli.get_ssh_args(['foo:fooinst'])
+    env_mock.return_value.get_project.assert_called_with('foo')
+    assert not env_mock.return_value.find_project.called
+    project.get_instance.assert_called_with('fooinst', refresh=False)
+
+def test_get_ssh_args_unknown_project(env_mock):
+    env_mock.return_value.get_project.side_effect = UnknownProjectError('foo')
+    with pytest.raises(SystemExit):
+        cli.get_ssh_args(['foo:fooinst'])
+
+def test_get_ssh_args_missing(env_mock, capsys):
+    project = env_mock.return_value.find_project.return_value
+    project.prefix = 'foo-'
+    project.get_instance.side_effect = NoInstanceFoundError('compte')
+    project.suggest_instance_names.return_value = ['compute', 'compose']
+    with pytest.raises(SystemExit):
+        cli.get_ssh_args(['compte'])
+    project.suggest_instance_names.assert_called_with('compte')
+    assert ('No instance named "foo-compte" found. Did you mean "compute" or "compose"? Pass --refresh if it was just '
+            'created.') in capsys.readouterr().err
+
+def test_get_ssh_args_missing_no_suggestions(env_mock, capsys):
+    project = env_mock.return_value.find_project.return_value
+    project.prefix = 'foo-'
+    project.get_instance.side_effect = NoInstanceFoundError('xyz')
+    project.suggest_instance_names.return_value = []
+    with pytest.raises(SystemExit):
+        cli.get_ssh_args(['xyz'])
+    assert 'No instance named "foo-xyz" found. Pass --refresh' in capsys.readouterr().err
+
+def test_get_ssh_args_ambiguous(env_mock, capsys):
+    project = env_mock.return_value.find_project.return_value
+    project.prefix = 'foo-'
+    project.get_instance.side_effect = TooManyInstancesError('web')
+    with pytest.raises(SystemExit):
+        cli.get_ssh_args(['web'])
+    assert 'Several instances are named "foo-web".' in capsys.readouterr().err
+
+def test_get_ssh_args_refresh(env_mock):
+    project = env_mock.return_value.find_project.return_value
+    project.get_instance.return_value.cached = False
+    cli.get_ssh_args(['--refresh', 'fooinst'])
+    project.get_instance.assert_called_with('fooinst', refresh=True)
+
+def test_get_ssh_args_stale_cache(env_mock):
+    project = env_mock.return_value.find_project.return_value
+    stale, fresh = MagicMock(cached=True, ip='0.0.0.0'), MagicMock(cached=False, ip='0.0.0.1')
+    stale.get_user_name.side_effect = UsernameNotFoundError()
+    fresh.get_user_name.return_value = 'test_user'
+    project.get_instance.side_effect = [stale, fresh]
+    args = cli.get_ssh_args(['fooinst'])
+    project.get_instance.assert_called_with('fooinst', refresh=True)
+    assert args.addr == '0.0.0.1'
+    assert not args.cached
+
+def test_get_ssh_args_unknown_user(env_mock):
+    project = env_mock.return_value.find_project.return_value
+    project.get_instance.return_value.cached = False
+    project.get_instance.return_value.get_user_name.side_effect = UsernameNotFoundError()
+    with pytest.raises(UsernameNotFoundError):
+        cli.get_ssh_args(['fooinst'])
+    assert project.get_instance.call_count == 1
+
+def test_get_ssh_args_unreachable(env_mock):
+    project = env_mock.return_value.find_project.return_value
+    stale, fresh = MagicMock(cached=True, ip='0.0.0.0'), MagicMock(cached=False, ip='0.0.0.1')
+    stale.get_user_name.side_effect = HostUnreachableError('Unable to reach foo-fooinst: Connection refused')
+    fresh.get_user_name.side_effect = HostUnreachableError('Unable to reach foo-fooinst: Connection refused')
+    project.get_instance.side_effect = [stale, fresh]
+    with pytest.raises(SystemExit):
+        cli.get_ssh_args(['fooinst'])
+    project.get_instance.assert_called_with('fooinst', refresh=True) # The cached address may be outdated
+
+def test_get_ssh_args_probe_config(env_mock, capsys):
+    instance = env_mock.return_value.find_project.return_value.get_instance.return_value
+    instance.cached = False
+    instance.get_user_name.side_effect = ProbeConfigError('Unable to probe foo-fooinst for its username')
+    with pytest.raises(SystemExit):
+        cli.get_ssh_args(['fooinst'])
+    assert 'Unable to probe foo-fooinst for its username' in capsys.readouterr().err
+
+def test_get_ssh_args_stopped(env_mock):
+    project = env_mock.return_value.find_project.return_value
+    project.get_instance.return_value = MagicMock(cached=False, is_running=False, state='stopped')
+    with pytest.raises(SystemExit):
+        cli.get_ssh_args(['fooinst'])
+    assert not project.get_instance.return_value.start.called
+
+def test_get_ssh_args_stopped_cached(env_mock):
+    project = env_mock.return_value.find_project.return_value
+    stale = MagicMock(cached=True, is_running=False, state='stopped')
+    fresh = MagicMock(cached=False, is_running=True, ip='0.0.0.1')
+    project.get_instance.side_effect = [stale, fresh]
+    assert cli.get_ssh_args(['fooinst']).addr == '0.0.0.1'
+    project.get_instance.assert_called_with('fooinst', refresh=True)
+
+def test_get_ssh_args_start(env_mock):
+    project = env_mock.return_value.find_project.return_value
+    instance = project.get_instance.return_value = MagicMock(cached=False, is_running=False, state='stopped')
+    instance.get_user_name.return_value = 'test_user'
+    cli.get_ssh_args(['--start', 'fooinst'])
+    instance.start.assert_called_with()
+
+def test_get_ssh_args_start_failed(env_mock):
+    project = env_mock.return_value.find_project.return_value
+    instance = project.get_instance.return_value = MagicMock(cached=False, is_running=False, state='stopped')
+    instance.start.side_effect = InstanceNotRunningError('foo-fooinst is still pending')
+    with pytest.raises(SystemExit):
+        cli.get_ssh_args(['--start', 'fooinst'])
+
+def test_get_ssh_args_no_address(env_mock, capsys):
+    project = env_mock.return_value.find_project.return_value
+    instance = project.get_instance.return_value = MagicMock(cached=False, is_running=True, ip=None)
+    instance.check_address.side_effect = NoAddressError('foo-fooinst has no public address. Set `route = private`, '
+                                                        '`bastion`, or `auto` in .awssshconfig to reach it another way.')
+    with pytest.raises(SystemExit):
+        cli.get_ssh_args(['fooinst'])
+    assert 'Set `route = private`, `bastion`, or `auto`' in capsys.readouterr().err
+    assert not instance.get_user_name.called
+
+def test_get_ssh_args_stopped_cached_gone(env_mock, capsys):
+    project = env_mock.return_value.find_project.return_value
+    project.prefix = 'foo-'
+    project.suggest_instance_names.return_value = []
+    project.get_instance.side_effect = [MagicMock(cached=True, is_running=False, state='stopped'),
+                                        NoInstanceFoundError('fooinst')]
+    with pytest.raises(SystemExit):
+        cli.get_ssh_args(['fooinst'])
+    assert 'No instance named "foo-fooinst" found.' in capsys.readouterr().err
+
+def test_get_ssh_args_stale_cache_ambiguous(env_mock, capsys):
+    project = env_mock.return_value.find_project.return_value
+    project.prefix = 'foo-'
+    stale = MagicMock(cached=True, ip='0.0.0.0')
+    stale.get_user_name.side_effect = UsernameNotFoundError()
+    project.get_instance.side_effect = [stale, TooManyInstancesError('fooinst')]
+    with pytest.raises(SystemExit):
+        cli.get_ssh_args(['fooinst'])
+    assert 'Several instances are named "foo-fooinst".' in capsys.readouterr().err
+
+def test_get_ssh_args_stale_cache_stopped(env_mock, capsys):
+    project = env_mock.return_value.find_project.return_value
+    stale = MagicMock(cached=True, ip='0.0.0.0')
+    stale.get_user_name.side_effect = UsernameNotFoundError()
+    fresh = MagicMock(cached=False, is_running=False, state='stopped')
+    fresh.name = 'foo-fooinst'
+    project.get_instance.side_effect = [stale, fresh]
+    with pytest.raises(SystemExit):
+        cli.get_ssh_args(['fooinst'])
+    assert 'foo-fooinst is stopped. Pass --start to start it.' in capsys.readouterr().err
+    assert not fresh.get_user_name.called
+
+def get_imported_modules(importtime_output):
+    """Parse the module names out of `python -X importtime` output"""
+    return set(line.rsplit('|', 1)[1].strip() for line in importtime_output.splitlines()
+               if line.startswith('import time:') and '|' in line)
+
+def test_cached_connect_skips_heavy_imports(tmpdir):
+    home, project_root = tmpdir.mkdir('home'), tmpdir.mkdir('project')
+    home.mkdir('.aws-ssh').join('config.ini').write('[DEFAULT]\nkey_dir = /path/to/keys\n')
+    project_root.join('.awssshconfig').write('[DEFAULT]\nname = foo\nprefix = foo-\nprofile = testing\n'
+                                             'key = foo.pem\n\n[instance_foo-web]\nusername = ubuntu\n')
+    InstanceCache(os.path.join(str(home), '.aws-ssh', 'cache')).set('testing', None, 'foo-', 'web',
+                                                                   json.loads(SAMPLE_INSTANCE_BODY))
+    env = dict(os.environ, HOME=str(home), PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    process = subprocess.Popen(
+        [sys.executable, '-X', 'importtime', '-c',
+         'import sys; from aws_ssh import cli; sys.argv = ["aws-ssh-cli", "web"]; cli.print_ssh_args()'],
+        cwd=str(project_root), env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    stdout, stderr = process.communicate()
+    assert process.returncode == cli.EXIT_CONNECT_CACHED, stderr
+    control_path = os.path.join(str(home), '.aws-ssh', 'cm', '%C')
+    assert stdout.strip() == ('-i /path/to/keys/foo.pem -o ControlMaster=auto -o ControlPath={} '
+                              '-o ControlPersist=10m ubuntu@52.90.39.59'.format(control_path))
+    imported = get_imported_modules(stderr)
+    assert 'aws_ssh.interfaces' in imported
+    for module in ('boto3', 'botocore', 'pexpect', 'tqdm'):
+        assert module not in imported
+
+def test_complete_skips_heavy_imports(tmpdir):
+    home, project_root = tmpdir.mkdir('home'), tmpdir.mkdir('project')
+    home.mkdir('.aws-ssh').join('registry.json').write(json.dumps({'foo': {'root': str(project_root)}}))
+    home.join('.aws-ssh').mkdir('cache').join('names').write('foo:data\nfoo:web\nfoo:worker\n')
+    env = dict(os.environ, HOME=str(home), PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    process = subprocess.Popen(
+        [sys.executable, '-X', 'importtime', '-c',
+         'import sys; from aws_ssh import cli; sys.argv = ["aws-ssh-cli", "--complete", "w"]; cli.main()'],
+        cwd=str(project_root), env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    stdout, stderr = process.communicate()
+    assert process.returncode == 0, stderr
+    assert stdout.split() == ['web', 'worker']
+    imported = get_imported_modules(stderr)
+    for module in ('boto3', 'botocore', 'pexpect', 'tqdm'):
+        assert module not in imported
@@ -0,0 +1,85 @@
+# pylint: disable=redefined-outer-name,no-self-use,unused-argument,protected-access,missing-docstring
+import os
+import os.path
+import timeit
+try:
+    from unittest.mock import MagicMock
+except ImportError:
+    from mock import MagicMock
+
+import pytest
+
+from aws_ssh.completion import NameIndex, complete, find_project_name, suggest
+
+@pytest.fixture
+def name_index(tmpdir):
+    yield NameIndex(os.path.join(str(tmpdir), 'cache', 'names'))
+
+@pytest.fixture
+def registry():
+    registry = MagicMock()
+    registry.projects = {'foo': {'root': '/src/foo'}, 'foobar': {'root': '/src/foo/bar'},
+                         'baz': {'root': '/src/baz'}}
+    yield registry
+
+def test_search_missing(name_index):
+    assert name_index.search('foo:') == []
+
+def test_update(name_index):
+    name_index.update('foo', ['web', 'data'])
+    name_index.update('bar', ['web'])
+    with open(name_index.path) as indexfile:
+        assert indexfile.read() == 'bar:web\nfoo:data\nfoo:web\n'
+    assert name_index.search('foo:') == ['foo:data', 'foo:web']
+    assert name_index.search('foo:w') == ['foo:web']
+    assert name_index.search('foo:x') == []
+    assert name_index.search('') == ['bar:web', 'foo:data', 'foo:web']
+
+def test_update_merge(name_index):
+    name_index.update('foo', ['web', 'data'])
+    name_index.update('foo', ['compute'])
+    assert name_index.search('foo:') == ['foo:compute', 'foo:data', 'foo:web']
+    name_index.update('foo', ['web'], replace=True)
+    assert name_index.search('foo:') == ['foo:web']
+
+def test_update_unchanged(name_index):
+    name_index.update('foo', ['web'])
+    mtime = os.stat(name_index.path).st_mtime
+    os.utime(name_index.path, (mtime - 10, mtime - 10))
+    name_index.update('foo', ['web'])
+    assert os.stat(name_index.path).st_mtime == mtime - 10
+
+def test_search_large(name_index):
+    name_index.update('foo', ['node{:05d}'.format(index) for index in range(10000)])
+    assert name_index.search('foo:node0999') == ['foo:node0999{}'.format(index) for index in range(10)]
+    assert min(timeit.repeat(lambda: name_index.search('foo:node0999'), number=1, repeat=5)) < 0.05
+
+def test_find_project_name(registry):
+    assert find_project_name('/src/foo', registry) == 'foo'
+    assert find_project_name('/src/foo/lib', registry) == 'foo'
+    assert find_project_name('/src/foo/bar/lib', registry) == 'foobar'
+    assert find_project_name('/src/foobar', registry) is None
+    assert find_project_name('/elsewhere', registry) is None
+
+def test_complete(name_index, registry):
+    name_index.update('foo', ['web', 'data'])
+    name_index.update('baz', ['web', 'worker'])
+    assert complete('', '/src/foo/lib', name_index, registry) == ['data', 'web', 'baz:', 'foo:', 'foobar:']
+    assert complete('w', '/src/foo', name_index, registry) == ['web']
+    assert complete('f', '/src/foo', name_index, registry) == ['foo:', 'foobar:']
+    assert complete('w', '/elsewhere', name_index, registry) == []
+    assert complete('baz:w', '/src/foo', name_index, registry) == ['baz:web', 'baz:worker']
+
+def test_suggest():
+    names = ['compute', 'compose', 'web', 'data', 'comp', 'worker']
+    assert suggest('compte', names) == ['compute', 'comp', 'compose']
+    assert suggest('compte', names, limit=1) == ['compute']
+    assert suggest('wbe', names) == ['web'] # Transposition
+    assert suggest('dta', names) == ['data']
+    assert suggest('xyz', names) == []
+    assert suggest('compte', []) == []
+
+def test_suggest_large():
+    names = ['node{:05d}'.format(index) for index in range(50000)]
+    assert suggest('node0421', names) == ['node00421', 'node01421', 'node02421']
+    assert min(timeit.repeat(lambda: suggest('nod0421', names), number=1, repeat=3)) < 0.5
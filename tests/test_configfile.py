@@ -0,0 +1,138 @@
+"""Test the configfile module"""
+# pylint: disable=redefined-outer-name,no-self-use,unused-argument,protected-access,missing-docstring,invalid-name,line-too-long
+import os
+import stat
+import threading
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+import pytest
+from configparser import ConfigParser  # pylint: disable=import-error
+
+from aws_ssh import configfile
+
+CONFIG = """[DEFAULT]
+key_dir = /path/to/keys
+
+[project_foo]
+root = /path/to/foo
+
+[instance_foo-web]
+username = ubuntu
+"""
+
+@pytest.fixture
+def cache_dir(tmpdir):
+    return str(tmpdir.join('cache'))
+
+@pytest.fixture
+def config_path(tmpdir):
+    path = tmpdir.join('config.ini')
+    path.write(CONFIG)
+    return str(path)
+
+def read(path, cache_dir):
+    config = ConfigParser()
+    assert configfile.read_config(config, path, cache_dir)
+    return config
+
+def test_dump_config():
+    config = ConfigParser()
+    config.read_string(CONFIG)
+    assert configfile.dump_config(config) == {
+        'DEFAULT': {'key_dir': '/path/to/keys'},
+        'project_foo': {'root': '/path/to/foo'},
+        'instance_foo-web': {'username': 'ubuntu'},
+    }
+
+def test_read_missing(tmpdir, cache_dir):
+    assert not configfile.read_config(ConfigParser(), str(tmpdir.join('missing.ini')), cache_dir)
+
+def test_read_writes_snapshot(config_path, cache_dir):
+    config = read(config_path, cache_dir)
+    assert config['project_foo']['root'] == '/path/to/foo'
+    assert len(os.listdir(os.path.join(cache_dir, 'configs'))) == 1
+
+def test_read_uses_snapshot(config_path, cache_dir):
+    read(config_path, cache_dir)
+    with patch.object(ConfigParser, 'read') as read_mock:
+        config = read(config_path, cache_dir)
+    assert not read_mock.called
+    assert config['instance_foo-web']['username'] == 'ubuntu'
+    assert config['instance_foo-web']['key_dir'] == '/path/to/keys'
+
+def test_read_stale_snapshot(config_path, cache_dir):
+    read(config_path, cache_dir)
+    with open(config_path, 'a') as configfile_:
+        configfile_.write('\n[usernames]\nami-123 = admin\n')
+    config = read(config_path, cache_dir)
+    assert config['usernames']['ami-123'] == 'admin'
+
+def test_write_roundtrip(config_path, cache_dir):
+    config = read(config_path, cache_dir)
+    config['instance_foo-db'] = {'username': 'admin'}
+    configfile.write_config(config, config_path, cache_dir)
+    with patch.object(ConfigParser, 'read') as read_mock:
+        assert read(config_path, cache_dir)['instance_foo-db']['username'] == 'admin'
+    assert not read_mock.called
+    fresh = ConfigParser()
+    fresh.read(config_path)
+    assert fresh['instance_foo-db']['username'] == 'admin'
+
+def test_write_preserves_mode(config_path, cache_dir):
+    os.chmod(config_path, 0o640)
+    configfile.write_config(read(config_path, cache_dir), config_path, cache_dir)
+    assert stat.S_IMODE(os.stat(config_path).st_mode) == 0o640
+    assert sorted(os.listdir(os.path.dirname(config_path))) == ['cache', 'config.ini']
+
+def test_write_new(tmpdir, cache_dir):
+    path = str(tmpdir.join('nested', 'config.ini'))
+    config = ConfigParser()
+    config['DEFAULT']['key_dir'] = '/path/to/keys'
+    configfile.write_config(config, path, cache_dir)
+    assert read(path, cache_dir)['DEFAULT']['key_dir'] == '/path/to/keys'
+
+def test_save_merges_changes(config_path, cache_dir):
+    ours = read(config_path, cache_dir)
+    theirs = read(config_path, cache_dir)
+    theirs['instance_foo-db'] = {'username': 'admin'}
+    theirs['DEFAULT']['cache_ttl'] = '60'
+    configfile.save_config(theirs, config_path, {('instance_foo-db', None), ('DEFAULT', 'cache_ttl')}, cache_dir)
+    ours['instance_foo-web'] = {'username': 'ec2-user'}
+    ours['DEFAULT']['key_dir'] = '/path/to/other/keys'
+    configfile.save_config(ours, config_path, {('instance_foo-web', None), ('DEFAULT', 'key_dir')}, cache_dir)
+    merged = ConfigParser()
+    merged.read(config_path)
+    assert merged['instance_foo-db']['username'] == 'admin'
+    assert merged['instance_foo-web']['username'] == 'ec2-user'
+    assert merged['DEFAULT']['cache_ttl'] == '60'
+    assert merged['DEFAULT']['key_dir'] == '/path/to/other/keys'
+    assert merged['project_foo']['root'] == '/path/to/foo'
+
+def test_save_removes(config_path, cache_dir):
+    config = read(config_path, cache_dir)
+    config.remove_section('project_foo')
+    config.remove_option('DEFAULT', 'key_dir')
+    configfile.save_config(config, config_path, {('project_foo', None), ('DEFAULT', 'key_dir')}, cache_dir)
+    merged = ConfigParser()
+    merged.read(config_path)
+    assert not merged.has_section('project_foo')
+    assert not merged.has_option('DEFAULT', 'key_dir')
+    assert merged['instance_foo-web']['username'] == 'ubuntu'
+
+def test_save_concurrent(config_path, cache_dir):
+    def save(index):
+        config = read(config_path, cache_dir)
+        section = 'instance_foo-{}'.format(index)
+        config[section] = {'username': 'user{}'.format(index)}
+        configfile.save_config(config, config_path, {(section, None)}, cache_dir)
+    threads = [threading.Thread(target=save, args=(index,)) for index in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    merged = ConfigParser()
+    merged.read(config_path)
+    assert all(merged['instance_foo-{}'.format(index)]['username'] == 'user{}'.format(index) for index in range(20))
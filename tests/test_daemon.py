@@ -0,0 +1,165 @@
+"""Test the daemon module"""
+# pylint: disable=redefined-outer-name,no-self-use,unused-argument,protected-access,missing-docstring,invalid-name,line-too-long
+import json
+import os
+import threading
+import time
+try:
+    from unittest.mock import MagicMock, patch
+except ImportError:
+    from mock import MagicMock, patch
+
+import pytest
+
+from aws_ssh import daemon
+from aws_ssh.errors import InstanceNotRunningError, NoAddressError, NoInstanceFoundError
+from test_aws import SAMPLE_INSTANCE_BODY # pylint: disable=import-error
+
+@pytest.fixture
+def socket_path(tmpdir):
+    return os.path.join(str(tmpdir), 'daemon.sock')
+
+@pytest.fixture
+def resolver():
+    return MagicMock()
+
+@pytest.fixture
+def server(resolver, socket_path):
+    server = daemon.ResolverServer(resolver, socket_path)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def environment(tmpdir):
+    environment = MagicMock()
+    environment.path = str(tmpdir.join('config.ini'))
+    project = environment.find_project.return_value
+    project.root = '/path/to/foo'
+    project.key_path = '/path/to/key.pem'
+    instance = project.get_instance.return_value
+    instance.ssh_options = []
+    instance.get_user_name.return_value = 'ubuntu'
+    instance.ip = '0.0.0.0'
+    instance.cached = True
+    return environment
+
+def test_query_no_daemon(socket_path):
+    assert daemon.query('/path/to/foo', 'web', path=socket_path) is None
+
+def test_query_stale_socket(socket_path):
+    open(socket_path, 'w').close()
+    assert daemon.query('/path/to/foo', 'web', path=socket_path) is None
+
+def test_query(server, resolver, socket_path):
+    resolver.resolve.return_value = {'key': '/path/to/key.pem', 'user': 'ubuntu', 'addr': '0.0.0.0', 'cached': True}
+    answer = daemon.query('/path/to/foo', 'web', path=socket_path)
+    resolver.resolve.assert_called_with('/path/to/foo', 'web', refresh=False)
+    assert answer == resolver.resolve.return_value
+
+def test_query_timeout(server, resolver, socket_path):
+    resolver.resolve.side_effect = lambda *args, **kwargs: time.sleep(1)
+    start = time.time()
+    assert daemon.query('/path/to/foo', 'web', path=socket_path, request_timeout=0.2) is None
+    assert time.time() - start < 0.9
+
+def test_query_error(server, resolver, socket_path):
+    resolver.resolve.side_effect = NoInstanceFoundError('web')
+    assert daemon.query('/path/to/foo', 'web', path=socket_path) is None
+
+def test_server_close_removes_socket(resolver, socket_path):
+    server = daemon.ResolverServer(resolver, socket_path)
+    assert os.path.exists(socket_path)
+    assert not os.stat(socket_path).st_mode & 0o077
+    server.server_close()
+    assert not os.path.exists(socket_path)
+
+def test_resolve(environment):
+    resolver = daemon.Resolver(environment)
+    answer = resolver.resolve('/path/to/foo/src', 'web')
+    assert answer == {'key': '/path/to/key.pem', 'user': 'ubuntu', 'addr': '0.0.0.0', 'cached': True, 'options': []}
+    environment.find_project.return_value.get_instance.assert_called_with('web', refresh=False)
+
+def test_resolve_reuses_projects(environment):
+    resolver = daemon.Resolver(environment)
+    resolver.resolve('/path/to/foo/src', 'web')
+    resolver.resolve('/path/to/foo/src', 'data')
+    assert environment.find_project.call_count == 1
+
+def test_resolve_qualified(environment):
+    environment.get_project.return_value = environment.find_project.return_value
+    resolver = daemon.Resolver(environment)
+    resolver.resolve('/elsewhere', 'foo:web')
+    resolver.resolve('/somewhere/else', 'foo:data')
+    environment.get_project.assert_called_once_with('foo')
+    assert not environment.find_project.called
+    environment.get_project.return_value.get_instance.assert_called_with('data', refresh=False)
+
+def test_resolve_refresh(environment):
+    resolver = daemon.Resolver(environment)
+    resolver.resolve('/path/to/foo', 'web', refresh=True)
+    project = environment.find_project.return_value
+    project.get_instance.assert_called_with('web', refresh=True)
+    project.get_fleet.assert_called_with() # As fetched by the lookup
+
+def test_resolve_stopped(environment):
+    instance = environment.find_project.return_value.get_instance.return_value
+    instance.is_running = False
+    with pytest.raises(InstanceNotRunningError):
+        daemon.Resolver(environment).resolve('/path/to/foo', 'web')
+
+def test_resolve_no_address(environment):
+    instance = environment.find_project.return_value.get_instance.return_value
+    instance.check_address.side_effect = NoAddressError('foo-web has no public address')
+    with pytest.raises(NoAddressError):
+        daemon.Resolver(environment).resolve('/path/to/foo', 'web')
+    assert not instance.get_user_name.called
+
+def test_refresh(environment):
+    resolver = daemon.Resolver(environment)
+    resolver.resolve('/path/to/foo', 'web')
+    resolver.refresh()
+    environment.find_project.return_value.get_fleet.assert_called_with(refresh=True)
+
+def test_resolve_from_index(environment):
+    project = environment.find_project.return_value
+    project.prefix = 'foo-'
+    project.get_instance_config.return_value = {'username': 'ubuntu'}
+    resource = json.loads(SAMPLE_INSTANCE_BODY)
+    project.get_fleet.return_value = {'web': [resource], 'data': [resource, resource]}
+    resolver = daemon.Resolver(environment)
+    resolver.resolve('/path/to/foo', 'web')
+    resolver.refresh()
+    project.get_instance.reset_mock()
+    answer = resolver.resolve('/path/to/foo', 'web')
+    assert not project.get_instance.called
+    assert answer['addr'] == resource['PublicIpAddress']
+    assert answer['user'] == 'ubuntu'
+    assert answer['cached']
+    resolver.resolve('/path/to/foo', 'data') # Ambiguous names aren't indexed
+    project.get_instance.assert_called_with('data', refresh=False)
+
+def test_resolve_reloads_changed_project(environment, tmpdir):
+    root = tmpdir.mkdir('foo')
+    root.join('.awssshconfig').write('[DEFAULT]\nname = foo\n')
+    environment.find_project.return_value.root = str(root)
+    resolver = daemon.Resolver(environment)
+    resolver.resolve(str(root), 'web')
+    resolver.resolve(str(root), 'web')
+    assert environment.find_project.call_count == 1
+    root.join('.awssshconfig').write('[DEFAULT]\nname = foo\nroute = private\n')
+    resolver.resolve(str(root), 'web')
+    assert environment.find_project.call_count == 2
+
+def test_resolve_reloads_changed_environment(environment, tmpdir):
+    resolver = daemon.Resolver(environment)
+    resolver.resolve('/path/to/foo', 'web')
+    tmpdir.join('config.ini').write('[DEFAULT]\nkey_dir = /path/to/keys\n')
+    with patch('aws_ssh.daemon.Environment') as env_mock:
+        env_mock.return_value = environment
+        resolver.resolve('/path/to/foo', 'web')
+    env_mock.assert_called_with(environment.path)
+    assert environment.find_project.call_count == 2
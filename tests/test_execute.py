@@ -0,0 +1,96 @@
+"""Test the execute module"""
+# pylint: disable=redefined-outer-name,no-self-use,unused-argument,protected-access,missing-docstring,invalid-name,line-too-long
+try:
+    from unittest.mock import MagicMock, patch
+except ImportError:
+    from mock import MagicMock, patch
+
+import pytest
+import six
+
+from aws_ssh import execute
+from aws_ssh.errors import NoAddressError, NoInstanceFoundError, UsernameNotFoundError
+
+@pytest.fixture
+def project():
+    project = MagicMock()
+    project.key_path = '/path/to/key.pem'
+    return project
+
+@pytest.fixture
+def instance():
+    instance = MagicMock()
+    instance.ip = '0.0.0.0'
+    instance.ssh_options = ['-o', 'ControlMaster=auto']
+    instance.get_user_name.return_value = 'ubuntu'
+    return instance
+
+@pytest.mark.parametrize('patterns,expected', [
+    ('web', ['web']),
+    ('web-*', ['web-1', 'web-2']),
+    ('web-1, data', ['data', 'web-1']),
+    ('*', ['data', 'web', 'web-1', 'web-2']),
+    ('nope', []),
+])
+def test_select_instance_names(patterns, expected):
+    assert execute.select_instance_names(['web', 'web-1', 'web-2', 'data'], patterns) == expected
+
+def test_get_command(project, instance):
+    runner = execute.Runner(project, ['uptime', '-p'], connect_timeout=5)
+    assert runner.get_command(instance) == ['ssh', '-n', '-i', '/path/to/key.pem', '-o', 'BatchMode=yes',
+                                            '-o', 'ConnectTimeout=5', '-o', 'ControlMaster=auto',
+                                            'ubuntu@0.0.0.0', '--', 'uptime', '-p']
+
+def test_run(project, instance):
+    out = six.StringIO()
+    runner = execute.Runner(project, ['true'], out=out)
+    commands = {'web': ['sh', '-c', 'echo hello; echo world'], 'data': ['sh', '-c', 'echo oops; exit 3']}
+    instances = {'web': MagicMock(ip='web'), 'data': MagicMock(ip='data')}
+    with patch.object(runner, 'get_command', side_effect=lambda inst: commands[inst.ip]):
+        results = runner.run(instances)
+    assert [result.name for result in results] == ['data', 'web']
+    assert [result.exit_code for result in results] == [3, 0]
+    lines = out.getvalue().splitlines()
+    assert sorted(lines) == ['data | oops', 'web | hello', 'web | world']
+    assert lines.index('web | hello') < lines.index('web | world')
+
+def test_run_unresolved(project):
+    runner = execute.Runner(project, ['true'], out=six.StringIO())
+    results = runner.run({'web': NoInstanceFoundError('web')})
+    assert results[0].exit_code is None
+    assert 'NoInstanceFoundError' in results[0].error
+
+def test_run_unknown_user(project, instance):
+    instance.get_user_name.side_effect = UsernameNotFoundError()
+    runner = execute.Runner(project, ['true'], out=six.StringIO())
+    results = runner.run({'web': instance})
+    assert 'UsernameNotFoundError' in results[0].error
+
+def test_run_no_address(project, instance):
+    instance.get_user_name.side_effect = NoAddressError('foo-web has no public address')
+    other = MagicMock(ip='0.0.0.1', ssh_options=[])
+    runner = execute.Runner(project, ['true'], out=six.StringIO())
+    with patch('subprocess.Popen') as popen_mock:
+        popen_mock.return_value.stdout.readline.return_value = b''
+        popen_mock.return_value.wait.return_value = 0
+        results = runner.run({'web': instance, 'data': other})
+    assert [result.name for result in results] == ['data', 'web']
+    assert results[0].exit_code == 0
+    assert 'NoAddressError' in results[1].error
+
+def test_run_stopped(project, instance):
+    instance.is_running = False
+    instance.state = 'stopped'
+    runner = execute.Runner(project, ['true'], out=six.StringIO())
+    with patch('subprocess.Popen') as popen_mock:
+        results = runner.run({'web': instance})
+        assert not popen_mock.called
+    assert 'InstanceNotRunningError' in results[0].error
+
+def test_write_summary():
+    out = six.StringIO()
+    execute.write_summary([execute.Result('web', 0, 1.5, None), execute.Result('data', None, 0, 'Timeout')], out=out)
+    lines = out.getvalue().splitlines()
+    assert lines[0].split() == ['HOST', 'EXIT', 'SECONDS']
+    assert lines[1].split() == ['web', '0', '1.50']
+    assert lines[2].split() == ['data', 'error', '0.00', 'Timeout']
@@ -0,0 +1,43 @@
+"""Test the images module"""
+# pylint: disable=redefined-outer-name,no-self-use,unused-argument,protected-access,missing-docstring,invalid-name,line-too-long
+import pytest
+
+from aws_ssh.images import infer_username
+
+@pytest.mark.parametrize('name,username', [
+    ('ubuntu/images/hvm-ssd/ubuntu-xenial-16.04-amd64-server-20170414', 'ubuntu'),
+    ('amzn-ami-hvm-2017.03.0.20170417-x86_64-gp2', 'ec2-user'),
+    ('amzn2-ami-hvm-2.0.20190313-x86_64-gp2', 'ec2-user'),
+    ('al2023-ami-2023.0.20230322.0-kernel-6.1-x86_64', 'ec2-user'),
+    ('CentOS Linux 7 x86_64 HVM EBS 1704_01', 'centos'),
+    ('debian-stretch-hvm-x86_64-gp2-2017-04-19', 'admin'),
+    ('RHEL-7.3_HVM_GA-20161026-x86_64-1-Hourly2-GP2', 'ec2-user'),
+    ('suse-sles-12-sp2-v20170420-hvm-ssd-x86_64', 'ec2-user'),
+    ('Fedora-Cloud-Base-25-1.3.x86_64-hvm-us-east-1-gp2-0', 'fedora'),
+    ('bitnami-wordpress-4.7.4-0-linux-ubuntu-14.04.3-x86_64-hvm-ebs', None), # Bitnami on Ubuntu is ambiguous
+    ('my-custom-image', None),
+])
+def test_infer_from_name(name, username):
+    assert infer_username('ami-123', image={'Name': name}) == username
+
+def test_infer_unknown_image():
+    assert infer_username('ami-123') is None
+
+def test_infer_windows():
+    assert infer_username('ami-123', 'Windows', image={'Name': 'ubuntu'}) is None
+
+def test_infer_from_platform():
+    assert infer_username('ami-123', 'Red Hat Enterprise Linux') == 'ec2-user'
+    assert infer_username('ami-123', 'Linux/UNIX') is None
+
+def test_user_mapping_by_id():
+    assert infer_username('ami-123', image={'Name': 'ubuntu'}, mappings=[('ami-123', 'deploy')]) == 'deploy'
+
+def test_user_mapping_by_name():
+    mappings = [('my-custom-*', 'deploy')]
+    assert infer_username('ami-123', image={'Name': 'my-custom-image'}, mappings=mappings) == 'deploy'
+    assert infer_username('ami-123', image={'Name': 'MY-CUSTOM-image'}, mappings=mappings) == 'deploy'
+
+def test_user_mapping_overrides_default():
+    mappings = [('*ubuntu*', 'deploy')]
+    assert infer_username('ami-123', image={'Name': 'ubuntu/images/foo'}, mappings=mappings) == 'deploy'
@@ -1,18 +1,19 @@
 # pylint: disable=redefined-outer-name,no-self-use,unused-argument,protected-access,missing-docstring,invalid-name,line-too-long
 import json
 import os.path
-from collections import namedtuple
+import threading
+import time
+from collections import namedtuple, OrderedDict
 try:
-    from unittest.mock import call, MagicMock, patch, mock_open, PropertyMock
+    from unittest.mock import ANY, call, MagicMock, patch, PropertyMock
 except ImportError:
-    from mock import call, MagicMock, patch, mock_open, PropertyMock
+    from mock import ANY, call, MagicMock, patch, PropertyMock
 
 import pytest
-from pexpect import pxssh
 from configparser import ConfigParser  # pylint: disable=import-error
 
 from aws_ssh import errors
-from aws_ssh.interfaces import DEFAULT_AWSSH_CONFIG, DEFAULT_PROJECT_CONFIG, Environment, Instance, Project
+from aws_ssh.interfaces import DEFAULT_AWSSH_CONFIG, DEFAULT_PROJECT_CONFIG, Environment, Instance, Project, split_address
 from fixtures import * # pylint: disable=import-error,wildcard-import
 from test_aws import SAMPLE_INSTANCE_BODY # pylint: disable=import-error
 
@@ -42,6 +43,70 @@ def existing_environment(parser_mock):
         })
         yield EnvironmentVars(env, old_config, env._config['DEFAULT'])
 
+@pytest.fixture
+def read_config_mock():
+    with patch('aws_ssh.interfaces.read_config') as read_config_patch:
+        yield read_config_patch
+
+@pytest.fixture
+def save_config_mock():
+    with patch('aws_ssh.interfaces.save_config') as save_config_patch:
+        yield save_config_patch
+
+@pytest.fixture(autouse=True)
+def control_options():
+    with patch.object(Environment, 'control_options', new_callable=PropertyMock) as control_options:
+        control_options.return_value = {}
+        yield control_options
+
+@pytest.fixture(autouse=True)
+def registry_mock():
+    with patch.object(Environment, 'registry', new_callable=PropertyMock) as registry_property:
+        registry_property.return_value = MagicMock()
+        registry_property.return_value.get.return_value = None
+        yield registry_property.return_value
+
+@pytest.fixture(autouse=True)
+def name_index_mock():
+    with patch.object(Environment, 'name_index', new_callable=PropertyMock) as name_index_property:
+        name_index_property.return_value = MagicMock()
+        yield name_index_property.return_value
+
+@pytest.fixture(autouse=True)
+def miss_cache_mock():
+    with patch.object(Environment, 'miss_cache', new_callable=PropertyMock) as miss_cache_property:
+        miss_cache_property.return_value = MagicMock()
+        miss_cache_property.return_value.get.return_value = None
+        yield miss_cache_property.return_value
+
+@pytest.fixture(autouse=True)
+def coalescer_mock():
+    with patch.object(Environment, 'coalescer', new_callable=PropertyMock) as coalescer_property:
+        coalescer_property.return_value = MagicMock()
+        coalescer_property.return_value.call.side_effect = lambda key, fetch, share=None: (fetch(), False)
+        yield coalescer_property.return_value
+
+@pytest.fixture
+def popen_mock():
+    """Run username probes against a fake instance, answering via `popen_mock.check(username)`, which returns
+    the probe's exit status and error output"""
+    with patch('aws_ssh.probe.subprocess.Popen') as popen_patch, \
+            patch.dict('aws_ssh.probe._versions', {'ssh': (8, 9)}):
+        popen_patch.check = lambda username: (0, '')
+        popen_patch.processes = {}
+        def popen(args, stdin=None, stdout=None, stderr=None):
+            username = args[args.index('-l') + 1]
+            process = popen_patch.processes[username] = MagicMock(returncode=None)
+            def wait():
+                process.returncode, message = popen_patch.check(username)
+                stderr.write(message.encode('utf-8'))
+                return process.returncode
+            process.wait.side_effect = wait
+            process.poll.side_effect = lambda: process.returncode
+            return process
+        popen_patch.side_effect = popen
+        yield popen_patch
+
 @pytest.fixture
 def project_mock():
     with patch('aws_ssh.interfaces.Project') as project_mock:
@@ -61,17 +126,20 @@ def existing_project(parser_mock, existing_environment):
     project = Project('/path/to/foo', existing_environment.env, config=config)
     yield project
 
-@pytest.fixture
-def open_mock():
-    with patch('aws_ssh.interfaces.open', mock_open(), create=True) as opens:
-        yield opens
-
 @pytest.fixture
 def aws_resource():
     return json.loads(SAMPLE_INSTANCE_BODY)
 
 @pytest.fixture
-def new_instance(existing_project):
+def image_info_mock(existing_project):
+    existing_project._environment._image_cache = MagicMock()
+    existing_project._environment._image_cache.get.return_value = None
+    with patch('aws_ssh.aws.get_image_info') as image_info_mock:
+        image_info_mock.return_value = None
+        yield image_info_mock
+
+@pytest.fixture
+def new_instance(existing_project, image_info_mock):
     return Instance('fooinst', json.loads(SAMPLE_INSTANCE_BODY), existing_project)
 
 @pytest.fixture
@@ -91,8 +159,8 @@ class TestEnvironment(object):
     def test_no_config(self, new_environment):
         assert not new_environment.config.read.called
 
-    def test_config(self, existing_environment):
-        assert len(existing_environment.config.read.call_args_list) == 1
+    def test_config(self, read_config_mock, existing_environment):
+        read_config_mock.assert_called_once_with(existing_environment.config, os.path.expanduser(DEFAULT_AWSSH_CONFIG))
 
     def test_keydir_empty(self, new_environment):
         keydir = new_environment.env.key_dir
@@ -100,6 +168,17 @@ class TestEnvironment(object):
         new_environment.config_values.get.assert_called_with('key_dir')
         assert keydir is None
 
+    def test_ssh_options(self, existing_project, control_options):
+        control_options.return_value = OrderedDict([('ControlMaster', 'auto'), ('ControlPersist', '10m')])
+        assert existing_project.ssh_options == ['-o', 'ControlMaster=auto', '-o', 'ControlPersist=10m']
+
+    def test_image_usernames_empty(self, existing_environment):
+        assert existing_environment.env.image_usernames == []
+
+    def test_image_usernames(self, existing_environment):
+        existing_environment.env._config['usernames'] = {'ami-123': 'admin', 'custom-*': 'deploy'}
+        assert sorted(existing_environment.env.image_usernames) == [('ami-123', 'admin'), ('custom-*', 'deploy')]
+
     def test_keydir_defined(self, existing_environment):
         keydir = existing_environment.env.key_dir
         assert keydir == '/path/to/key'
@@ -114,12 +193,41 @@ class TestEnvironment(object):
         existing_environment.env.set_key_root('/new/path/to/key')
         assert existing_environment.env.key_dir == '/new/path/to/key'
 
+    def test_cache_ttl_default(self, existing_environment):
+        assert existing_environment.env.cache_ttl == 3600
+
+    def test_cache_ttl_configured(self, existing_environment):
+        existing_environment.env._config['DEFAULT']['cache_ttl'] = '60'
+        assert existing_environment.env.instance_cache.ttl == 60
+
     def test_add_project(self, existing_environment):
         project_mock = namedtuple('MockProject', 'name root')('foo', '/path/too/foo')
         existing_environment.env.add_project(project_mock)
         assert 'project_{}'.format(project_mock.name) in existing_environment.env._config
         assert existing_environment.env._config['project_{}'.format(project_mock.name)]['root'] == '/path/too/foo'
 
+    def test_add_project_registers(self, existing_environment, registry_mock):
+        project = MagicMock()
+        existing_environment.env.add_project(project)
+        registry_mock.update.assert_called_with(project)
+
+    def test_get_project_registry(self, existing_environment, registry_mock, project_mock):
+        registry_mock.get.return_value = {'root': '/path/to/foo'}
+        project = existing_environment.env.get_project('foo')
+        registry_mock.get.assert_called_with('foo')
+        project_mock.load_file.assert_called_with('/path/to/foo/' + DEFAULT_PROJECT_CONFIG, existing_environment.env)
+        assert not project_mock.load.called
+        registry_mock.update.assert_called_with(project)
+
+    def test_get_project_unregistered(self, existing_environment, project_mock):
+        existing_environment.env._config['project_foo'] = {'root': '/path/to/foo'}
+        existing_environment.env.get_project('foo')
+        project_mock.load_file.assert_called_with('/path/to/foo/' + DEFAULT_PROJECT_CONFIG, existing_environment.env)
+
+    def test_get_project_unknown(self, existing_environment, project_mock):
+        with pytest.raises(errors.UnknownProjectError):
+            existing_environment.env.get_project('foo')
+
     def test_create_project(self, existing_environment, project_mock):
         existing_environment.env.add_project = MagicMock()
         existing_environment.env.save = MagicMock()
@@ -129,16 +237,23 @@ class TestEnvironment(object):
         existing_environment.env.add_project.assert_called_with(project)
         existing_environment.env.save.assert_called_with()
 
-    def test_save_existing(self, existing_environment, open_mock):
+    def test_save_existing(self, existing_environment, save_config_mock):
+        existing_environment.env.set_key_root('/path/to/keys')
         existing_environment.env.save()
-        open_mock.assert_called_with(os.path.expanduser(DEFAULT_AWSSH_CONFIG), 'w')
-        assert len(open_mock().write.mock_calls) > 0
+        save_config_mock.assert_called_once_with(existing_environment.env._config,
+                                                 os.path.expanduser(DEFAULT_AWSSH_CONFIG), {('DEFAULT', 'key_dir')})
+        assert not existing_environment.env._changes
 
-    def test_save_new(self, new_environment, mkdirs_mock, open_mock):
+    def test_save_new(self, new_environment, save_config_mock):
         new_environment.env.save()
-        mkdirs_mock.assert_called_with(os.path.dirname(os.path.expanduser(DEFAULT_AWSSH_CONFIG)))
-        open_mock.assert_called_with(os.path.expanduser(DEFAULT_AWSSH_CONFIG), 'w')
-        new_environment.config.write.assert_called_with(open_mock())
+        save_config_mock.assert_called_once_with(new_environment.config, os.path.expanduser(DEFAULT_AWSSH_CONFIG), set())
+
+    def test_add_project_tracks_changes(self, existing_environment):
+        project = MagicMock()
+        type(project).name = PropertyMock(return_value='foo')
+        project.root = '/path/to/foo'
+        existing_environment.env.add_project(project)
+        assert existing_environment.env._changes == {('project_foo', None)}
 
     def test_find_project_exists_registered(self, project_mock, existing_environment):
         project = MagicMock()
@@ -154,6 +269,12 @@ class TestEnvironment(object):
         assert len(existing_environment.env.save.mock_calls) == 0
         assert project == found_project
 
+    def test_find_project_exists_registered_updates_registry(self, project_mock, existing_environment, registry_mock):
+        project_mock.load.return_value.name = 'foo'
+        existing_environment.env._config['project_foo'] = {'root': '/path/to/foo'}
+        project = existing_environment.env.find_project('/path/to/foo')
+        registry_mock.update.assert_called_with(project)
+
     def test_find_project_exists_unregistered(self, project_mock, existing_environment):
         project = MagicMock()
         type(project).name = PropertyMock(return_value='foo')
@@ -167,6 +288,61 @@ class TestEnvironment(object):
         existing_environment.env.save.assert_called_with()
         assert project == found_project
 
+    def test_get_project_roots(self, existing_environment):
+        existing_environment.env._config['project_foo'] = {'root': '/path/to/foo'}
+        existing_environment.env._config['project_bar'] = {}
+        existing_environment.env._config['usernames'] = {'ami-123': 'ubuntu'}
+        assert existing_environment.env.get_project_roots() == {'foo': '/path/to/foo'}
+
+    def test_get_projects(self, project_mock, existing_environment, isfile_mock):
+        existing_environment.env._config['project_foo'] = {'root': '/path/to/foo'}
+        existing_environment.env._config['project_bar'] = {'root': '/path/to/bar'}
+        isfile_mock.side_effect = lambda path: path == '/path/to/foo/' + DEFAULT_PROJECT_CONFIG
+        projects = existing_environment.env.get_projects()
+        assert projects == [project_mock.load.return_value]
+        project_mock.load.assert_called_with('/path/to/foo', existing_environment.env)
+
+    @pytest.mark.parametrize('path,root', [
+        ('/path/to/foo', '/path/to/foo'),
+        ('/path/to/foo/src/lib', '/path/to/foo'),
+        ('/path/to/foo/nested/src', '/path/to/foo/nested'),
+        ('/path/to/foobar', None),
+        ('/elsewhere', None),
+    ])
+    def test_match_project_root(self, existing_environment, path, root):
+        existing_environment.env._config['project_foo'] = {'root': '/path/to/foo'}
+        existing_environment.env._config['project_nested'] = {'root': '/path/to/foo/nested'}
+        assert existing_environment.env.match_project_root(path) == root
+
+    def test_find_project_registered_root(self, project_mock, existing_environment):
+        project_mock.load.return_value.name = 'foo'
+        existing_environment.env._config['project_foo'] = {'root': '/path/to/foo'}
+        existing_environment.env.find_project('/path/to/foo/src/lib')
+        project_mock.load.assert_called_with('/path/to/foo/src/lib', existing_environment.env, root='/path/to/foo')
+
+    def test_find_project_registered_root_without_config(self, project_mock, existing_environment):
+        project = MagicMock()
+        type(project).name = PropertyMock(return_value='bar')
+        project_mock.load.side_effect = [errors.ProjectConfigNotFoundError(), project]
+        existing_environment.env._config['project_foo'] = {'root': '/path/to/foo'}
+        existing_environment.env._config['project_bar'] = {'root': '/path'}
+        assert existing_environment.env.find_project('/path/to/foo/src') == project
+        project_mock.load.assert_called_with('/path/to/foo/src', existing_environment.env)
+
+    def test_find_project_nested(self, existing_environment, isfile_mock):
+        existing_environment.env._config['project_foo'] = {'root': '/path/to/foo'}
+        existing_environment.env.add_project = MagicMock()
+        existing_environment.env.save = MagicMock()
+        isfile_mock.side_effect = lambda path: path in ('/path/to/foo/' + DEFAULT_PROJECT_CONFIG,
+                                                        '/path/to/foo/nested/' + DEFAULT_PROJECT_CONFIG)
+        with patch('aws_ssh.interfaces.Project.load_file') as load_file_mock, \
+                patch.dict('aws_ssh.interfaces._UNCONFIGURED_DIRS', clear=True):
+            type(load_file_mock.return_value).name = PropertyMock(return_value='nested')
+            existing_environment.env.find_project('/path/to/foo/nested/src')
+            load_file_mock.assert_called_with('/path/to/foo/nested/' + DEFAULT_PROJECT_CONFIG, existing_environment.env)
+            existing_environment.env.find_project('/path/to/foo/src')
+            load_file_mock.assert_called_with('/path/to/foo/' + DEFAULT_PROJECT_CONFIG, existing_environment.env)
+
     def test_find_project_nonexistant(self, project_mock, existing_environment):
         project_mock.load.side_effect = errors.ProjectConfigNotFoundError()
         with pytest.raises(errors.ProjectConfigNotFoundError):
@@ -176,42 +352,88 @@ class TestEnvironment(object):
 
 
 class TestProjectConfig(object):
-    def test_find_config_empty_dirs(self, listdir_mock):
-        listdir_mock.return_value = []
+    @pytest.fixture(autouse=True)
+    def unconfigured_dirs(self):
+        with patch.dict('aws_ssh.interfaces._UNCONFIGURED_DIRS', clear=True) as unconfigured_dirs:
+            yield unconfigured_dirs
+
+    def test_find_config_empty_dirs(self, isfile_mock, listdir_mock):
+        isfile_mock.return_value = False
         with pytest.raises(errors.ProjectConfigNotFoundError):
             Project.find_config('/path/to/foo')
-        listdir_mock.assert_has_calls([call('/path/to/foo'),
-                                       call('/path/to'),
-                                       call('/path'),
-                                       call('/')])
+        isfile_mock.assert_has_calls([call('/path/to/foo/' + DEFAULT_PROJECT_CONFIG),
+                                      call('/path/to/' + DEFAULT_PROJECT_CONFIG),
+                                      call('/path/' + DEFAULT_PROJECT_CONFIG),
+                                      call('/' + DEFAULT_PROJECT_CONFIG)])
+        assert not listdir_mock.called
 
-    def test_find_config_current_dir(self, listdir_mock, isfile_mock):
-        listdir_mock.return_value = [DEFAULT_PROJECT_CONFIG]
+    def test_find_config_current_dir(self, isfile_mock):
         isfile_mock.return_value = True
         config_path = Project.find_config('/path/to/foo')
         assert config_path == '/path/to/foo/' + DEFAULT_PROJECT_CONFIG
 
-    def test_find_config_current_dir_notfile(self, listdir_mock, isfile_mock):
-        listdir_mock.return_value = [DEFAULT_PROJECT_CONFIG]
+    def test_find_config_current_dir_notfile(self, isfile_mock):
         isfile_mock.return_value = False
         with pytest.raises(errors.ProjectConfigNotFoundError):
             Project.find_config('/path/to/foo')
 
-    def test_find_config_parent_dir(self, listdir_mock, isfile_mock):
-        listdir_mock.side_effect = lambda x: [DEFAULT_PROJECT_CONFIG] if x == '/path/to' else []
-        isfile_mock.return_value = True
+    def test_find_config_parent_dir(self, isfile_mock):
+        isfile_mock.side_effect = lambda x: x == '/path/to/' + DEFAULT_PROJECT_CONFIG
         config_path = Project.find_config('/path/to/foo')
         assert config_path == '/path/to/' + DEFAULT_PROJECT_CONFIG
 
-    def test_load(self, new_environment):
+    def test_find_config_registered_root(self, isfile_mock):
+        isfile_mock.return_value = False
+        assert Project.find_config('/path/to/foo/src', root='/path/to/foo') == '/path/to/foo/' + DEFAULT_PROJECT_CONFIG
+        isfile_mock.assert_called_once_with('/path/to/foo/src/' + DEFAULT_PROJECT_CONFIG)
+
+    def test_find_config_nearer_than_registered_root(self, isfile_mock):
+        isfile_mock.side_effect = lambda x: x == '/path/to/foo/nested/' + DEFAULT_PROJECT_CONFIG
+        config_path = Project.find_config('/path/to/foo/nested/src', root='/path/to/foo')
+        assert config_path == '/path/to/foo/nested/' + DEFAULT_PROJECT_CONFIG
+
+    def test_find_config_memoizes_misses(self, isfile_mock):
+        isfile_mock.return_value = False
+        with pytest.raises(errors.ProjectConfigNotFoundError):
+            Project.find_config('/path/to/foo')
+        isfile_mock.reset_mock()
+        with pytest.raises(errors.ProjectConfigNotFoundError):
+            Project.find_config('/path/to/foo/bar')
+        isfile_mock.assert_called_once_with('/path/to/foo/bar/' + DEFAULT_PROJECT_CONFIG)
+
+    def test_find_config_misses_expire(self, isfile_mock, unconfigured_dirs):
+        isfile_mock.return_value = False
+        with patch('aws_ssh.interfaces.time.time') as time_mock:
+            time_mock.return_value = 1000
+            with pytest.raises(errors.ProjectConfigNotFoundError):
+                Project.find_config('/path/to/foo')
+            time_mock.return_value = 1061
+            isfile_mock.side_effect = lambda x: x == '/path/to/' + DEFAULT_PROJECT_CONFIG
+            assert Project.find_config('/path/to/foo') == '/path/to/' + DEFAULT_PROJECT_CONFIG
+
+    def test_load(self, new_environment, read_config_mock):
         Project.find_config = MagicMock(return_value='/path/to/foo/' + DEFAULT_PROJECT_CONFIG)
         project = Project.load('/path/to/foo', new_environment.env)
-        Project.find_config.assert_called_with('/path/to/foo')
-        new_environment.config.read.assert_called_with('/path/to/foo/' + DEFAULT_PROJECT_CONFIG)
+        Project.find_config.assert_called_with('/path/to/foo', root=None)
+        read_config_mock.assert_called_with(new_environment.config, '/path/to/foo/' + DEFAULT_PROJECT_CONFIG)
         assert project._config == new_environment.config
         assert project.root == '/path/to/foo'
         assert project._environment == new_environment.env
 
+    def test_load_file_missing(self, tmpdir):
+        with pytest.raises(errors.ProjectConfigNotFoundError):
+            Project.load_file(str(tmpdir.join(DEFAULT_PROJECT_CONFIG)), MagicMock())
+
+    @pytest.mark.parametrize('value,expected', [
+        (None, [('testing', None)]),
+        ('testing:us-east-1', [('testing', 'us-east-1')]),
+        ('other, :eu-west-1\n other:us-west-2', [('other', None), ('testing', 'eu-west-1'), ('other', 'us-west-2')]),
+    ])
+    def test_targets(self, existing_project, value, expected):
+        if value is not None:
+            existing_project._config['DEFAULT']['targets'] = value
+        assert existing_project.targets == expected
+
     @pytest.mark.parametrize('field_name', ['name', 'key', 'prefix', 'profile'])
     def test_config_params(self, existing_project, field_name):
         setattr(existing_project, field_name, field_name)
@@ -240,11 +462,279 @@ class TestProjectConfig(object):
         assert 'answer' in existing_project._config['instance_foo']
         assert existing_project._config['instance_foo']['answer'] == '42'
 
-    def test_save(self, existing_project, open_mock):
-        existing_project._config.write = MagicMock()
+    def test_get_fleet(self, existing_project, aws_resource, name_index_mock):
+        cache = existing_project._environment._instance_cache = MagicMock()
+        with patch('aws_ssh.aws.get_fleet') as fleet_mock:
+            fleet_mock.return_value = {'web': [aws_resource], 'data': [aws_resource, aws_resource]}
+            fleet = existing_project.get_fleet()
+            assert existing_project.get_fleet() is fleet
+            assert fleet_mock.call_count == 1
+            fleet_mock.assert_called_with('testing', 'foo-', region_name=None)
+            existing_project.get_fleet(refresh=True)
+            assert fleet_mock.call_count == 2
+        cache.update.assert_called_with('testing', None, 'foo-', {'web': aws_resource}, replace=True)
+        name_index_mock.update.assert_called_with('foo', fleet_mock.return_value, replace=True)
+
+    def test_get_instance_uncached(self, existing_project, aws_resource):
+        cache = existing_project._environment._instance_cache = MagicMock()
+        cache.get.return_value = None
+        with patch('aws_ssh.aws.get_fleet') as fleet_mock:
+            fleet_mock.return_value = {'web': [aws_resource], 'data': [aws_resource]}
+            instance = existing_project.get_instance('web')
+            existing_project.get_instance('data')
+            assert fleet_mock.call_count == 1
+        assert instance.name == 'foo-web'
+        assert not instance.cached
+
+    def test_get_instance_launched_since_fleet(self, existing_project, aws_resource, miss_cache_mock):
+        existing_project._environment._instance_cache = MagicMock()
+        existing_project._environment._instance_cache.get.return_value = None
+        existing_project._fleet = {'web': [aws_resource]} # Fetched before 'data' was launched
+        with patch('aws_ssh.aws.get_fleet') as fleet_mock:
+            fleet_mock.return_value = {'web': [aws_resource], 'data': [aws_resource]}
+            assert existing_project.get_instance('data').name == 'foo-data'
+            assert fleet_mock.call_count == 1
+            fleet_mock.return_value = {'web': [aws_resource]}
+            existing_project._fleet = {'web': [aws_resource]}
+            results = existing_project.lookup_instances(['compute', 'data'])
+            assert fleet_mock.call_count == 2 # Fetched again, rather than trusting the stale fleet
+        assert isinstance(results['compute'], errors.NoInstanceFoundError)
+        miss_cache_mock.set.assert_any_call('testing', None, 'foo-', 'compute', 'NoInstanceFoundError')
+
+    def test_get_instance_missing(self, existing_project):
+        cache = existing_project._environment._instance_cache = MagicMock()
+        cache.get.return_value = None
+        with patch('aws_ssh.aws.get_fleet') as fleet_mock:
+            fleet_mock.return_value = {}
+            with pytest.raises(errors.NoInstanceFoundError):
+                existing_project.get_instance('web')
+
+    def test_get_instance_missing_cached(self, existing_project, miss_cache_mock):
+        existing_project._environment._instance_cache = MagicMock()
+        existing_project._environment._instance_cache.get.return_value = None
+        miss_cache_mock.get.return_value = 'NoInstanceFoundError'
+        with patch('aws_ssh.aws.get_fleet') as fleet_mock:
+            with pytest.raises(errors.NoInstanceFoundError):
+                existing_project.get_instance('web')
+            assert not fleet_mock.called
+        miss_cache_mock.get.assert_called_with('testing', None, 'foo-', 'web')
+        assert not miss_cache_mock.set.called
+
+    def test_get_instance_missing_recorded(self, existing_project, aws_resource, miss_cache_mock):
+        existing_project._environment._instance_cache = MagicMock()
+        existing_project._environment._instance_cache.get.return_value = None
+        with patch('aws_ssh.aws.get_fleet') as fleet_mock:
+            fleet_mock.return_value = {'web': [aws_resource, aws_resource]}
+            with pytest.raises(errors.NoInstanceFoundError):
+                existing_project.get_instance('compte')
+            miss_cache_mock.set.assert_called_with('testing', None, 'foo-', 'compte', 'NoInstanceFoundError')
+            with pytest.raises(errors.TooManyInstancesError):
+                existing_project.get_instance('web')
+            miss_cache_mock.set.assert_called_with('testing', None, 'foo-', 'web', 'TooManyInstancesError')
+        miss_cache_mock.invalidate.assert_called_once_with('testing', None, 'foo-')
+
+    def test_get_instance_missing_refresh(self, existing_project, aws_resource, miss_cache_mock):
+        existing_project._environment._instance_cache = MagicMock()
+        miss_cache_mock.get.return_value = 'NoInstanceFoundError'
+        with patch('aws_ssh.aws.get_fleet') as fleet_mock:
+            fleet_mock.return_value = {'web': [aws_resource]}
+            instance = existing_project.get_instance('web', refresh=True)
+        assert not miss_cache_mock.get.called
+        miss_cache_mock.invalidate.assert_any_call('testing', None, 'foo-', 'web')
+        assert instance.name == 'foo-web'
+
+    def test_suggest_instance_names(self, existing_project, name_index_mock):
+        name_index_mock.search.return_value = ['foo:compute', 'foo:compose', 'foo:web']
+        assert existing_project.suggest_instance_names('compte') == ['compute', 'compose']
+        name_index_mock.search.assert_called_with('foo:')
+
+    def test_suggest_instance_names_cached_fleet(self, existing_project, name_index_mock, aws_resource):
+        name_index_mock.search.return_value = []
+        existing_project._environment._instance_cache = MagicMock()
+        existing_project._environment._instance_cache.get_all.return_value = ({'compute': aws_resource}, True)
+        assert existing_project.suggest_instance_names('compte') == ['compute']
+
+    def test_get_instance_duplicated(self, existing_project, aws_resource):
+        cache = existing_project._environment._instance_cache = MagicMock()
+        cache.get.return_value = None
+        with patch('aws_ssh.aws.get_fleet') as fleet_mock:
+            fleet_mock.return_value = {'web': [aws_resource, aws_resource]}
+            with pytest.raises(errors.TooManyInstancesError):
+                existing_project.get_instance('web')
+
+    def test_get_instance_targets(self, existing_project, aws_resource, name_index_mock):
+        existing_project._config['DEFAULT']['targets'] = 'testing:us-east-1, other:eu-west-1'
+        cache = existing_project._environment._instance_cache = MagicMock()
+        cache.get.return_value = None
+        with patch('aws_ssh.aws.find_instance') as find_mock, patch('aws_ssh.aws.get_fleet') as fleet_mock:
+            find_mock.return_value = dict(aws_resource, AwsSshTarget=['other', 'eu-west-1'])
+            instance = existing_project.get_instance('web')
+            assert not fleet_mock.called
+        find_mock.assert_called_with([('testing', 'us-east-1'), ('other', 'eu-west-1')], 'foo-', 'web',
+                                     latencies=existing_project.target_latencies)
+        cache.set.assert_called_with('testing', None, 'foo-', 'web', find_mock.return_value)
+        name_index_mock.update.assert_called_with('foo', ['web'])
+        assert instance.target == ('other', 'eu-west-1')
+
+    def test_get_fleet_shared(self, existing_project, aws_resource, coalescer_mock, name_index_mock):
+        cache = existing_project._environment._instance_cache = MagicMock()
+        coalescer_mock.call.side_effect = None
+        coalescer_mock.call.return_value = ({'web': [aws_resource]}, True)
+        with patch('aws_ssh.aws.get_fleet') as fleet_mock:
+            assert existing_project.get_fleet() == {'web': [aws_resource]}
+            assert not fleet_mock.called
+        coalescer_mock.call.assert_called_with('fleet:foo- testing:', ANY, share=ANY)
+        assert not cache.update.called
+        assert not name_index_mock.update.called
+
+    def test_get_fleet_share(self, existing_project, aws_resource, coalescer_mock):
+        existing_project._environment._instance_cache = MagicMock()
+        with patch('aws_ssh.aws.get_fleet') as fleet_mock:
+            fleet_mock.return_value = {'web': [aws_resource]}
+            existing_project.get_fleet()
+        share = coalescer_mock.call.call_args[1]['share']
+        shared = share({'web': [aws_resource]})
+        assert shared['web'][0]['PublicIpAddress'] == aws_resource['PublicIpAddress']
+        assert 'Tags' not in shared['web'][0]
+
+    def test_get_instance_targets_shared(self, existing_project, aws_resource, coalescer_mock):
+        existing_project._config['DEFAULT']['targets'] = 'testing:us-east-1, other:eu-west-1'
+        cache = existing_project._environment._instance_cache = MagicMock()
+        cache.get.return_value = None
+        coalescer_mock.call.side_effect = None
+        coalescer_mock.call.return_value = (aws_resource, True)
+        with patch('aws_ssh.aws.find_instance') as find_mock:
+            instance = existing_project.get_instance('web')
+            assert not find_mock.called
+        coalescer_mock.call.assert_called_with('instance:foo- testing:us-east-1 other:eu-west-1:web', ANY, share=ANY)
+        assert not cache.set.called
+        assert instance.name == 'foo-web'
+
+    def test_get_fleet_targets(self, existing_project, aws_resource):
+        existing_project._config['DEFAULT']['targets'] = ':us-east-1 other:eu-west-1'
+        existing_project._environment._instance_cache = MagicMock()
+        with patch('aws_ssh.aws.get_fleet') as fleet_mock:
+            fleet_mock.return_value = {'web': [aws_resource]}
+            assert len(existing_project.get_fleet()['web']) == 2
+        assert sorted(existing_project.target_latencies) == [('other', 'eu-west-1'), ('testing', 'us-east-1')]
+
+    def test_get_instances(self, existing_project, aws_resource):
+        existing_project._fleet = {'web': [aws_resource], 'data': [aws_resource, aws_resource]}
+        instances = existing_project.get_instances(['web', 'data', 'compute'])
+        assert instances['web'].name == 'foo-web'
+        assert isinstance(instances['data'], errors.TooManyInstancesError)
+        assert isinstance(instances['compute'], errors.NoInstanceFoundError)
+
+    def test_lookup_instances(self, existing_project, aws_resource, miss_cache_mock):
+        cache = existing_project._environment._instance_cache = MagicMock()
+        cache.get.side_effect = lambda profile, region, prefix, name: aws_resource if name == 'web' else None
+        miss_cache_mock.get.side_effect = lambda profile, region, prefix, name: (
+            'NoInstanceFoundError' if name == 'gone' else None)
+        with patch('aws_ssh.aws.get_fleet') as fleet_mock:
+            fleet_mock.return_value = {'data': [aws_resource], 'compute': [aws_resource, aws_resource]}
+            results = existing_project.lookup_instances(['web', 'gone', 'data', 'compute', 'missing'])
+        assert fleet_mock.call_count == 1
+        assert list(results) == ['web', 'gone', 'data', 'compute', 'missing']
+        assert results['web'].cached
+        assert isinstance(results['gone'], errors.NoInstanceFoundError)
+        assert results['data'].name == 'foo-data'
+        assert isinstance(results['compute'], errors.TooManyInstancesError)
+        assert isinstance(results['missing'], errors.NoInstanceFoundError)
+        miss_cache_mock.set.assert_any_call('testing', None, 'foo-', 'compute', 'TooManyInstancesError')
+        miss_cache_mock.set.assert_any_call('testing', None, 'foo-', 'missing', 'NoInstanceFoundError')
+
+    def test_lookup_instances_single(self, existing_project, aws_resource, miss_cache_mock):
+        existing_project._environment._instance_cache = MagicMock()
+        existing_project._environment._instance_cache.get.return_value = None
+        with patch.object(existing_project, '_find_instance') as find_mock:
+            find_mock.side_effect = errors.NoInstanceFoundError('web')
+            results = existing_project.lookup_instances(['web'])
+        assert isinstance(results['web'], errors.NoInstanceFoundError)
+        miss_cache_mock.set.assert_called_with('testing', None, 'foo-', 'web', 'NoInstanceFoundError')
+
+    def test_get_instance_cached(self, existing_project, aws_resource):
+        cache = existing_project._environment._instance_cache = MagicMock()
+        cache.get.return_value = aws_resource
+        with patch('aws_ssh.aws.get_fleet') as fleet_mock:
+            instance = existing_project.get_instance('web')
+            assert not fleet_mock.called
+        cache.get.assert_called_with('testing', None, 'foo-', 'web')
+        assert instance.ip == aws_resource['PublicIpAddress']
+        assert instance.cached
+
+    def test_get_instance_refresh(self, existing_project, aws_resource):
+        cache = existing_project._environment._instance_cache = MagicMock()
+        with patch('aws_ssh.aws.get_fleet') as fleet_mock:
+            fleet_mock.return_value = {'web': [aws_resource]}
+            instance = existing_project.get_instance('web', refresh=True)
+            assert fleet_mock.called
+        assert not cache.get.called
+        cache.invalidate.assert_called_with('testing', None, 'foo-', 'web')
+        assert not instance.cached
+
+    def test_get_instance_refresh_fetched_fleet(self, existing_project, aws_resource):
+        existing_project._environment._instance_cache = MagicMock()
+        existing_project._fleet = {'web': [aws_resource]} # Fetched before 'web' was replaced
+        with patch('aws_ssh.aws.get_fleet') as fleet_mock:
+            fleet_mock.return_value = {'web': [dict(aws_resource, InstanceId='i-replaced')]}
+            instance = existing_project.get_instance('web', refresh=True)
+        assert fleet_mock.call_count == 1
+        assert instance._aws_resource['InstanceId'] == 'i-replaced'
+
+    def test_get_instance_refresh_forgets_inferred_username(self, existing_project, aws_resource, save_config_mock):
+        existing_project._environment._instance_cache = MagicMock()
+        existing_project._config['instance_foo-web'] = {'username': 'ubuntu', 'username_inferred': 'yes', 'route': 'private'}
+        existing_project._config['instance_foo-data'] = {'username': 'ec2-user'}
+        with patch('aws_ssh.aws.get_fleet') as fleet_mock:
+            fleet_mock.return_value = {'web': [aws_resource], 'data': [aws_resource]}
+            existing_project.get_instance('web', refresh=True)
+            existing_project.get_instance('data', refresh=True)
+        assert existing_project.get_instance_config('foo-web').get('route') == 'private'
+        assert not existing_project._config.has_option('instance_foo-web', 'username')
+        assert save_config_mock.call_args[0][2] == {('instance_foo-web', 'username'),
+                                                    ('instance_foo-web', 'username_inferred')}
+        assert save_config_mock.call_count == 1 # The probed username is kept
+        assert existing_project._config['instance_foo-data']['username'] == 'ec2-user'
+
+    def test_get_instance_refresh_then_user_name(self, existing_project, aws_resource, save_config_mock,
+                                                 image_info_mock, popen_mock):
+        existing_project._environment._instance_cache = MagicMock()
+        existing_project._config['instance_foo-web'] = {'username': 'ubuntu', 'username_inferred': 'yes'}
+        with patch('aws_ssh.aws.get_fleet') as fleet_mock:
+            fleet_mock.return_value = {'web': [aws_resource]}
+            instance = existing_project.get_instance('web', refresh=True)
+        assert not existing_project._config.has_section('instance_foo-web') # Not left behind, empty
+        assert ('instance_foo-web', None) in save_config_mock.call_args[0][2]
+        assert instance.username is None
+        popen_mock.check = lambda username: ((0, '') if username == 'ec2-user' else
+                                             (255, '{}@52.90.39.59: Permission denied (publickey).\n'.format(username)))
+        assert instance.get_user_name() == 'ec2-user'
+
+    def test_save(self, existing_project, save_config_mock):
+        existing_project.prefix = 'bar-'
         existing_project.save()
-        open_mock.assert_called_with('/path/to/foo/' + DEFAULT_PROJECT_CONFIG, 'w')
-        existing_project._config.write.assert_called_with(open_mock())
+        save_config_mock.assert_called_once_with(existing_project._config, '/path/to/foo/' + DEFAULT_PROJECT_CONFIG,
+                                                 {('DEFAULT', 'prefix')})
+        assert not existing_project._changes
+
+    def test_set_instance_config_tracks_changes(self, existing_project, save_config_mock):
+        existing_project.set_instance_config('web', username='ubuntu')
+        assert save_config_mock.call_args[0][2] == {('instance_web', 'username')}
+
+    def test_set_instance_config_keeps_options(self, existing_project, save_config_mock):
+        existing_project._config['instance_web'] = {'route': 'bastion', 'bastion': 'jump.example.com'}
+        existing_project.set_instance_config('web', username='ubuntu')
+        section = existing_project._config['instance_web']
+        assert (section['username'], section['route'], section['bastion']) == ('ubuntu', 'bastion', 'jump.example.com')
+        assert save_config_mock.call_args[0][2] == {('instance_web', 'username')}
+
+@pytest.mark.parametrize('address,expected', [
+    ('web', (None, 'web')),
+    ('foo:web', ('foo', 'web')),
+    ('foo:web:1', ('foo', 'web:1')),
+])
+def test_split_address(address, expected):
+    assert split_address(address) == expected
 
 class TestInstance(object):
 
@@ -252,52 +742,298 @@ class TestInstance(object):
         instance = Instance('fooinst', aws_resource, existing_project)
         assert instance.public_ip == aws_resource['PublicIpAddress']
 
+    @pytest.mark.parametrize('route,expected', [
+        (None, '52.90.39.59'),
+        ('public', '52.90.39.59'),
+        ('private', '10.0.0.1'),
+        ('ipv6', '2600::1'),
+        ('bastion', '10.0.0.1'),
+    ])
+    def test_ip_route(self, aws_resource, existing_project, route, expected):
+        if route:
+            existing_project._config['instance_fooinst'] = {'route': route}
+        aws_resource.update(PrivateIpAddress='10.0.0.1', Ipv6Address='2600::1')
+        assert Instance('fooinst', aws_resource, existing_project).ip == expected
+
+    def test_ip_route_unknown(self, aws_resource, existing_project):
+        existing_project._config['DEFAULT']['route'] = 'carrier-pigeon'
+        assert Instance('fooinst', aws_resource, existing_project).ip == aws_resource['PublicIpAddress']
+
+    def test_bastion_options(self, aws_resource, existing_project, control_options):
+        control_options.return_value = OrderedDict([('ControlMaster', 'auto')])
+        existing_project._config['DEFAULT'].update(route='bastion', bastion='jump@bastion.example.com')
+        instance = Instance('fooinst', aws_resource, existing_project)
+        assert instance.ssh_options == ['-o', 'ControlMaster=auto', '-o', 'ProxyJump=jump@bastion.example.com']
+
+    def test_public_options(self, aws_resource, existing_project):
+        existing_project._config['DEFAULT']['bastion'] = 'bastion.example.com'
+        assert Instance('fooinst', aws_resource, existing_project).ssh_options == []
+
+    @pytest.mark.parametrize('cached,cached_route,expected', [
+        (True, 'private', 'private'),
+        (True, None, 'public'),
+        (False, 'private', 'public'),
+    ])
+    def test_route_auto(self, aws_resource, existing_project, cached, cached_route, expected):
+        existing_project._config['DEFAULT']['route'] = 'auto'
+        route_cache = existing_project._environment._route_cache = MagicMock()
+        route_cache.get.return_value = cached_route
+        instance = Instance('fooinst', aws_resource, existing_project, cached=cached)
+        with patch('aws_ssh.interfaces.get_network_id', return_value='eth0/192.168.1.1'), \
+                patch('aws_ssh.interfaces.choose_route', return_value='public') as choose_mock:
+            assert instance.route == expected
+            assert instance.route == expected
+        assert choose_mock.call_count == (0 if cached and cached_route else 1)
+        if choose_mock.called:
+            route_cache.set.assert_called_once_with('eth0/192.168.1.1', aws_resource['InstanceId'], 'public')
+
+    def test_route_auto_unreachable(self, aws_resource, existing_project):
+        existing_project._config['DEFAULT']['route'] = 'auto'
+        route_cache = existing_project._environment._route_cache = MagicMock()
+        instance = Instance('fooinst', aws_resource, existing_project)
+        with patch('aws_ssh.interfaces.choose_route', return_value=None):
+            assert instance.route == 'public'
+        assert not route_cache.set.called
+
     def test_init_invalid_resource(self, existing_project):
         with pytest.raises(KeyError):
             Instance('fooinst', {}, existing_project)
 
-    def test_get_user_name_uncached(self, aws_resource, new_instance):
+    def test_init_stopped(self, aws_resource, existing_project):
+        del aws_resource['PublicIpAddress']
+        aws_resource['State'] = {'Name': 'stopped'}
+        instance = Instance('fooinst', aws_resource, existing_project)
+        assert instance.ip is None
+        assert instance.state == 'stopped'
+        assert not instance.is_running
+
+    @pytest.mark.parametrize('state,running', [(None, True), ('running', True), ('pending', False)])
+    def test_is_running(self, aws_resource, existing_project, state, running):
+        aws_resource.pop('State', None)
+        if state:
+            aws_resource['State'] = {'Name': state}
+        assert Instance('fooinst', aws_resource, existing_project).is_running == running
+
+    @pytest.mark.parametrize('state,started', [('stopped', True), ('stopping', True), ('pending', False)])
+    def test_start(self, aws_resource, existing_project, state, started):
+        cache = existing_project._environment._instance_cache = MagicMock()
+        stopped = dict(aws_resource, State={'Name': state})
+        del stopped['PublicIpAddress']
+        instance = Instance('foo-web', stopped, existing_project)
+        running = dict(aws_resource, State={'Name': 'running'}, PublicIpAddress='0.0.0.1')
+        with patch('aws_ssh.aws.start_instance') as start_mock, patch('aws_ssh.aws.wait_for_state') as wait_mock, \
+                patch('aws_ssh.interfaces.wait_for_port') as port_mock:
+            wait_mock.return_value = running
+            port_mock.return_value = True
+            instance.start()
+        assert start_mock.called == started
+        wait_mock.assert_called_with('testing', instance.instance_id, ('running',), region_name=None, timeout=ANY)
+        port_mock.assert_called_with('0.0.0.1', 22, timeout=ANY)
+        cache.set.assert_called_with('testing', None, 'foo-', 'web', running)
+        assert instance.ip == '0.0.0.1'
+        assert instance.is_running
+
+    def test_start_unreachable(self, aws_resource, existing_project):
+        existing_project._environment._instance_cache = MagicMock()
+        instance = Instance('foo-web', dict(aws_resource, State={'Name': 'stopped'}), existing_project)
+        with patch('aws_ssh.aws.start_instance'), patch('aws_ssh.aws.wait_for_state') as wait_mock, \
+                patch('aws_ssh.interfaces.wait_for_port') as port_mock:
+            wait_mock.return_value = dict(aws_resource, State={'Name': 'running'})
+            port_mock.return_value = False
+            with pytest.raises(errors.InstanceNotRunningError):
+                instance.start()
+
+    def test_check_address(self, aws_resource, existing_project):
+        Instance('fooinst', aws_resource, existing_project).check_address()
+        del aws_resource['PublicIpAddress']
+        instance = Instance('fooinst', aws_resource, existing_project)
+        with pytest.raises(errors.NoAddressError) as exc_info:
+            instance.check_address()
+        assert 'fooinst has no public address. Set `route = private`, `bastion`, or `auto`' in str(exc_info.value)
+
+    def test_get_user_name_no_address(self, new_instance, popen_mock):
+        new_instance.public_ip = None
+        with pytest.raises(errors.NoAddressError):
+            new_instance.get_user_name()
+        assert not popen_mock.called
+
+    def test_get_user_name_uncached(self, aws_resource, new_instance, popen_mock):
         new_instance._project._usernames = ['ubuntu']
-        with patch('pexpect.pxssh.pxssh') as pxssh_mock:
-            session_mock = pxssh_mock.return_value
-            new_instance._project.set_instance_config = MagicMock()
-            username = new_instance.get_user_name()
-            session_mock.login.assert_called_with(aws_resource['PublicIpAddress'], 'ubuntu', ssh_key=new_instance._project.key_path, login_timeout=10, quiet=True, auto_prompt_reset=False)
-            session_mock.logout.assert_called_with()
-            assert username == 'ubuntu'
-            new_instance._project.set_instance_config.assert_called_with('fooinst', username='ubuntu')
+        new_instance._project.set_instance_config = MagicMock()
+        username = new_instance.get_user_name()
+        args = popen_mock.call_args[0][0]
+        assert args[:3] == ['ssh', '-i', new_instance._project.key_path]
+        assert args[-2:] == [aws_resource['PublicIpAddress'], 'true']
+        assert 'BatchMode=yes' in args
+        assert username == 'ubuntu'
+        new_instance._project.set_instance_config.assert_called_with('fooinst', username='ubuntu')
 
-    def test_get_user_name_cached(self, existing_instance):
+    def test_get_user_name_cached(self, existing_instance, popen_mock):
         username = existing_instance.get_user_name()
-        with patch('pexpect.pxssh.pxssh') as pxssh_mock:
-            assert len(pxssh_mock.mock_calls) == 0
-            assert username == 'ec2-user'
+        assert not popen_mock.called
+        assert username == 'ec2-user'
 
-    def test_get_user_name_multiple_first(self, aws_resource, new_instance):
+    def test_get_user_name_multiple_first(self, aws_resource, new_instance, popen_mock):
         new_instance._project._usernames = ['ubuntu', 'ec2-user']
-        with patch('pexpect.pxssh.pxssh') as pxssh_mock:
-            session_mock = pxssh_mock.return_value
-            new_instance._project.set_instance_config = MagicMock()
+        released = threading.Event()
+        started = threading.Event()
+        def username_checks(username):
+            if username == 'ec2-user':
+                started.set()
+                released.wait(5) # Slower than ubuntu
+            else:
+                started.wait(5)
+            return 0, ''
+        popen_mock.check = username_checks
+        new_instance._project.set_instance_config = MagicMock()
+        try:
             username = new_instance.get_user_name()
-            assert username == 'ubuntu'
-            assert session_mock.login.call_count == 1
-            session_mock.login.assert_called_with(aws_resource['PublicIpAddress'], 'ubuntu', ssh_key=new_instance._project.key_path, login_timeout=10, quiet=True, auto_prompt_reset=False)
-            session_mock.logout.assert_called_with()
-            new_instance._project.set_instance_config.assert_called_with('fooinst', username='ubuntu')
+        finally:
+            released.set()
+        assert username == 'ubuntu'
+        assert popen_mock.processes['ec2-user'].kill.called
+        assert not popen_mock.processes['ubuntu'].kill.called
+        new_instance._project.set_instance_config.assert_called_with('fooinst', username='ubuntu')
 
-    def test_get_user_name_multiple_second(self, aws_resource, new_instance):
+    def test_get_user_name_multiple_second(self, aws_resource, new_instance, popen_mock):
         new_instance._project._usernames = ['ubuntu', 'ec2-user']
-        def usernaame_checks(ip, username, **kwargs):
+        rejected = threading.Event()
+        def username_checks(username):
             if username == 'ubuntu':
-                raise pxssh.ExceptionPxssh('ubuntu')
-            return None
-        with patch('pexpect.pxssh.pxssh') as pxssh_mock:
-            session_mock = pxssh_mock.return_value
-            new_instance._project.set_instance_config = MagicMock()
-            session_mock.login.side_effect = usernaame_checks
-            username = new_instance.get_user_name()
-            assert username == 'ec2-user'
-            assert session_mock.login.call_count == 2
-            session_mock.login.assert_called_with(aws_resource['PublicIpAddress'], 'ec2-user', ssh_key=new_instance._project.key_path, login_timeout=10, quiet=True, auto_prompt_reset=False)
-            session_mock.logout.assert_called_with()
-            new_instance._project.set_instance_config.assert_called_with('fooinst', username='ec2-user')
+                rejected.set()
+                return 255, 'ubuntu@52.90.39.59: Permission denied (publickey).\n'
+            rejected.wait(5) # Don't win before the other probe has even started
+            return 0, ''
+        popen_mock.check = username_checks
+        new_instance._project.set_instance_config = MagicMock()
+        username = new_instance.get_user_name()
+        assert username == 'ec2-user'
+        assert popen_mock.call_count == 2
+        new_instance._project.set_instance_config.assert_called_with('fooinst', username='ec2-user')
+
+    def test_get_user_name_rejected_session(self, new_instance, popen_mock):
+        new_instance._project._usernames = ['root', 'ubuntu']
+        def username_checks(username):
+            if username == 'root': # Authenticates, but only to say which username to use
+                return 142, 'Please login as the user "ubuntu" rather than the user "root".\n'
+            return 0, ''
+        popen_mock.check = username_checks
+        new_instance._project.set_instance_config = MagicMock()
+        assert new_instance.get_user_name() == 'ubuntu'
+
+    def test_get_user_name_unreachable(self, new_instance, popen_mock):
+        new_instance._project._usernames = ['ubuntu', 'ec2-user', 'centos']
+        released = threading.Event()
+        def username_checks(username):
+            if username == 'ubuntu':
+                while len(popen_mock.processes) < 3: # Once every probe is in flight
+                    time.sleep(0.01)
+                return 255, 'ssh: connect to host 52.90.39.59 port 22: Connection refused\n'
+            released.wait(5) # Would burn the timeout
+            return 255, 'Permission denied'
+        popen_mock.check = username_checks
+        new_instance._project.set_instance_config = MagicMock()
+        try:
+            with pytest.raises(errors.HostUnreachableError) as exc_info:
+                new_instance.get_user_name()
+        finally:
+            released.set()
+        assert 'Connection refused' in str(exc_info.value)
+        assert popen_mock.processes['ec2-user'].kill.called
+        assert not new_instance._project.set_instance_config.called
+
+    def test_get_user_name_host_key(self, new_instance, popen_mock):
+        new_instance._project._usernames = ['ubuntu']
+        popen_mock.check = lambda username: (255, '@@@ WARNING: REMOTE HOST IDENTIFICATION HAS CHANGED! @@@\n'
+                                                  'Host key verification failed.\n')
+        with pytest.raises(errors.HostKeyError):
+            new_instance.get_user_name()
+
+    def test_get_user_name_bad_option(self, new_instance, popen_mock):
+        new_instance._project._usernames = ['ubuntu', 'ec2-user']
+        popen_mock.check = lambda username: (255, 'command-line line 0: Bad configuration option: controlpersist\n')
+        new_instance._project.set_instance_config = MagicMock()
+        with pytest.raises(errors.ProbeConfigError):
+            new_instance.get_user_name()
+        assert not new_instance._project.set_instance_config.called
+
+    def test_get_user_name_concurrent(self, new_instance, popen_mock):
+        new_instance._project._usernames = ['ubuntu', 'ec2-user', 'centos', 'root']
+        barrier = threading.Semaphore(0)
+        def username_checks(username):
+            barrier.release()
+            if username != 'root':
+                return 255, 'Permission denied'
+            for _ in range(4): # Only succeeds once every probe is in flight
+                barrier.acquire()
+            return 0, ''
+        popen_mock.check = username_checks
+        new_instance._project.set_instance_config = MagicMock()
+        assert new_instance.get_user_name() == 'root'
+
+    def test_get_image_cached(self, new_instance, image_info_mock):
+        image_cache = new_instance._project._environment.image_cache
+        image_cache.get.return_value = {'Name': 'ubuntu/images/foo'}
+        assert new_instance.get_image() == {'Name': 'ubuntu/images/foo'}
+        image_cache.get.assert_called_with('ami-d05e75b8')
+        assert not image_info_mock.called
+
+    def test_get_image_uncached(self, new_instance, image_info_mock):
+        image_info_mock.return_value = {'Name': 'ubuntu/images/foo'}
+        assert new_instance.get_image() == {'Name': 'ubuntu/images/foo'}
+        image_info_mock.assert_called_with('testing', 'ami-d05e75b8', region_name=None)
+        new_instance._project._environment.image_cache.set.assert_called_with('ami-d05e75b8', {'Name': 'ubuntu/images/foo'})
+
+    def test_get_image_target(self, existing_project, aws_resource, image_info_mock):
+        instance = Instance('fooinst', dict(aws_resource, AwsSshTarget=['other', 'eu-west-1']), existing_project)
+        existing_project._environment._image_cache = MagicMock()
+        existing_project._environment._image_cache.get.return_value = None
+        instance.get_image()
+        image_info_mock.assert_called_with('other', 'ami-d05e75b8', region_name='eu-west-1')
+
+    def test_get_user_name_inferred(self, new_instance, image_info_mock, popen_mock):
+        image_info_mock.return_value = {'Name': 'ubuntu/images/hvm-ssd/ubuntu-xenial-16.04-amd64-server-20170414'}
+        new_instance._project.set_instance_config = MagicMock()
+        assert new_instance.get_user_name() == 'ubuntu'
+        assert list(popen_mock.processes) == ['ubuntu'] # Verified on its own
+        new_instance._project.set_instance_config.assert_called_with('fooinst', username='ubuntu',
+                                                                     username_inferred='yes')
+
+    def test_get_user_name_inferred_rejected(self, new_instance, image_info_mock, popen_mock):
+        image_info_mock.return_value = {'Name': 'ubuntu/images/hvm-ssd/ubuntu-xenial-16.04-amd64-server-20170414'}
+        new_instance._project._usernames = ['ubuntu', 'ec2-user']
+        popen_mock.check = lambda username: (0, '') if username == 'ec2-user' else (255, 'Permission denied (publickey).')
+        new_instance._project.set_instance_config = MagicMock()
+        assert new_instance.get_user_name() == 'ec2-user'
+        new_instance._project.set_instance_config.assert_called_once_with('fooinst', username='ec2-user')
+
+    def test_get_user_name_inferred_unreachable(self, new_instance, image_info_mock, popen_mock):
+        image_info_mock.return_value = {'Name': 'ubuntu/images/hvm-ssd/ubuntu-xenial-16.04-amd64-server-20170414'}
+        popen_mock.check = lambda username: (255, 'ssh: connect to host 0.0.0.0 port 22: Connection refused')
+        new_instance._project.set_instance_config = MagicMock()
+        with pytest.raises(errors.HostUnreachableError):
+            new_instance.get_user_name()
+        assert list(popen_mock.processes) == ['ubuntu']
+        assert not new_instance._project.set_instance_config.called
+
+    def test_get_user_name_user_mapping(self, new_instance, image_info_mock, popen_mock):
+        new_instance._project._environment._config['usernames'] = {'ami-d05e75b8': 'deploy'}
+        new_instance._project.set_instance_config = MagicMock()
+        assert new_instance.get_user_name() == 'deploy'
+        assert not image_info_mock.called
+
+    def test_get_user_name_multiplexed(self, new_instance, control_options, popen_mock):
+        control_options.return_value = {'ControlMaster': 'auto'}
+        new_instance._project._usernames = ['ubuntu']
+        new_instance._project.set_instance_config = MagicMock()
+        new_instance.get_user_name()
+        assert 'ControlMaster=auto' in popen_mock.call_args[0][0]
+
+    def test_get_user_name_none(self, new_instance, popen_mock):
+        new_instance._project._usernames = ['ubuntu', 'ec2-user']
+        popen_mock.check = lambda username: (255, 'Permission denied (publickey).')
+        new_instance._project.set_instance_config = MagicMock()
+        with pytest.raises(errors.UsernameNotFoundError) as exc_info:
+            new_instance.get_user_name()
+        assert not isinstance(exc_info.value, errors.HostUnreachableError)
+        assert not new_instance._project.set_instance_config.called
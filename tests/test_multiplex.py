@@ -0,0 +1,35 @@
+"""Test the multiplex module"""
+# pylint: disable=redefined-outer-name,no-self-use,unused-argument,protected-access,missing-docstring,invalid-name,line-too-long
+import os
+import stat
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+from aws_ssh import multiplex
+
+def test_get_control_options(tmpdir):
+    directory = os.path.join(str(tmpdir), 'cm')
+    options = multiplex.get_control_options('5m', directory)
+    assert list(options.items()) == [('ControlMaster', 'auto'), ('ControlPath', os.path.join(directory, '%C')),
+                                     ('ControlPersist', '5m')]
+    assert stat.S_IMODE(os.stat(directory).st_mode) == 0o700
+
+def test_get_control_options_concurrent(tmpdir):
+    directory = os.path.join(str(tmpdir), 'cm')
+    os.mkdir(directory) # By another process, after this one found it missing
+    with patch('os.path.isdir') as isdir_mock:
+        isdir_mock.side_effect = [False, True]
+        assert multiplex.get_control_options('5m', directory)
+    assert stat.S_IMODE(os.stat(directory).st_mode) == 0o700
+
+def test_get_control_options_disabled(tmpdir):
+    directory = os.path.join(str(tmpdir), 'cm')
+    assert not multiplex.get_control_options('no', directory)
+    assert not os.path.exists(directory)
+
+def test_format_options():
+    options = multiplex.get_control_options('5m', '/tmp')
+    assert multiplex.format_options(options) == ['-o', 'ControlMaster=auto', '-o', 'ControlPath=/tmp/%C',
+                                                 '-o', 'ControlPersist=5m']
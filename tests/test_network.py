@@ -0,0 +1,38 @@
+"""Test the network module"""
+# pylint: disable=redefined-outer-name,no-self-use,unused-argument,protected-access,missing-docstring,invalid-name,line-too-long
+import socket
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+import pytest
+
+from aws_ssh import network
+
+@pytest.fixture
+def listener():
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+    yield server
+    server.close()
+
+def test_wait_for_port_ready(listener):
+    assert network.wait_for_port('127.0.0.1', listener.getsockname()[1], timeout=1)
+
+def test_wait_for_port_eventually_ready():
+    attempts = [socket.error('Connection refused'), socket.error('Connection refused'), None]
+    def create_connection(address, timeout):
+        error = attempts.pop(0)
+        if error:
+            raise error
+        return socket.socket()
+    with patch('socket.create_connection', side_effect=create_connection), patch('time.sleep') as sleep_mock:
+        assert network.wait_for_port('0.0.0.0', timeout=60)
+    assert [args[0][0] for args in sleep_mock.call_args_list] == [0.25, 0.5]
+
+def test_wait_for_port_timeout(listener):
+    port = listener.getsockname()[1]
+    listener.close()
+    assert not network.wait_for_port('127.0.0.1', port, timeout=0)
@@ -0,0 +1,112 @@
+"""Test the picker module"""
+# pylint: disable=redefined-outer-name,no-self-use,unused-argument,protected-access,missing-docstring,invalid-name,line-too-long
+import os
+import pty
+import threading
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+import pytest
+
+from aws_ssh import picker
+
+NAMES = ['web-1', 'web-2', 'worker', 'database', 'db-replica']
+
+@pytest.mark.parametrize('query,text,matches', [
+    ('', 'web-1', True),
+    ('web', 'web-1', True),
+    ('WB1', 'web-1', True),
+    ('db', 'database', True),
+    ('xyz', 'web-1', False),
+    ('1w', 'web-1', False),
+])
+def test_fuzzy_score(query, text, matches):
+    assert (picker.fuzzy_score(query, text) is not None) == matches
+
+def test_fuzzy_score_ranking():
+    assert picker.fuzzy_score('db', 'db-replica') > picker.fuzzy_score('db', 'database')
+    assert picker.fuzzy_score('web', 'web-1') > picker.fuzzy_score('web', 'worker-eb')
+
+def test_fuzzy_filter():
+    fuzzy_filter = picker.FuzzyFilter(NAMES)
+    assert fuzzy_filter.filter('') == (5, ['web-1', 'web-2', 'worker', 'database', 'db-replica'])
+    assert fuzzy_filter.filter('w') == (3, ['web-1', 'web-2', 'worker'])
+    assert fuzzy_filter.filter('w2', limit=1) == (1, ['web-2'])
+
+def test_fuzzy_filter_narrows():
+    fuzzy_filter = picker.FuzzyFilter(NAMES)
+    fuzzy_filter.filter('w')
+    with patch('aws_ssh.picker.fuzzy_score', wraps=picker.fuzzy_score) as score_mock:
+        fuzzy_filter.filter('we')
+        assert score_mock.call_count == 3
+        fuzzy_filter.filter('d')
+        assert score_mock.call_count == 8
+
+def test_fuzzy_filter_large():
+    fuzzy_filter = picker.FuzzyFilter(['node-{:05d}'.format(index) for index in range(20000)])
+    count, best = fuzzy_filter.filter('n01234', limit=15)
+    assert count > 0
+    assert best[0] == 'node-01234'
+
+def test_format_table():
+    assert picker.format_table([('web', 'running'), ('database', 'stopped')]) == ['web       running',
+                                                                                'database  stopped']
+    assert picker.format_table([]) == []
+
+def test_split_keys():
+    assert picker.split_keys('ab\x1b[A\x1b\r') == ['a', 'b', '\x1b[A', '\x1b', '\r']
+
+def test_handle_key():
+    instance_picker = picker.Picker(NAMES)
+    for key in 'db':
+        assert instance_picker.handle_key(key) is None
+    assert instance_picker.selection == 'db-replica'
+    instance_picker.handle_key('\x1b[B')
+    assert instance_picker.selection == 'database'
+    instance_picker.handle_key('\x1b[B')
+    assert instance_picker.selection == 'database'
+    instance_picker.handle_key('\x1b[A')
+    instance_picker.handle_key('\x7f')
+    assert instance_picker.query == 'd'
+    assert instance_picker.selection == 'database'
+    instance_picker.handle_key('\x15')
+    assert instance_picker.query == ''
+    assert instance_picker.handle_key('\r') is True
+    assert instance_picker.handle_key('\x1b') is False
+
+def test_handle_key_no_matches():
+    instance_picker = picker.Picker(NAMES)
+    instance_picker.handle_key('z')
+    assert instance_picker.selection is None
+    assert instance_picker.handle_key('\r') is False
+
+def test_update_keeps_selection():
+    instance_picker = picker.Picker(NAMES)
+    instance_picker.handle_key('\x1b[B')
+    assert instance_picker.selection == 'web-2'
+    instance_picker.update(['web-0'] + NAMES, status='refreshed')
+    assert instance_picker._apply_update()
+    assert instance_picker.selection == 'web-2'
+    assert not instance_picker._apply_update()
+
+def test_render():
+    instance_picker = picker.Picker(NAMES, height=3)
+    instance_picker.status = 'refreshing'
+    lines = instance_picker.render(80)
+    assert lines[0] == '>   5/5 (refreshing)'
+    assert lines[1] == '\x1b[7m> web-1\x1b[0m'
+    assert lines[2:] == ['  web-2', '  worker']
+
+def test_run():
+    master, slave = pty.openpty()
+    instance_picker = picker.Picker(NAMES)
+    result = []
+    thread = threading.Thread(target=lambda: result.append(instance_picker.run(os.ttyname(slave))))
+    thread.start()
+    os.write(master, b'dat\r')
+    thread.join(5)
+    os.close(master)
+    os.close(slave)
+    assert result == ['database']
@@ -0,0 +1,107 @@
+# pylint: disable=redefined-outer-name,no-self-use,unused-argument,protected-access,missing-docstring
+import subprocess
+import sys
+import threading
+import time
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+import pytest
+
+from aws_ssh import errors
+from aws_ssh.probe import (AUTH_FAILED, CONFIG_FAILED, HOST_KEY_FAILED, NETWORK_FAILED, ProbeProcesses,
+                           check_failure, classify, describe, get_host_key_options, get_ssh_version)
+
+def python(code):
+    return [sys.executable, '-c', 'import sys, time; ' + code]
+
+@pytest.mark.parametrize('returncode, stderr, failure', [
+    (0, '', None),
+    (255, 'ubuntu@10.0.0.1: Permission denied (publickey).', AUTH_FAILED),
+    (1, '', AUTH_FAILED),
+    (142, 'Please login as the user "ubuntu" rather than the user "root".', AUTH_FAILED),
+    (255, 'ssh: connect to host 10.0.0.1 port 22: Connection timed out', NETWORK_FAILED),
+    (255, 'ssh: connect to host 10.0.0.1 port 22: Connection refused', NETWORK_FAILED),
+    (255, 'ssh: Could not resolve hostname bastion: Name or service not known', NETWORK_FAILED),
+    (255, '@@@ WARNING: REMOTE HOST IDENTIFICATION HAS CHANGED! @@@\nHost key verification failed.',
+     HOST_KEY_FAILED),
+    (255, 'kex_exchange_identification: Connection closed by remote host', AUTH_FAILED),
+    (255, 'command-line line 0: Bad configuration option: stricthostkeychecking', CONFIG_FAILED),
+    (255, 'command-line line 0: unsupported option "accept-new".', CONFIG_FAILED),
+])
+def test_classify(returncode, stderr, failure):
+    assert classify(returncode, stderr) == failure
+
+def test_describe():
+    assert describe('Warning: Permanently added\n\nPermission denied (publickey).\n') == \
+        'Permission denied (publickey).'
+    assert describe('') == ''
+
+def test_check_failure():
+    check_failure('foo-web', AUTH_FAILED, 'Permission denied')
+    with pytest.raises(errors.HostUnreachableError):
+        check_failure('foo-web', NETWORK_FAILED, 'Connection refused')
+    with pytest.raises(errors.HostKeyError):
+        check_failure('foo-web', HOST_KEY_FAILED, 'Host key verification failed.')
+    with pytest.raises(errors.ProbeConfigError) as exc_info:
+        check_failure('foo-web', CONFIG_FAILED, 'Bad configuration option: foo')
+    assert '[instance_foo-web]' in str(exc_info.value)
+
+@pytest.mark.parametrize('output, version', [
+    ('OpenSSH_9.2p1 Debian-2+deb12u7, OpenSSL 3.0.17 1 Jul 2025', (9, 2)),
+    ('OpenSSH_7.4p1, OpenSSL 1.0.2k-fips  26 Jan 2017', (7, 4)),
+    ('Dropbear v2022.83', None),
+])
+def test_get_ssh_version(output, version):
+    with patch.dict('aws_ssh.probe._versions', clear=True):
+        command = python('sys.stderr.write({!r}); sys.exit(0 if sys.argv[1] == "-V" else 1)'.format(output))
+        popen = subprocess.Popen
+        with patch('aws_ssh.probe.subprocess.Popen') as popen_mock:
+            popen_mock.side_effect = lambda args, **kwargs: popen(command + args[1:], **kwargs)
+            assert get_ssh_version() == version
+            assert get_ssh_version() == version
+        assert popen_mock.call_count == 1 # Once per process
+
+def test_get_ssh_version_missing():
+    with patch.dict('aws_ssh.probe._versions', clear=True):
+        assert get_ssh_version('/nonexistent/ssh') is None
+
+def test_get_host_key_options():
+    with patch('aws_ssh.probe.get_ssh_version', return_value=(7, 6)):
+        options = get_host_key_options()
+    assert options[:2] == ['-o', 'StrictHostKeyChecking=accept-new']
+    assert options[3].startswith('UserKnownHostsFile=/dev/null ') # New keys aren't written to the user's
+    assert '~/.ssh/known_hosts' in options[3] # Changed keys are still refused
+    assert 'ControlMaster=no' not in options
+
+@pytest.mark.parametrize('version', [(7, 4), None])
+def test_get_host_key_options_fallback(version):
+    with patch('aws_ssh.probe.get_ssh_version', return_value=version):
+        options = get_host_key_options()
+    assert options[:2] == ['-o', 'StrictHostKeyChecking=no']
+    assert options[3].startswith('UserKnownHostsFile=/dev/null ')
+    assert options[-2:] == ['-o', 'ControlMaster=no'] # The real session mustn't reuse an unchecked connection
+
+def test_run():
+    processes = ProbeProcesses()
+    assert processes.run(python('sys.exit(0)')) == (None, '')
+    assert processes.run(python('sys.stderr.write("Connection refused\\n"); sys.exit(255)')) == \
+        (AUTH_FAILED, 'Connection refused')
+    assert processes.run(python('sys.stderr.write("ssh: connect to host x port 22: No route to host"); '
+                                'sys.exit(255)'))[0] == NETWORK_FAILED
+
+def test_close():
+    processes = ProbeProcesses()
+    results = []
+    thread = threading.Thread(target=lambda: results.append(processes.run(python('time.sleep(30)'))))
+    thread.start()
+    while not processes._processes:
+        time.sleep(0.01)
+    processes.close()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert results[0][0] == AUTH_FAILED
+    with pytest.raises(OSError):
+        processes.run(python('sys.exit(0)'))
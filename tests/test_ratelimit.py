@@ -0,0 +1,156 @@
+# pylint: disable=redefined-outer-name,no-self-use,unused-argument,protected-access,missing-docstring
+import os.path
+import threading
+from functools import partial
+try:
+    from unittest.mock import MagicMock, patch
+except ImportError:
+    from mock import MagicMock, patch
+
+import pytest
+
+from aws_ssh import ratelimit
+from aws_ssh.ratelimit import Coalescer, TokenBucket
+
+@pytest.fixture
+def bucket(tmpdir):
+    return TokenBucket(os.path.join(str(tmpdir), 'ratelimit.json'), rate=2, burst=3)
+
+@pytest.fixture
+def coalescer(tmpdir):
+    return Coalescer(os.path.join(str(tmpdir), 'inflight'))
+
+def test_reserve_burst(bucket):
+    with patch('aws_ssh.ratelimit.time.time') as time_mock:
+        time_mock.return_value = 1000
+        assert [bucket.reserve() for _ in range(3)] == [0, 0, 0]
+        assert bucket.reserve() == 0.5
+        assert bucket.reserve() == 1.0
+
+def test_reserve_refill(bucket):
+    with patch('aws_ssh.ratelimit.time.time') as time_mock:
+        time_mock.return_value = 1000
+        for _ in range(4):
+            bucket.reserve()
+        time_mock.return_value = 1001 # Two tokens refilled, one of which repays the debt
+        assert bucket.reserve() == 0
+        assert bucket.reserve() == 0.5
+        time_mock.return_value = 1100
+        assert [bucket.reserve() for _ in range(3)] == [0, 0, 0]
+
+def test_reserve_shared(bucket):
+    other = TokenBucket(bucket.path, rate=2, burst=3)
+    with patch('aws_ssh.ratelimit.time.time') as time_mock:
+        time_mock.return_value = 1000
+        bucket.reserve()
+        other.reserve()
+        bucket.reserve()
+        assert other.reserve() == 0.5
+
+def test_reserve_unwritable(tmpdir):
+    bucket = TokenBucket(os.path.join(str(tmpdir), 'missing', 'file', 'ratelimit.json'))
+    with patch('aws_ssh.cache.make_dirs') as make_dirs_mock:
+        make_dirs_mock.side_effect = OSError('Read-only file system')
+        assert bucket.reserve() == 0
+
+def test_acquire(bucket):
+    with patch('aws_ssh.ratelimit.time.sleep') as sleep_mock, patch.object(bucket, 'reserve') as reserve_mock:
+        reserve_mock.return_value = 0
+        bucket.acquire()
+        assert not sleep_mock.called
+        reserve_mock.return_value = 0.5
+        bucket.acquire()
+        sleep_mock.assert_called_with(0.5)
+
+def test_coalescer_fetches(coalescer):
+    fetch = MagicMock(return_value={'web': 1})
+    assert coalescer.call('fleet:foo', fetch) == ({'web': 1}, False)
+    assert coalescer.call('fleet:foo', fetch) == ({'web': 1}, False) # The earlier result is not in flight
+    assert fetch.call_count == 2
+
+def test_coalescer_shares(coalescer):
+    started = threading.Event()
+    release = threading.Event()
+    results = {}
+
+    def leader_fetch():
+        started.set()
+        release.wait()
+        return {'web': ['full']}
+
+    def lead():
+        results['leader'] = coalescer.call('fleet:foo', leader_fetch, share=lambda fleet: {'web': ['trimmed']})
+
+    def follow():
+        results['follower'] = coalescer.call('fleet:foo', follower_fetch)
+
+    follower_fetch = MagicMock()
+    leader = threading.Thread(target=lead)
+    leader.start()
+    started.wait()
+    follower = threading.Thread(target=follow)
+    follower.start()
+    follower.join(0.1)
+    release.set()
+    leader.join()
+    follower.join()
+    assert results['leader'] == ({'web': ['full']}, False)
+    assert results['follower'] == ({'web': ['trimmed']}, True)
+    assert not follower_fetch.called
+
+def test_coalescer_unjoined(coalescer):
+    assert coalescer.call('fleet:foo', lambda: 1) == (1, False)
+    assert not os.path.exists(coalescer._get_path('fleet:foo')) # Nobody joined, so nothing was written
+
+def test_coalescer_keys(coalescer):
+    def fetch():
+        coalescer._join('fleet:foo', coalescer._get_path('fleet:foo') + '.joined')
+        return 1
+    coalescer.call('fleet:foo', fetch)
+    assert not os.path.exists(coalescer._get_path('fleet:foo') + '.joined')
+    with patch('aws_ssh.ratelimit.time.time') as time_mock:
+        time_mock.return_value = 0 # Any shared result completed after this call began
+        assert coalescer.call('fleet:foo', lambda: 2) == (1, True)
+        assert coalescer.call('fleet:bar', lambda: 3) == (3, False)
+
+def test_coalescer_errors(coalescer):
+    def fail():
+        raise ValueError()
+    with pytest.raises(ValueError):
+        coalescer.call('fleet:foo', fail)
+    assert coalescer.call('fleet:foo', lambda: 1) == (1, False)
+
+@pytest.fixture
+def config_path(tmpdir):
+    with patch.dict(ratelimit._limits, clear=True), patch.dict(os.environ):
+        os.environ.pop(ratelimit.RATE_VARIABLE, None)
+        os.environ.pop(ratelimit.BURST_VARIABLE, None)
+        yield str(tmpdir.join('config.ini'))
+
+@pytest.fixture
+def get_limits(tmpdir):
+    return partial(ratelimit.get_limits, cache_dir=str(tmpdir.join('cache'))) # Keep snapshots out of the home dir
+
+def test_get_limits_default(config_path, get_limits):
+    assert get_limits(config_path) == (ratelimit.DEFAULT_RATE, ratelimit.DEFAULT_BURST)
+
+def test_get_limits_config(config_path, get_limits):
+    with open(config_path, 'w') as config:
+        config.write('[DEFAULT]\napi_rate = 2.5\napi_burst = 4\n')
+    assert get_limits(config_path) == (2.5, 4)
+    with patch('aws_ssh.ratelimit.read_config') as read_mock:
+        assert get_limits(config_path) == (2.5, 4)
+        assert not read_mock.called # Unchanged, so not read again
+
+def test_get_limits_invalid_config(config_path, get_limits):
+    with open(config_path, 'w') as config:
+        config.write('[DEFAULT]\napi_rate = 0\n')
+    assert get_limits(config_path) == (ratelimit.DEFAULT_RATE, ratelimit.DEFAULT_BURST)
+
+def test_get_limits_environment(config_path, get_limits):
+    with open(config_path, 'w') as config:
+        config.write('[DEFAULT]\napi_rate = 2.5\napi_burst = 4\n')
+    os.environ[ratelimit.RATE_VARIABLE] = '10'
+    assert get_limits(config_path) == (10, 4)
+    os.environ[ratelimit.BURST_VARIABLE] = 'many'
+    assert get_limits(config_path) == (10, 4)
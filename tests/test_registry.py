@@ -0,0 +1,43 @@
+"""Test the registry module"""
+# pylint: disable=redefined-outer-name,no-self-use,unused-argument,protected-access,missing-docstring,invalid-name,line-too-long
+from collections import namedtuple
+import os
+
+import pytest
+
+from aws_ssh.registry import Registry
+
+MockProject = namedtuple('MockProject', 'name root')
+
+@pytest.fixture
+def registry_path(tmpdir):
+    return os.path.join(str(tmpdir), 'registry.json')
+
+def test_get_missing(registry_path):
+    assert Registry(registry_path).get('foo') is None
+
+def test_update(registry_path):
+    Registry(registry_path).update(MockProject('foo', '/path/to/foo'))
+    assert Registry(registry_path).get('foo') == {'root': '/path/to/foo'}
+
+def test_update_unchanged(registry_path):
+    project = MockProject('foo', '/path/to/foo')
+    Registry(registry_path).update(project)
+    mtime = os.stat(registry_path).st_mtime
+    os.utime(registry_path, (mtime - 100, mtime - 100))
+    Registry(registry_path).update(project)
+    assert os.stat(registry_path).st_mtime == mtime - 100
+
+def test_update_keeps_concurrent_updates(registry_path):
+    first, second = Registry(registry_path), Registry(registry_path)
+    assert first.get('foo') is None and second.get('bar') is None # Both loaded before either writes
+    first.update(MockProject('foo', '/path/to/foo'))
+    second.update(MockProject('bar', '/path/to/bar'))
+    assert Registry(registry_path).projects == {'foo': {'root': '/path/to/foo'}, 'bar': {'root': '/path/to/bar'}}
+    assert second.get('foo') == {'root': '/path/to/foo'}
+
+def test_update_unwritable(tmpdir):
+    registry = Registry(os.path.join(str(tmpdir), 'missing', 'registry.json'))
+    tmpdir.join('missing').write('') # A file where the directory should be
+    registry.update(MockProject('foo', '/path/to/foo'))
+    assert registry.get('foo') == {'root': '/path/to/foo'}
@@ -0,0 +1,63 @@
+"""Test the routing module"""
+# pylint: disable=redefined-outer-name,no-self-use,unused-argument,protected-access,missing-docstring,invalid-name,line-too-long
+import socket
+try:
+    from unittest.mock import patch, mock_open
+except ImportError:
+    from mock import patch, mock_open
+
+import pytest
+
+from aws_ssh import routing
+
+PROC_NET_ROUTE = """Iface\tDestination\tGateway \tFlags\tRefCnt\tUse\tMetric\tMask\t\tMTU\tWindow\tIRTT
+eth0\t00000000\t0101A8C0\t0003\t0\t0\t100\t00000000\t0\t0\t0
+eth0\t0001A8C0\t00000000\t0001\t0\t0\t100\t00FFFFFF\t0\t0\t0
+"""
+
+def test_get_addresses():
+    resource = {'PublicIpAddress': '52.0.0.1', 'PrivateIpAddress': '10.0.0.1',
+                'NetworkInterfaces': [{'Ipv6Addresses': [{'Ipv6Address': '2600::1'}]}]}
+    assert list(routing.get_addresses(resource).items()) == [('public', '52.0.0.1'), ('private', '10.0.0.1'),
+                                                             ('ipv6', '2600::1')]
+
+def test_get_addresses_private_only():
+    assert list(routing.get_addresses({'PrivateIpAddress': '10.0.0.1'}).items()) == [('private', '10.0.0.1')]
+
+@pytest.mark.parametrize('bastion,expected', [
+    ('bastion.example.com', ('bastion.example.com', 22)),
+    ('jump@bastion.example.com:2222', ('bastion.example.com', 2222)),
+    ('[2600::1]:2222', ('2600::1', 2222)),
+    ('2600::1', ('2600::1', 22)),
+])
+def test_split_bastion(bastion, expected):
+    assert routing.split_bastion(bastion) == expected
+
+def test_measure_latency():
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+    port = server.getsockname()[1]
+    assert routing.measure_latency('127.0.0.1', port) >= 0
+    server.close()
+    assert routing.measure_latency('127.0.0.1', port) is None
+
+@pytest.mark.parametrize('latencies,bastion,expected', [
+    ({'52.0.0.1': 0.2, '10.0.0.1': 0.01}, None, 'private'),
+    ({'52.0.0.1': 0.2, '10.0.0.1': None}, None, 'public'),
+    ({'52.0.0.1': None, '10.0.0.1': None, 'bastion': 0.05}, 'bastion', 'bastion'),
+    ({'52.0.0.1': 0.3, '10.0.0.1': None, 'bastion': 0.05}, 'bastion', 'public'),
+    ({'52.0.0.1': None, '10.0.0.1': None}, None, None),
+])
+def test_choose_route(latencies, bastion, expected):
+    with patch('aws_ssh.routing.measure_latency', side_effect=lambda host, port, timeout: latencies[host]):
+        assert routing.choose_route({'public': '52.0.0.1', 'private': '10.0.0.1'}, bastion) == expected
+
+def test_get_network_id_gateway():
+    with patch('aws_ssh.routing.open', mock_open(read_data=PROC_NET_ROUTE), create=True):
+        assert routing.get_network_id() == 'eth0/192.168.1.1'
+
+def test_get_network_id_fallback():
+    with patch('aws_ssh.routing.open', side_effect=IOError(), create=True), \
+            patch('aws_ssh.routing._get_local_address', return_value='10.1.2.3'):
+        assert routing.get_network_id() == '10.1.2.3'
@@ -0,0 +1,111 @@
+"""Test the sshconfig module"""
+# pylint: disable=redefined-outer-name,no-self-use,unused-argument,protected-access,missing-docstring,invalid-name,line-too-long
+import json
+import os
+try:
+    from unittest.mock import MagicMock
+except ImportError:
+    from mock import MagicMock
+
+import pytest
+
+from aws_ssh import sshconfig
+from aws_ssh.errors import NoConfigError
+from test_aws import SAMPLE_INSTANCE_BODY # pylint: disable=import-error
+
+def make_project(name, prefix, fleet, usernames=None):
+    project = MagicMock()
+    project.name = name
+    project.prefix = prefix
+    project.key_path = '/path/to/{}.pem'.format(name)
+    project.get_fleet.return_value = fleet
+    usernames = usernames or {}
+    def get_instance_config(instance_name):
+        if instance_name not in usernames:
+            raise NoConfigError(instance_name)
+        return {'username': usernames[instance_name]}
+    project.get_instance_config.side_effect = get_instance_config
+    return project
+
+def resource(ip, image_id='ami-unknown'):
+    return dict(json.loads(SAMPLE_INSTANCE_BODY), PublicIpAddress=ip, ImageId=image_id)
+
+@pytest.fixture
+def environment():
+    environment = MagicMock()
+    environment.image_cache.get.return_value = {'Name': 'my-custom-image'}
+    environment.image_usernames = []
+    environment.control_options = {'ControlMaster': 'auto'}
+    return environment
+
+@pytest.fixture
+def config_path(tmpdir):
+    return os.path.join(str(tmpdir), 'ssh_config')
+
+def test_render_host():
+    block = sshconfig.render_host('foo-web', 'foo', '0.0.0.0', '/path/to/foo.pem', 'ubuntu')
+    assert block.splitlines() == ['Host foo-web', '    # aws-ssh project: foo', '    HostName 0.0.0.0', '    User ubuntu',
+                                  '    IdentityFile /path/to/foo.pem', '    IdentitiesOnly yes']
+    assert 'User' not in sshconfig.render_host('foo-web', 'foo', '0.0.0.0', '/path/to/foo.pem')
+    block = sshconfig.render_host('foo-web', 'foo', '0.0.0.0', '/path/to/foo.pem', options={'ControlMaster': 'auto'})
+    assert block.splitlines()[-1] == '    ControlMaster auto'
+
+def test_parse_config():
+    blocks = sshconfig.parse_config(sshconfig.HEADER + '\n' + sshconfig.render_host('a', 'foo', '0.0.0.0', 'k') + '\n' + sshconfig.render_host('b', 'bar', '0.0.0.1', 'k'))
+    assert list(blocks.keys()) == ['a', 'b']
+    assert sshconfig.get_block_project(blocks['a']) == 'foo'
+    assert sshconfig.get_block_project(blocks['b']) == 'bar'
+
+def test_export(environment, config_path):
+    project = make_project('foo', 'foo-', {'web': [resource('0.0.0.1')], 'data': [resource('0.0.0.2')],
+                                           'dupe': [resource('0.0.0.3'), resource('0.0.0.4')]},
+                           usernames={'foo-web': 'ubuntu'})
+    project._environment = environment
+    environment.get_projects.return_value = [project]
+    assert sshconfig.export(environment, config_path) == (2, 0, 0)
+    with open(config_path) as configfile:
+        blocks = sshconfig.parse_config(configfile.read())
+    assert list(blocks.keys()) == ['foo-data', 'foo-web']
+    assert '    User ubuntu\n' in blocks['foo-web']
+    assert 'User' not in blocks['foo-data']
+    assert '    ControlMaster auto\n' in blocks['foo-web']
+
+def test_export_bastion(environment, config_path):
+    project = make_project('foo', 'foo-', {'web': [dict(resource('0.0.0.1'), PrivateIpAddress='10.0.0.1')]})
+    project._environment = environment
+    project.get_instance_config.side_effect = lambda name: {'username': 'ubuntu', 'route': 'bastion',
+                                                            'bastion': 'jump@bastion.example.com'}
+    environment.get_projects.return_value = [project]
+    sshconfig.export(environment, config_path)
+    with open(config_path) as configfile:
+        block = sshconfig.parse_config(configfile.read())['foo-web']
+    assert '    HostName 10.0.0.1\n' in block
+    assert '    ProxyJump jump@bastion.example.com\n' in block
+
+def test_export_incremental(environment, config_path):
+    project = make_project('foo', 'foo-', {'web': [resource('0.0.0.1')], 'data': [resource('0.0.0.2')]})
+    project._environment = environment
+    environment.get_projects.return_value = [project]
+    sshconfig.export(environment, config_path)
+    mtime = os.stat(config_path).st_mtime
+    os.utime(config_path, (mtime - 100, mtime - 100))
+    assert sshconfig.export(environment, config_path) == (0, 0, 0)
+    assert os.stat(config_path).st_mtime == mtime - 100 # Untouched
+    project.get_fleet.return_value = {'web': [resource('0.0.0.9')], 'compute': [resource('0.0.0.3')]}
+    assert sshconfig.export(environment, config_path) == (1, 1, 1)
+    with open(config_path) as configfile:
+        blocks = sshconfig.parse_config(configfile.read())
+    assert sorted(blocks.keys()) == ['foo-compute', 'foo-web']
+    assert 'HostName 0.0.0.9' in blocks['foo-web']
+
+def test_export_keeps_failed_projects(environment, config_path):
+    foo = make_project('foo', 'foo-', {'web': [resource('0.0.0.1')]})
+    bar = make_project('bar', 'bar-', {'web': [resource('0.0.0.2')]})
+    foo._environment = bar._environment = environment
+    environment.get_projects.return_value = [foo, bar]
+    sshconfig.export(environment, config_path)
+    bar.get_fleet.side_effect = Exception('Throttled')
+    foo.get_fleet.return_value = {}
+    assert sshconfig.export(environment, config_path) == (0, 0, 1)
+    with open(config_path) as configfile:
+        assert list(sshconfig.parse_config(configfile.read()).keys()) == ['bar-web']
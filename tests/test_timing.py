@@ -0,0 +1,116 @@
+# pylint: disable=redefined-outer-name,no-self-use,unused-argument,protected-access,missing-docstring
+import json
+import os.path
+import threading
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+import pytest
+import six
+
+from aws_ssh import timing
+
+@pytest.fixture(autouse=True)
+def clean_spans():
+    timing.reset()
+    with patch.dict(timing._settings, {'table': False}):
+        yield
+    timing.reset()
+
+def test_span():
+    with timing.span('outer'):
+        with timing.span('inner'):
+            pass
+        with timing.span('sibling'):
+            pass
+    spans = timing.get_spans()
+    assert [(name, depth) for name, depth, _, _ in spans] == [('outer', 0), ('inner', 1), ('sibling', 1)]
+    assert spans[0][3] >= spans[1][3] + spans[2][3]
+
+def test_span_exception():
+    with pytest.raises(ValueError):
+        with timing.span('failing'):
+            raise ValueError()
+    with timing.span('next'):
+        pass
+    assert [(name, depth) for name, depth, _, _ in timing.get_spans()] == [('failing', 0), ('next', 0)]
+
+def test_span_threads():
+    started = threading.Event()
+    finished = threading.Event()
+
+    def work():
+        with timing.span('thread'):
+            started.set()
+            finished.wait()
+
+    thread = threading.Thread(target=work)
+    thread.start()
+    started.wait()
+    with timing.span('main'):
+        pass
+    finished.set()
+    thread.join()
+    assert sorted((name, depth) for name, depth, _, _ in timing.get_spans()) == [('main', 0), ('thread', 0)]
+
+def test_timed():
+    @timing.timed('double')
+    def double(value):
+        """Double a value"""
+        return value * 2
+    assert double(21) == 42
+    assert double.__name__ == 'double'
+    assert [name for name, _, _, _ in timing.get_spans()] == ['double']
+
+def test_record():
+    timing.record('import', 1.0, 1.25)
+    assert timing.get_spans() == [('import', 0, 1.0, 0.25)]
+
+def test_max_spans():
+    for _ in range(timing.MAX_SPANS + 10):
+        timing.record('span', 1.0, 2.0)
+    assert len(timing.get_spans()) == timing.MAX_SPANS
+
+def test_format_table():
+    lines = timing.format_table([('get_ssh_args', 0, 1.0, 0.5), ('aws.get_fleet', 1, 1.1, 0.25)])
+    assert lines == ['SPAN                    MS',
+                     'get_ssh_args         500.0',
+                     '  aws.get_fleet      250.0']
+
+def test_report_disabled(tmpdir):
+    out = six.StringIO()
+    with patch.dict(os.environ, clear=True):
+        timing.record('import', 1.0, 2.0)
+        timing.report(out)
+    assert out.getvalue() == ''
+
+def test_report_table():
+    out = six.StringIO()
+    timing.show_table()
+    with patch.dict(os.environ, clear=True):
+        timing.record('import', 1.0, 2.0)
+        timing.report(out)
+    assert out.getvalue() == 'SPAN           MS\nimport     1000.0\n'
+
+def test_report_file(tmpdir):
+    path = os.path.join(str(tmpdir), 'timings.jsonl')
+    out = six.StringIO()
+    with patch.dict(os.environ, {timing.TIMINGS_FILE_ENV: path}):
+        timing.record('import', 1.0, 2.0)
+        timing.report(out, version='1.0')
+        timing.report(out, version='1.0')
+    assert out.getvalue() == ''
+    with open(path) as timingsfile:
+        records = [json.loads(line) for line in timingsfile]
+    assert len(records) == 2
+    assert records[0]['spans'] == [{'name': 'import', 'depth': 0, 'ms': 1000.0}]
+    assert records[0]['version'] == '1.0'
+    assert 'host' in records[0] and 'time' in records[0]
+
+def test_report_file_unwritable(tmpdir):
+    out = six.StringIO()
+    with patch.dict(os.environ, {timing.TIMINGS_FILE_ENV: str(tmpdir)}):
+        timing.report(out)
+    assert out.getvalue().startswith('Unable to write timings')